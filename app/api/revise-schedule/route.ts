@@ -1,7 +1,9 @@
 // app/api/revise-schedule/route.ts
 import { NextRequest, NextResponse } from 'next/server';
 import { getAuthenticatedUserId } from '@/lib/auth';
+import { runViaDaemon } from '@/lib/schedulerDaemon';
 import { spawn } from 'child_process';
+import { randomUUID } from 'crypto';
 
 // Increase the timeout for this route (in seconds)
 export const maxDuration = 60;
@@ -32,33 +34,99 @@ export async function POST(req: NextRequest) {
       console.log('[revise] Using Railway scheduler at:', SCHEDULER_URL);
       console.log('[revise] Date:', todayIso, 'User:', userId);
 
-      // Call the Railway scheduler service
-      const response = await fetch(`${SCHEDULER_URL}/run-scheduler`, {
+      // Queue the run on the Railway scheduler service; it answers at once with a job id.
+      // The Idempotency-Key (the client's, or one per request) makes a retry return the
+      // same job instead of starting another delete-and-rewrite of the day.
+      const idempotencyKey = req.headers.get('Idempotency-Key') || randomUUID();
+      const queueRun = () => fetch(`${SCHEDULER_URL}/run-scheduler`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey,
         },
         body: JSON.stringify({
           date: todayIso,
           user_id: userId,
         }),
       });
+      let response: Response;
+      try {
+        response = await queueRun();
+      } catch (err) {
+        console.warn('[revise] Queue request failed, retrying once with the same key:', err);
+        response = await queueRun();
+      }
+
+      const queued = await response.json();
+      console.log('[revise] Queued:', queued);
+
+      if (!response.ok || !queued.ok) {
+        // 429: the scheduler is saturated; pass its Retry-After on so the client backs off
+        const retryAfter = response.headers.get('Retry-After');
+        return NextResponse.json(
+          { ok: false, error: queued.error || 'Scheduler failed', retryAfter: queued.retry_after },
+          { status: response.status, headers: retryAfter ? { 'Retry-After': retryAfter } : undefined }
+        );
+      }
+
+      // Callers that accept server-sent events get the run's stage events as they happen
+      // (status, stage..., end) instead of waiting for the final answer
+      if (req.headers.get('Accept')?.includes('text/event-stream')) {
+        const events = await fetch(`${SCHEDULER_URL}/jobs/${queued.job_id}/events`, {
+          cache: 'no-store',
+          headers: { Accept: 'text/event-stream' },
+        });
+        if (events.ok && events.body) {
+          return new Response(events.body, {
+            headers: {
+              'Content-Type': 'text/event-stream',
+              'Cache-Control': 'no-cache',
+              'X-Job-Id': queued.job_id,
+            },
+          });
+        }
+        console.warn('[revise] Event stream unavailable (status', events.status, '); polling instead');
+      }
+
+      // Poll the job until it finishes, leaving headroom under maxDuration
+      const deadline = startTime + (maxDuration - 5) * 1000;
+      let job = queued;
+      while (job.status === 'queued' || job.status === 'running') {
+        if (Date.now() >= deadline) break;
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const poll = await fetch(`${SCHEDULER_URL}/jobs/${queued.job_id}`, { cache: 'no-store' });
+        if (!poll.ok) {
+          const data = await poll.json().catch(() => ({}));
+          return NextResponse.json(
+            { ok: false, error: data.error || `Job status failed (${poll.status})` },
+            { status: poll.status }
+          );
+        }
+        job = await poll.json();
+      }
 
-      const data = await response.json();
       const elapsed = Date.now() - startTime;
-      
-      console.log('[revise] Response:', data, `(elapsed ${elapsed}ms)`);
-      
-      if (!response.ok || !data.ok) {
+      console.log('[revise] Job:', job, `(elapsed ${elapsed}ms)`);
+
+      if (job.status === 'queued' || job.status === 'running') {
+        // Still going: the schedule will update when it finishes
+        return NextResponse.json(
+          { ok: true, pending: true, jobId: queued.job_id, message: 'Scheduler is still running', elapsedMs: elapsed },
+          { status: 202 }
+        );
+      }
+
+      if (job.status !== 'succeeded') {
         return NextResponse.json(
-          { ok: false, error: data.error || 'Scheduler failed' },
-          { status: response.status }
+          { ok: false, error: job.error || 'Scheduler failed', jobId: queued.job_id },
+          { status: 500 }
         );
       }
 
       return NextResponse.json({ 
         ok: true, 
-        message: data.message,
+        message: job.result?.message,
+        jobId: queued.job_id,
         elapsedMs: elapsed 
       });
     }
@@ -90,6 +158,28 @@ export async function POST(req: NextRequest) {
     // Build args for: python -m dayflow.scheduler_main --date YYYY-MM-DD --user USER_ID --force
     const args = ['-m', 'dayflow.scheduler_main', '--date', todayIso, '--user', userId, '--force'];
 
+    // Optional timeout (ms)
+    const timeoutMs = 120000; // 2 minutes
+
+    // Use the warm local daemon (python -m dayflow.daemon) when it's running
+    const warm = await runViaDaemon(args.slice(2), timeoutMs);
+    if (warm) {
+      const elapsed = Date.now() - startTime;
+      console.log('[revise] Daemon exit code:', warm.rc, `(elapsed ${elapsed}ms)`);
+      if (warm.rc !== 0) {
+        console.error('[revise] output:', warm.output);
+        return NextResponse.json(
+          { ok: false, error: 'Scheduler failed', exitCode: warm.rc, stderr: warm.output.split('\n').slice(-20).join('\n') },
+          { status: 500 }
+        );
+      }
+      return NextResponse.json({
+        ok: true,
+        message: `Scheduler completed for ${todayIso}`,
+        elapsedMs: elapsed
+      });
+    }
+
     console.log('[revise] Spawning:', pythonExe, args.join(' '));
 
     // Spawn the Python scheduler with inherited server env (includes service key)
@@ -110,8 +200,6 @@ export async function POST(req: NextRequest) {
       stderr += d.toString();
     });
 
-    // Optional timeout (ms)
-    const timeoutMs = 120000; // 2 minutes
     const timer = setTimeout(() => {
       try {
         child.kill('SIGTERM');
@@ -2,6 +2,7 @@
 import { NextResponse } from "next/server";
 import { spawn } from "child_process";
 import { getAuthenticatedUserId } from "@/lib/auth";
+import { runViaDaemon } from "@/lib/schedulerDaemon";
 
 function formatDateYYYYMMDD(d: Date): string {
   const y = d.getFullYear();
@@ -58,6 +59,32 @@ export async function POST(req: Request) {
     args.push("--write");
     }
 
+    // Optional timeout (ms)
+    const timeoutMs = 120000; // 2 minutes
+
+    // Use the warm local daemon (python -m dayflow.daemon) when it's running: no interpreter
+    // start, imports or client setup per run
+    const warm = await runViaDaemon(args.slice(2), timeoutMs);
+    if (warm) {
+      const ok = warm.rc === 0;
+      console.log('[scheduler/run] Daemon exit code:', warm.rc, `(${warm.elapsedMs}ms)`);
+      if (!ok) {
+        console.error('[scheduler/run] output:', warm.output);
+      }
+      return NextResponse.json({
+        ok,
+        exitCode: warm.rc,
+        stdoutTail: warm.output.split("\n").slice(-50).join("\n"),
+        stderrTail: "",
+        ran: {
+          daemon: true,
+          args: args.slice(2),
+          date,
+          force,
+        },
+      }, { status: ok ? 200 : 500 });
+    }
+
     console.log('[scheduler/run] Spawning:', pythonExe, args.join(' '));
 
     // Spawn the Python scheduler with inherited server env (includes service key)
@@ -78,8 +105,6 @@ export async function POST(req: Request) {
       stderr += d.toString();
     });
 
-    // Optional timeout (ms)
-    const timeoutMs = 120000; // 2 minutes
     const timer = setTimeout(() => {
       try {
         child.kill("SIGTERM");
@@ -0,0 +1,268 @@
+# dayflow/batch.py
+"""
+All-users batch mode: plan every active user's day in one job.
+
+    python -m dayflow.scheduler_main --all-users --force [--concurrency 8] [--user-timeout 120]
+
+Active users are the distinct user_ids with at least one live template. They are
+read with a skip scan, one indexed `user_id > last ORDER BY user_id LIMIT 1`
+query per user (idx_task_templates_user_active), so enumeration doesn't read
+every template.
+
+Users are fanned out over a pool of worker processes. Each worker imports the
+planner and opens its own store once, then runs users one after another with
+scheduler_main.run_for_user. Every user is isolated from the others:
+  - each run starts with a fresh transport deadline and error count on the
+    shared store (transport.start_run), so one user's failed reads don't
+    abort the users after them
+  - an exception in one user's run is caught in the worker and reported for
+    that user, and the worker moves on
+  - a user still running after --user-timeout has its worker killed and
+    replaced, and is reported as timed out
+  - a worker that dies (segfault, OOM kill) is replaced the same way
+The job as a whole is bounded by DAYFLOW_BATCH_DEADLINE_S. Users that haven't
+started by then are skipped and reported, so the 07:00 run ends on time however
+big the tenant base gets or however slow the API is that morning.
+
+The summary at the end has counts, latency percentiles, tasks placed and each
+failed user's error. The exit code is 1 if any user failed, timed out or was
+skipped.
+
+Workers are started with "spawn" everywhere (no fork): a forked child would
+inherit the parent's open HTTP connections and any background threads.
+
+Config (env, all optional):
+  DAYFLOW_BATCH_WORKERS          worker processes (default: CPU count, max 8)
+  DAYFLOW_BATCH_USER_TIMEOUT_S   per-user time limit (default 120)
+  DAYFLOW_BATCH_DEADLINE_S       start no user after this many seconds (default 3000)
+"""
+import os
+import time
+import dataclasses
+import logging
+import traceback
+import multiprocessing as mp
+from collections import deque
+from datetime import date
+from multiprocessing.connection import wait
+from typing import Any, Dict, List, Optional
+
+from dayflow.store import Store
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def default_workers() -> int:
+    return max(1, int(_env_float("DAYFLOW_BATCH_WORKERS", min(8, os.cpu_count() or 1))))
+
+
+def active_user_ids(store: Store) -> List[str]:
+    """Distinct user_ids with at least one non-deleted template, in id order (skip scan)."""
+    users: List[str] = []
+    last: Optional[str] = None
+    while True:
+        filters = [("eq", "is_deleted", False)]
+        if last is not None:
+            filters.append(("gt", "user_id", last))
+        rows = store.select("task_templates", "user_id", filters=filters, order=[("user_id", False)], limit=1)
+        if not rows or rows[0].get("user_id") is None:
+            return users
+        last = str(rows[0]["user_id"])
+        users.append(last)
+
+
+# ----------------------------------------
+# Worker process
+# ----------------------------------------
+def _worker(conn, backend: str, run_date: date, tz_name: str, options: Dict[str, Any]) -> None:
+    """Open one store, then run users sent over `conn` until told to stop (None)."""
+    logging.basicConfig(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO"), logging.INFO),
+        format="%(asctime)s %(processName)s %(levelname)s %(message)s",
+    )
+    init_error = None
+    store = None
+    try:
+        from dayflow import scheduler_main
+        from dayflow.client_pool import ClientPool
+
+        client = ClientPool().get() if backend == "postgrest" else None
+        store = scheduler_main.open_store(client, backend=backend)
+        run_options = scheduler_main.RunOptions(**options)
+        if store is None:
+            init_error = "no Supabase client (SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY not set)"
+    except Exception as e:
+        init_error = f"worker init failed: {e}"
+        logging.exception("batch worker init failed")
+    conn.send({"ready": True})
+
+    while True:
+        try:
+            user_id = conn.recv()
+        except EOFError:
+            return
+        if user_id is None:
+            return
+        t0 = time.monotonic()
+        result: Dict[str, Any] = {"user_id": user_id, "rc": 1, "placed": None, "error": init_error}
+        if init_error is None:
+            stats: Dict[str, Any] = {}
+            try:
+                result["rc"] = scheduler_main.run_for_user(user_id, run_date, tz_name, run_options, store, stats=stats)
+                result["placed"] = stats.get("placed")
+                if result["rc"]:
+                    result["error"] = f"exit status {result['rc']}"
+            except Exception as e:
+                logging.exception("batch: user %s failed", user_id)
+                result["error"] = f"{e.__class__.__name__}: {e}"
+                result["traceback"] = traceback.format_exc(limit=5)
+        result["elapsed_s"] = round(time.monotonic() - t0, 3)
+        conn.send(result)
+
+
+class _Worker:
+    def __init__(self, ctx, n: int, args: tuple):
+        self.parent, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker, args=(child, *args), name=f"batch-{n}", daemon=True)
+        self.proc.start()
+        child.close()
+        self.ready = False
+        self.user: Optional[str] = None
+        self.started = 0.0
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.proc.terminate()
+            self.proc.join(2)
+            if self.proc.is_alive():
+                self.proc.kill()
+        else:
+            try:
+                self.parent.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.proc.join(5)
+        self.parent.close()
+
+
+# ----------------------------------------
+# Pool
+# ----------------------------------------
+def run_all(
+    users: List[str],
+    run_date: date,
+    tz_name: str,
+    options: Any,
+    *,
+    backend: str = "postgrest",
+    workers: Optional[int] = None,
+    user_timeout: Optional[float] = None,
+    deadline: Optional[float] = None,
+) -> List[Dict]:
+    """Run every user on a pool of worker processes; one result dict per user (see summarize)."""
+    if not users:
+        return []
+    workers = max(1, min(workers or default_workers(), len(users) or 1))
+    user_timeout = user_timeout or _env_float("DAYFLOW_BATCH_USER_TIMEOUT_S", 120.0)
+    deadline = deadline if deadline is not None else _env_float("DAYFLOW_BATCH_DEADLINE_S", 3000.0)
+    ctx = mp.get_context("spawn")
+    args = (backend, run_date, tz_name, dataclasses.asdict(options))
+    t_start = time.monotonic()
+
+    pending = deque(users)
+    results: List[Dict] = []
+    pool = [_Worker(ctx, i, args) for i in range(workers)]
+    next_id = workers
+    logging.info("batch: %d user(s) for %s on %d worker(s), %.0fs per user", len(users), run_date, workers, user_timeout)
+
+    def replace(w: _Worker) -> None:
+        nonlocal next_id
+        w.stop(kill=True)
+        pool[pool.index(w)] = _Worker(ctx, next_id, args)
+        next_id += 1
+
+    try:
+        while pending or any(w.user for w in pool):
+            now = time.monotonic()
+            if pending and deadline and now - t_start > deadline:
+                logging.warning("batch: deadline of %.0fs reached; skipping %d user(s)", deadline, len(pending))
+                results.extend({"user_id": u, "rc": None, "placed": None, "error": "skipped (batch deadline)",
+                                "elapsed_s": None, "skipped": True} for u in pending)
+                pending.clear()
+            for w in pool:
+                if w.ready and w.user is None and pending:
+                    w.user, w.started = pending.popleft(), time.monotonic()
+                    w.parent.send(w.user)
+
+            busy = [w.started + user_timeout for w in pool if w.user]
+            timeout = max(0.0, min(busy) - time.monotonic()) if busy else 1.0
+            for conn in wait([w.parent for w in pool], timeout=timeout):
+                w = next(w for w in pool if w.parent is conn)
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    code = w.proc.exitcode
+                    if w.user:
+                        results.append({"user_id": w.user, "rc": None, "placed": None,
+                                        "error": f"worker died (exit code {code})",
+                                        "elapsed_s": round(time.monotonic() - w.started, 3)})
+                    logging.error("batch: worker %s died (exit code %s) running %s", w.proc.name, code, w.user)
+                    replace(w)
+                    continue
+                if msg.get("ready"):
+                    w.ready = True
+                    continue
+                results.append(msg)
+                w.user = None
+
+            now = time.monotonic()
+            for w in list(pool):
+                if w.user and now - w.started > user_timeout:
+                    logging.error("batch: user %s timed out after %gs; restarting %s", w.user, user_timeout, w.proc.name)
+                    results.append({"user_id": w.user, "rc": None, "placed": None,
+                                    "error": f"timed out after {user_timeout:g}s", "elapsed_s": round(now - w.started, 3),
+                                    "timed_out": True})
+                    replace(w)
+    finally:
+        for w in pool:
+            w.stop(kill=bool(w.user))
+    return results
+
+
+def summarize(results: List[Dict], wall_s: float) -> Dict[str, Any]:
+    """Counts, latency percentiles and total placed; `errors` lists each failed user."""
+    ok = [r for r in results if r.get("rc") == 0]
+    lat = sorted(r["elapsed_s"] for r in results if r.get("elapsed_s") is not None and not r.get("skipped"))
+
+    def pct(p: float) -> Optional[float]:
+        return lat[min(len(lat) - 1, int(p * len(lat)))] if lat else None
+
+    return {
+        "users": len(results),
+        "ok": len(ok),
+        "failed": sum(1 for r in results if r.get("rc") != 0 and not r.get("timed_out") and not r.get("skipped")),
+        "timed_out": sum(1 for r in results if r.get("timed_out")),
+        "skipped": sum(1 for r in results if r.get("skipped")),
+        "placed": sum(r.get("placed") or 0 for r in ok),
+        "latency_s": {"p50": pct(0.5), "p95": pct(0.95), "max": lat[-1] if lat else None},
+        "wall_s": round(wall_s, 1),
+        "errors": {r["user_id"]: r.get("error") for r in results if r.get("rc") != 0},
+    }
+
+
+def print_summary(results: List[Dict], wall_s: float) -> Dict[str, Any]:
+    s = summarize(results, wall_s)
+    print("\n[Batch summary]")
+    print(f"  users: {s['users']}  ok: {s['ok']}  failed: {s['failed']}  timed out: {s['timed_out']}  skipped: {s['skipped']}")
+    print(f"  tasks placed: {s['placed']}  wall: {s['wall_s']}s")
+    lat = s["latency_s"]
+    print(f"  per-user latency: p50 {lat['p50']}s  p95 {lat['p95']}s  max {lat['max']}s")
+    for r in sorted(results, key=lambda r: r["user_id"]):
+        status = "ok" if r.get("rc") == 0 else r.get("error")
+        print(f"    {r['user_id']}  {r.get('elapsed_s')}s  placed={r.get('placed')}  {status}")
+    return s
@@ -0,0 +1,212 @@
+# dayflow/client_pool.py
+"""
+Long-lived Supabase clients for the scheduler server.
+
+Each scheduler run used to call create_client() itself, paying for a fresh
+HTTP session (TCP + TLS handshake) on every POST and throwing it away after.
+ClientPool owns the client(s) for the lifetime of the process instead:
+
+  - one shared client, or one per worker thread (DAYFLOW_CLIENT_PER_THREAD=1)
+  - a pooled httpx transport with keep-alive, HTTP/2 when `h2` is installed
+  - counters for requests vs. new connections, so the reuse rate is visible;
+    a request counts as reused only when its headers went out on a connection
+    it didn't open, so refused or failed connects never look like reuse
+
+Config (env, all optional):
+  DAYFLOW_HTTP_POOL_SIZE       max connections per client (default 10)
+  DAYFLOW_HTTP_KEEPALIVE_S     idle keep-alive expiry in seconds (default 60)
+  DAYFLOW_HTTP2                1/0 to force HTTP/2 on/off (default: on if h2 present)
+  DAYFLOW_HTTP_TIMEOUT_S       per-request timeout in seconds (default 30)
+  DAYFLOW_CLIENT_PER_THREAD    1 to give every worker thread its own client
+"""
+import os
+import logging
+import threading
+from typing import Any, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None or raw == "":
+        return default
+    return str(raw).lower() in ("1", "true", "yes", "on")
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+class ClientPool:
+    """
+    Owns long-lived Supabase client(s) plus the pooled HTTP session under them.
+    Call get() wherever a run needs a client; never call create_client() per run.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        key: Optional[str] = None,
+        *,
+        pool_size: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+        timeout: Optional[float] = None,
+        per_thread: Optional[bool] = None,
+    ):
+        self.url = url or os.getenv("SUPABASE_URL")
+        self.key = key or os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
+        self.pool_size = pool_size or _env_int("DAYFLOW_HTTP_POOL_SIZE", 10)
+        self.keepalive_expiry = keepalive_expiry or _env_float("DAYFLOW_HTTP_KEEPALIVE_S", 60.0)
+        self.timeout = timeout or _env_float("DAYFLOW_HTTP_TIMEOUT_S", 30.0)
+        want_http2 = _env_flag("DAYFLOW_HTTP2", True) if http2 is None else http2
+        self.http2 = bool(want_http2 and _h2_available())
+        self.per_thread = _env_flag("DAYFLOW_CLIENT_PER_THREAD", False) if per_thread is None else per_thread
+
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._local = threading.local()
+        self._shared: Optional[Any] = None
+        self._http_clients: list = []
+
+        # metrics (guarded by _lock)
+        self._clients_created = 0
+        self._requests = 0
+        self._requests_sent = 0
+        self._connections_opened = 0
+        self._connections_reused = 0
+
+    # -----------------------
+    # httpx plumbing
+    # -----------------------
+    def _tracer(self):
+        """httpcore trace callback for one request."""
+        connected = False
+
+        def trace(event_name: str, info: dict) -> None:
+            nonlocal connected
+            if event_name == "connection.connect_tcp.complete":
+                connected = True
+                with self._lock:
+                    self._connections_opened += 1
+            elif event_name in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+                # Headers going out without a connect in this request: a pooled connection
+                with self._lock:
+                    self._requests_sent += 1
+                    if not connected:
+                        self._connections_reused += 1
+
+        return trace
+
+    def _on_request(self, request) -> None:
+        with self._lock:
+            self._requests += 1
+        request.extensions["trace"] = self._tracer()
+
+    def _build_http_client(self):
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        return httpx.Client(
+            http2=self.http2,
+            limits=limits,
+            timeout=self.timeout,
+            follow_redirects=True,
+            event_hooks={"request": [self._on_request]},
+        )
+
+    def _create(self):
+        from supabase import create_client  # type: ignore
+
+        if not self.url or not self.key:
+            raise RuntimeError("ClientPool: SUPABASE_URL and a service key are required")
+
+        http = self._build_http_client()
+        try:
+            from supabase import ClientOptions  # type: ignore
+            client = create_client(self.url, self.key, options=ClientOptions(httpx_client=http))
+        except TypeError:
+            # Older supabase-py without httpx_client support: still long-lived, just not instrumented
+            http.close()
+            http = None
+            logging.warning("ClientPool: supabase-py too old for httpx_client; using its default session")
+            client = create_client(self.url, self.key)
+
+        with self._lock:
+            self._clients_created += 1
+            if http is not None:
+                self._http_clients.append(http)
+        logging.info(
+            "ClientPool: created Supabase client (pool_size=%d, keepalive=%ss, http2=%s, per_thread=%s)",
+            self.pool_size, self.keepalive_expiry, self.http2, self.per_thread,
+        )
+        return client
+
+    # -----------------------
+    # Public API
+    # -----------------------
+    def get(self):
+        """Return the long-lived client for the calling thread (created on first use)."""
+        if self.per_thread:
+            client = getattr(self._local, "client", None)
+            if client is None:
+                client = self._create()
+                self._local.client = client
+            return client
+
+        if self._shared is None:
+            with self._create_lock:
+                if self._shared is None:
+                    self._shared = self._create()
+        return self._shared
+
+    def metrics(self) -> dict:
+        with self._lock:
+            requests = self._requests
+            sent = self._requests_sent
+            opened = self._connections_opened
+            reused = self._connections_reused
+            return {
+                "pool_size": self.pool_size,
+                "keepalive_expiry_s": self.keepalive_expiry,
+                "http2": self.http2,
+                "per_thread": self.per_thread,
+                "clients_created": self._clients_created,
+                "requests": requests,
+                "requests_sent": sent,
+                "connections_opened": opened,
+                "connections_reused": reused,
+                "connection_reuse_rate": round(reused / sent, 4) if sent else None,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._http_clients = self._http_clients, []
+            self._shared = None
+        self._local = threading.local()
+        for http in clients:
+            try:
+                http.close()
+            except Exception:
+                logging.exception("ClientPool: failed closing http client")
@@ -0,0 +1,280 @@
+# dayflow/columns.py
+"""
+Column projection registry for the planner's hot reads.
+
+The templates fetch, the old-schedule fetch, the unscheduled fetch in
+preprocess_recurring_tasks and step 3b in scheduler_main used to select("*"),
+pulling descriptions, notes and every other column only to ignore them.
+Each stage now declares the exact columns it reads, and queries are built from
+that declaration (intersected with the columns the table really has, so a
+declared-but-absent column never breaks a query).
+
+Every stage fetch records rows, columns, approximate payload bytes and wall time
+(request + JSON parse) so the saving is visible in logs and on /metrics.
+
+Checking the declarations: tests/test_columns.py runs a full run_for_user over
+seeded rows that carry undeclared columns. It fails if a stage reads a column its
+select didn't fetch, or if projection changes the instances or the written
+schedule. Against a real user's data:
+
+    python -m dayflow.columns --check --user <user_id> [--date YYYY-MM-DD]
+
+runs preprocess_recurring_tasks + schedule_day (compute only, no writes) once
+with projection and once with select("*"), and exits non-zero if any scheduling
+decision differs.
+
+Config (env, all optional):
+  DAYFLOW_COLUMN_PROJECTION   0 to fall back to select("*") everywhere (default 1)
+  DAYFLOW_COLUMNS_TTL_S       how long discovered table columns are cached (default 300)
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import argparse
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence
+
+# Columns the scheduler reads from an instance row (scheduled_tasks). Rows from the
+# old schedule, the unscheduled backlog and step 3b all end up in schedule_day, so
+# they share one declaration.
+SCHEDULE_ROW_COLUMNS = (
+    "id", "user_id", "template_id", "origin_template_id",
+    "title", "task", "kind",
+    "local_date", "date", "start_time", "end_time", "duration_minutes", "priority",
+    "repeat_unit", "repeat", "repeat_interval", "repeat_day",
+    "is_template", "is_completed", "is_deleted",
+    "is_appointment", "is_routine", "is_fixed", "is_floating",
+    "is_recurring", "is_aspiration",
+    "window_start_local", "window_end_local",
+)
+
+# Columns preprocess_recurring_tasks reads from task_templates.
+TEMPLATE_COLUMNS = (
+    "id", "user_id", "title", "task", "kind",
+    "repeat_unit", "repeat", "repeat_interval", "repeat_day", "repeat_days", "day_of_month",
+    "date", "start_time", "duration_minutes", "priority", "last_completed_date",
+    "is_template", "is_appointment", "is_routine", "is_fixed", "is_floating",
+    "window_start_local", "window_end_local", "timezone", "created_at",
+)
+
+# stage -> (table, declared columns)
+STAGES: Dict[str, tuple] = {
+    "templates": ("task_templates", TEMPLATE_COLUMNS),
+    "old_schedule": ("scheduled_tasks", SCHEDULE_ROW_COLUMNS),
+    "unscheduled": ("scheduled_tasks", SCHEDULE_ROW_COLUMNS),
+    "main_unscheduled": ("scheduled_tasks", SCHEDULE_ROW_COLUMNS),
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+_table_cache: Dict[tuple, tuple] = {}   # (backend, table) -> (expires_at, columns)
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def _projection_enabled() -> bool:
+    if getattr(_local, "disabled", False):
+        return False
+    return str(os.getenv("DAYFLOW_COLUMN_PROJECTION", "1")).lower() not in ("0", "false", "no", "off")
+
+
+def _ttl() -> float:
+    try:
+        return float(os.getenv("DAYFLOW_COLUMNS_TTL_S", 300))
+    except (TypeError, ValueError):
+        return 300.0
+
+
+@contextmanager
+def projection_disabled():
+    """Use select("*") for stage fetches on this thread (used by --check)."""
+    prev = getattr(_local, "disabled", False)
+    _local.disabled = True
+    try:
+        yield
+    finally:
+        _local.disabled = prev
+
+
+def table_columns(store: Any, table: str) -> set:
+    """Discovered columns of `table`, cached per backend for DAYFLOW_COLUMNS_TTL_S."""
+    key = (type(store).__name__, table)
+    now = time.monotonic()
+    with _lock:
+        hit = _table_cache.get(key)
+        if hit and hit[0] > now:
+            return set(hit[1])
+    cols = set(store.table_columns(table) or ())
+    if cols:
+        # don't cache "unknown" - an empty table may gain rows (and a probe result) later
+        with _lock:
+            _table_cache[key] = (now + _ttl(), frozenset(cols))
+    return cols
+
+
+def stage_columns(store: Any, stage: str) -> str:
+    """The select list for `stage`: declared ∩ discovered, or "*" if discovery has nothing."""
+    table, declared = STAGES[stage]
+    if not _projection_enabled():
+        return "*"
+    try:
+        available = table_columns(store, table)
+    except Exception as e:
+        logging.warning("columns[%s]: discovery failed (%s); using select *", stage, e)
+        return "*"
+    if not available:
+        return "*"
+    picked = [c for c in declared if c in available]
+    return ", ".join(picked) if picked else "*"
+
+
+def _record(stage: str, columns: str, rows: List[Dict], elapsed: float) -> None:
+    try:
+        nbytes = len(json.dumps(rows, default=str, separators=(",", ":")))
+    except Exception:
+        nbytes = 0
+    ncols = len(rows[0]) if rows else (0 if columns == "*" else len(columns.split(",")))
+    with _lock:
+        s = _stats.setdefault(stage, {"fetches": 0, "rows": 0, "bytes": 0, "seconds": 0.0})
+        s["fetches"] += 1
+        s["rows"] += len(rows)
+        s["bytes"] += nbytes
+        s["seconds"] += elapsed
+        s["last"] = {
+            "projected": columns != "*",
+            "rows": len(rows),
+            "columns": ncols,
+            "bytes": nbytes,
+            "ms": round(elapsed * 1000, 1),
+        }
+    logging.info(
+        "columns[%s]: %d row(s) x %d col(s), %.1f KB in %.0f ms%s",
+        stage, len(rows), ncols, nbytes / 1024, elapsed * 1000, "" if columns != "*" else " (select *)",
+    )
+
+
+def fetch(store: Any, stage: str, *, filters: Sequence = (), order: Optional[Sequence] = None) -> List[Dict]:
+    """Run a stage's read with its declared projection and record payload/timing stats."""
+    table = STAGES[stage][0]
+    columns = stage_columns(store, stage)
+    t0 = time.perf_counter()
+    rows = store.select(table, columns, filters=filters, order=order)
+    _record(stage, columns, rows, time.perf_counter() - t0)
+    return rows
+
+
+def metrics() -> Dict[str, Any]:
+    """Per-stage cumulative and last-fetch stats (rows, bytes, seconds)."""
+    with _lock:
+        out = {}
+        for stage, s in _stats.items():
+            out[stage] = dict(s, seconds=round(s["seconds"], 4), last=dict(s.get("last", {})))
+        return out
+
+
+def reset_metrics() -> None:
+    with _lock:
+        _stats.clear()
+
+
+# -----------------------
+# Declaration check
+# -----------------------
+_DECISION_KEYS = (
+    "template_id", "title", "local_date", "start_time", "end_time", "duration_minutes",
+    "priority", "is_appointment", "is_routine", "is_fixed",
+)
+
+
+def _decisions(instances: List[Dict], schedule) -> tuple:
+    def norm(v):
+        try:
+            import pandas as pd
+            if pd.isna(v):
+                return None
+        except (TypeError, ValueError):
+            pass
+        return str(v)
+
+    inst = sorted((tuple(norm(r.get(k)) for k in _DECISION_KEYS) for r in instances), key=repr)
+    rows = schedule.to_dict(orient="records") if hasattr(schedule, "to_dict") else list(schedule or [])
+    sched = sorted((tuple(norm(r.get(k)) for k in _DECISION_KEYS) for r in rows), key=repr)
+    return inst, sched
+
+
+def _run_once(store, user_id, run_date, day_start, day_end):
+    import pandas as pd
+    from dayflow.planner import preprocess_recurring_tasks, schedule_day
+
+    reset_metrics()
+    instances = preprocess_recurring_tasks(run_date=run_date, supabase=store, user_id=user_id)
+    schedule = schedule_day(pd.DataFrame(instances or []), day_start, day_end, supabase=None)
+    return _decisions(instances, schedule), metrics()
+
+
+def check(store: Any, user_id: str, run_date) -> int:
+    """Compare projected vs select("*") planning for one user/day. Returns 0 if identical."""
+    from datetime import datetime, time as dtime
+    from zoneinfo import ZoneInfo
+
+    tz = ZoneInfo(os.getenv("TZ", "Europe/London"))
+    day_start = datetime.combine(run_date, dtime(8, 0), tzinfo=tz)
+    day_end = datetime.combine(run_date, dtime(23, 0), tzinfo=tz)
+
+    projected, m_proj = _run_once(store, user_id, run_date, day_start, day_end)
+    with projection_disabled():
+        full, m_full = _run_once(store, user_id, run_date, day_start, day_end)
+
+    print(f"{'stage':<18}{'bytes (*)':>12}{'bytes':>12}{'ms (*)':>10}{'ms':>10}")
+    for stage in STAGES:
+        a, b = m_full.get(stage), m_proj.get(stage)
+        if not a or not b:
+            continue
+        print(f"{stage:<18}{a['bytes']:>12}{b['bytes']:>12}{a['seconds'] * 1000:>10.0f}{b['seconds'] * 1000:>10.0f}")
+
+    ok = True
+    for label, x, y in (("instances", projected[0], full[0]), ("schedule", projected[1], full[1])):
+        if x != y:
+            ok = False
+            print(f"MISMATCH in {label}: a stage reads a column it does not declare")
+            for row in sorted(set(y) - set(x), key=repr)[:10]:
+                print("  select * :", dict(zip(_DECISION_KEYS, row)))
+            for row in sorted(set(x) - set(y), key=repr)[:10]:
+                print("  projected:", dict(zip(_DECISION_KEYS, row)))
+    print("OK: projected reads produce identical decisions" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def main(argv: Optional[list] = None) -> int:
+    from datetime import date, datetime
+    from dayflow.store import build_store
+
+    p = argparse.ArgumentParser(description="DayFlow column projection check")
+    p.add_argument("--check", action="store_true", help="Diff projected vs select(*) planning for a user/day.")
+    p.add_argument("--user", default=os.getenv("TEST_USER_ID"), help="user_id to plan for")
+    p.add_argument("--date", default=None, help="Run date YYYY-MM-DD (default: today)")
+    p.add_argument("--backend", choices=["postgrest", "postgres"], default=os.getenv("DAYFLOW_STORE_BACKEND", "postgrest"))
+    args = p.parse_args(argv)
+
+    if not args.check:
+        for stage, (table, cols) in STAGES.items():
+            print(f"{stage} ({table}): {', '.join(cols)}")
+        return 0
+    if not args.user:
+        p.error("--user (or TEST_USER_ID) is required for --check")
+
+    logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "WARNING"), logging.WARNING))
+    run_date = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else date.today()
+    if args.backend == "postgres":
+        store = build_store("postgres")
+    else:
+        from supabase import create_client  # type: ignore
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
+        store = build_store("postgrest", client=create_client(os.getenv("SUPABASE_URL"), key))
+    return check(store, args.user, run_date)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# dayflow/daemon.py
+"""
+Warm local scheduler daemon.
+
+Every local run (app/api/scheduler/run, the local branch of revise-schedule,
+run-scheduler.ps1) used to start a fresh `python -m dayflow.scheduler_main`.
+Before planning anything, each one paid for interpreter start, the pandas and
+supabase imports, .env parsing and a new client. The daemon pays those once:
+
+    python -m dayflow.daemon                  # from the repo root, so .env files load
+
+It imports the planner, opens a pooled Supabase client and the template cache,
+then listens on localhost (or a Unix socket) for run requests. A request is one
+JSON line and so is the answer:
+
+    {"argv": ["--date", "today", "--user", "<id>", "--force"], "env": {"TZ": "..."}}
+    {"ok": true, "rc": 0, "output": "...", "elapsed_ms": 412.3}
+
+`argv` is the scheduler CLI's own arguments. `env` carries the caller's values
+for the variables the CLI reads its defaults from (FORWARDED_ENV), so a run
+behaves as if the caller had started it. `output` is what the run printed and
+logged.
+
+`python -m dayflow.scheduler_main ...` checks for the daemon before its heavy
+imports and forwards the run when one is listening. Otherwise it runs in-process
+as before. Routes that spawn the CLI can talk to the daemon directly
+(lib/schedulerDaemon.ts) and skip the interpreter too.
+
+Runs are handled one at a time: a local install schedules one user, and a run's
+printed output can only be captured while it has the process to itself. There is
+no authentication, so the daemon only listens on localhost or a local socket.
+
+Config (env, all optional):
+  DAYFLOW_DAEMON             0 to stop the CLI forwarding to a daemon (default 1)
+  DAYFLOW_DAEMON_ADDR        host:port or unix:/path (default 127.0.0.1:8765)
+  DAYFLOW_DAEMON_TIMEOUT_S   how long the CLI waits for a forwarded run (default 300)
+"""
+import io
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import traceback
+import contextlib
+import socketserver
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_ADDR = "127.0.0.1:8765"
+CONNECT_TIMEOUT_S = 0.25
+
+# The variables scheduler_main.parse_args takes its defaults from
+FORWARDED_ENV = ("TZ", "TEST_USER_ID", "TEMPLATE_WHITELIST", "DAYFLOW_STORE_BACKEND", "ALLOW_BEFORE_7")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_addr(addr: str) -> Tuple[int, Any]:
+    """'host:port' -> (AF_INET, (host, port)); 'unix:/path' -> (AF_UNIX, path)."""
+    if addr.startswith("unix:"):
+        return socket.AF_UNIX, addr[len("unix:"):]
+    host, _, port = addr.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+# ----------------------------------------
+# Client (runs in the CLI process: stdlib only, nothing heavy)
+# ----------------------------------------
+def request(payload: Dict, addr: Optional[str] = None, timeout: Optional[float] = None) -> Optional[Dict]:
+    """
+    Send one request to the daemon and return its answer, or None if no daemon is
+    listening. Failures after the request was sent raise: the run may have started,
+    so the caller must not quietly run it a second time.
+    """
+    family, target = _parse_addr(addr or os.getenv("DAYFLOW_DAEMON_ADDR", DEFAULT_ADDR))
+    try:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+    except (AttributeError, OSError):   # AF_UNIX on an old Windows
+        return None
+    try:
+        sock.settimeout(CONNECT_TIMEOUT_S)
+        try:
+            sock.connect(target)
+        except OSError:
+            return None
+        sock.settimeout(timeout if timeout is not None else _env_float("DAYFLOW_DAEMON_TIMEOUT_S", 300.0))
+        sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+        if not line:
+            raise ConnectionError("daemon closed the connection without answering")
+        return json.loads(line)
+    finally:
+        sock.close()
+
+
+def try_run(argv: list) -> Optional[int]:
+    """
+    Forward a scheduler CLI run to the daemon. Returns the run's exit code, or None
+    (run in-process instead) when forwarding is off or no daemon is listening.
+    """
+    if str(os.getenv("DAYFLOW_DAEMON", "1")).lower() in ("0", "false", "no", "off"):
+        return None
+    env = {k: os.environ[k] for k in FORWARDED_ENV if k in os.environ}
+    try:
+        reply = request({"argv": list(argv), "env": env, "cwd": os.getcwd()})
+    except Exception as e:
+        print(f"[scheduler] daemon run failed: {e}", file=sys.stderr)
+        return 1
+    if reply is None:
+        return None
+    if reply.get("output"):
+        sys.stdout.write(reply["output"])
+        sys.stdout.flush()
+    if reply.get("error"):
+        print(f"[scheduler] daemon: {reply['error']}", file=sys.stderr)
+    return int(reply.get("rc", 1))
+
+
+# ----------------------------------------
+# Daemon
+# ----------------------------------------
+class Daemon:
+    """Preloaded scheduler state; handle() runs one request against it."""
+
+    def __init__(self):
+        t0 = time.monotonic()
+        from dayflow import scheduler_main   # planner, pandas, store wrappers
+        from dayflow.client_pool import ClientPool
+        from dayflow import template_cache as templates
+
+        self.scheduler_main = scheduler_main
+        self.client_pool = ClientPool()
+        self.template_cache = templates.build(self.client_pool.get)
+        if self.client_pool.url and self.client_pool.key:
+            self.client_pool.get()   # connect now rather than on the first run
+        self.started = time.time()
+        self.runs = 0
+        self._run_lock = threading.Lock()
+        logging.info("daemon: preloaded in %.0f ms", (time.monotonic() - t0) * 1000)
+
+    def handle(self, payload: Dict) -> Dict:
+        op = payload.get("op", "run")
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid(), "runs": self.runs, "uptime_s": round(time.time() - self.started, 1)}
+        if op != "run":
+            return {"ok": False, "rc": 2, "error": f"unknown op {op!r}"}
+        argv = [str(a) for a in payload.get("argv") or []]
+        env = dict(os.environ)
+        env.update({k: str(v) for k, v in (payload.get("env") or {}).items() if k in FORWARDED_ENV})
+        cwd = payload.get("cwd")
+        if cwd and os.path.abspath(cwd) != os.getcwd():
+            logging.warning("daemon: caller ran from %s but the daemon serves %s (.env files and paths are the daemon's)", cwd, os.getcwd())
+
+        with self._run_lock:
+            t0 = time.monotonic()
+            buf = io.StringIO()
+            handler = logging.StreamHandler(buf)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            root = logging.getLogger()
+            root.addHandler(handler)
+            try:
+                with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
+                    try:
+                        rc = self.scheduler_main.main(
+                            argv,
+                            supabase=self.client_pool.get() if self.client_pool.url and self.client_pool.key else None,
+                            template_cache=self.template_cache,
+                            env=env,
+                        )
+                    except SystemExit as e:   # argparse errors and --help
+                        rc = e.code if isinstance(e.code, int) else (0 if e.code is None else 2)
+                    except Exception:
+                        traceback.print_exc()
+                        rc = 1
+            finally:
+                root.removeHandler(handler)
+            self.runs += 1
+            elapsed = (time.monotonic() - t0) * 1000
+        logging.info("daemon: run %s -> rc=%s in %.0f ms", " ".join(argv), rc, elapsed)
+        return {"ok": rc == 0, "rc": rc, "output": buf.getvalue(), "elapsed_ms": round(elapsed, 1)}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line.strip():
+            return
+        try:
+            reply = self.server.daemon.handle(json.loads(line))
+        except Exception as e:
+            logging.exception("daemon: bad request")
+            reply = {"ok": False, "rc": 2, "error": str(e)}
+        self.wfile.write(json.dumps(reply, default=str).encode("utf-8") + b"\n")
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(addr: Optional[str] = None) -> None:
+    """Preload the scheduler and answer requests on `addr` until interrupted."""
+    addr = addr or os.getenv("DAYFLOW_DAEMON_ADDR", DEFAULT_ADDR)
+    family, target = _parse_addr(addr)
+    if family == socket.AF_INET and target[0] not in ("127.0.0.1", "localhost", "::1"):
+        raise SystemExit(f"refusing to listen on {target[0]}: the daemon has no authentication, use localhost")
+    daemon = Daemon()
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.unlink(target)
+
+        class _UnixServer(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        server = _UnixServer(target, _Handler)
+    else:
+        server = _TCPServer(target, _Handler)
+    server.daemon = daemon
+    logging.info("daemon: listening on %s (pid %d)", addr, os.getpid())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.unlink(target)
+
+
+def main(argv: Optional[list] = None) -> int:
+    p = argparse.ArgumentParser(prog="dayflow-daemon", description="Warm local scheduler daemon.")
+    p.add_argument("--addr", default=None, help=f"host:port or unix:/path (default DAYFLOW_DAEMON_ADDR or {DEFAULT_ADDR})")
+    p.add_argument("--ping", action="store_true", help="Check whether a daemon is listening and exit.")
+    args = p.parse_args(argv)
+    logging.basicConfig(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO"), logging.INFO),
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    if args.ping:
+        reply = request({"op": "ping"}, addr=args.addr, timeout=5)
+        print(json.dumps(reply) if reply else "no daemon listening")
+        return 0 if reply else 1
+    serve(args.addr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+# dayflow/explain.py
+"""
+EXPLAIN every query the planner issues, against a seeded local Postgres.
+
+    python -m dayflow.explain --dsn postgresql://localhost/dayflow_scratch --seed
+
+The database needs the app schema (e.g. `supabase db dump --schema-only` restored
+locally) and the migrations in supabase/ you want to check. --seed fills
+task_templates, scheduled_tasks and scheduled_tasks_archive with synthetic users
+(foreign-key triggers are bypassed, so it needs a superuser).
+
+The tool then runs one full scheduler pass for a seeded user (scheduler_main.main,
+writes included - point it at a scratch database) through a RecordingStore on the
+direct Postgres backend. Every distinct read, update and delete statement the run
+sent is EXPLAINed with the values it used, and any Seq Scan over a relation with
+more rows than the threshold is flagged. Exit status is 1 if anything was flagged,
+so a missing index fails the check instead of surfacing as a slow revise.
+
+Config (env, all optional):
+  DAYFLOW_EXPLAIN_DSN        scratch database (default: DAYFLOW_DATABASE_URL)
+  DAYFLOW_EXPLAIN_SEQ_ROWS   Seq Scan row threshold (default 10000)
+"""
+import os
+import sys
+import uuid
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from dayflow.store import Store, DEFAULT_KEYSET, PostgresStore, _with_key_columns
+
+_SEED_USER = "dayflow-explain-user-"
+_SEED_TEMPLATE = "dayflow-explain-template-"
+
+
+def seeded_user_ids(users: int) -> List[str]:
+    """The user_ids --seed creates (same md5-derived uuids as the seeding SQL)."""
+    return [str(uuid.UUID(hashlib.md5(f"{_SEED_USER}{u}".encode()).hexdigest())) for u in range(users)]
+
+
+# -----------------------
+# Seeding
+# -----------------------
+_SEED_TEMPLATES_SQL = """
+INSERT INTO public.task_templates
+  (id, user_id, title, repeat_unit, repeat_interval, duration_minutes, priority, is_deleted)
+SELECT md5(%(tpl)s || u || '-' || t)::uuid,
+       md5(%(usr)s || u)::uuid,
+       'Seed task ' || t,
+       CASE WHEN t %% 5 = 0 THEN 'none' ELSE 'daily' END,
+       1,
+       15 + (t %% 4) * 15,
+       1 + t %% 5,
+       t %% 13 = 12
+FROM generate_series(0, %(users)s - 1) u, generate_series(0, %(templates)s - 1) t
+"""
+
+# One instance per template per day; ~10% unscheduled, ~70% completed, ~5% deleted
+_SEED_TASKS_SQL = """
+INSERT INTO public.{table}
+  (id, user_id, template_id, title, local_date, start_time, duration_minutes, is_completed, is_deleted)
+SELECT gen_random_uuid(),
+       md5(%(usr)s || u)::uuid,
+       md5(%(tpl)s || u || '-' || t)::uuid,
+       'Seed task ' || t,
+       d::date,
+       CASE WHEN (u + t + extract(doy FROM d)::int) %% 10 = 0 THEN NULL
+            ELSE d + interval '8 hours' + t * interval '30 minutes' END,
+       15 + (t %% 4) * 15,
+       random() < 0.7,
+       random() < 0.05
+FROM generate_series(0, %(users)s - 1) u,
+     generate_series(0, %(templates)s - 1) t,
+     generate_series(%(first)s::date, %(last)s::date, interval '1 day') d
+"""
+
+
+def seed(conn, *, users: int, templates: int, days: int, run_date: date) -> Dict[str, int]:
+    """
+    (Re)create the synthetic users: `days` days of history in scheduled_tasks up to
+    the day before run_date and another `days` days before that in the archive.
+    """
+    ids = seeded_user_ids(users)
+    live_first = run_date - timedelta(days=days)
+    params = {
+        "usr": _SEED_USER, "tpl": _SEED_TEMPLATE, "users": users, "templates": templates,
+    }
+    counts: Dict[str, int] = {}
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL session_replication_role = replica")
+            for table in ("scheduled_tasks_archive", "scheduled_tasks", "task_templates"):
+                cur.execute(f"DELETE FROM public.{table} WHERE user_id = ANY(%s::uuid[])", (ids,))
+            cur.execute(_SEED_TEMPLATES_SQL, params)
+            counts["task_templates"] = cur.rowcount
+            cur.execute(
+                _SEED_TASKS_SQL.format(table="scheduled_tasks"),
+                dict(params, first=live_first, last=run_date - timedelta(days=1)),
+            )
+            counts["scheduled_tasks"] = cur.rowcount
+            cur.execute(
+                _SEED_TASKS_SQL.format(table="scheduled_tasks_archive"),
+                dict(params, first=live_first - timedelta(days=days), last=live_first - timedelta(days=1)),
+            )
+            counts["scheduled_tasks_archive"] = cur.rowcount
+    with conn.transaction():
+        with conn.cursor() as cur:
+            for table in ("task_templates", "scheduled_tasks", "scheduled_tasks_archive"):
+                cur.execute(f"ANALYZE public.{table}")
+    return counts
+
+
+# -----------------------
+# Recording
+# -----------------------
+class RecordingStore(Store):
+    """Pass-through Store that remembers every statement (kind, table, filters, values) it sends."""
+
+    def __init__(self, inner: PostgresStore):
+        self.inner = inner
+        self.backend = inner.backend
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def _record(self, kind: str, table: str, **kw) -> None:
+        with self._lock:
+            self.calls.append(dict(kind=kind, table=table, **kw))
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        filters = list(filters or ())
+        self._record("select", table, columns=columns, filters=filters, order=order, limit=limit)
+        return self.inner.select(table, columns, filters=filters, order=order, limit=limit)
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        filters = list(filters or ())
+        self._record("select", table, columns=columns, filters=filters, order=order, limit=limit)
+        return self.inner.select_page(table, columns, filters=filters, order=order, limit=limit, count=count)
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters=(),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key: Sequence[str] = DEFAULT_KEYSET,
+    ) -> Iterator[Dict]:
+        filters = list(filters or ())
+        self._record(
+            "select", table, columns=_with_key_columns(columns, key), filters=filters,
+            order=[(k, desc) for k in key], limit=None,
+        )
+        return self.inner.stream(table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        ids = list(template_ids or ())
+        if ids:
+            bounds = [("gte", "local_date", since)] if since else []
+            bounds += [("lt", "local_date", until)] if until else []
+            self._record(
+                "latest", "scheduled_tasks", ids=ids, since=since, until=until,
+                filters=[("in", "template_id", ids)] + bounds,
+            )
+        return self.inner.latest_per_template(ids, since=since, until=until)
+
+    def table_columns(self, table):
+        return self.inner.table_columns(table)
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        # INSERT .. ON CONFLICT resolves through the unique constraint; nothing to plan
+        return self.inner.upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+    def update(self, table, values, *, filters):
+        filters = list(filters or ())
+        self._record("update", table, values=dict(values), filters=filters)
+        return self.inner.update(table, values, filters=filters)
+
+    def delete(self, table, *, filters):
+        filters = list(filters or ())
+        self._record("delete", table, filters=filters)
+        return self.inner.delete(table, filters=filters)
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+def _shape(call: Dict[str, Any]) -> tuple:
+    """Calls with the same shape differ only in values; one EXPLAIN covers them."""
+    return (
+        call["kind"], call["table"], call.get("columns"),
+        tuple((op, col if isinstance(col, str) else tuple(col)) for op, col, _ in call.get("filters") or ()),
+        tuple(tuple(o) for o in call.get("order") or ()),
+        call.get("limit") is None,
+        tuple(sorted(call.get("values") or ())),
+    )
+
+
+def _label(call: Dict[str, Any]) -> str:
+    where = " AND ".join(
+        f"{col if isinstance(col, str) else ','.join(col)} {op}" for op, col, _ in call.get("filters") or ()
+    )
+    out = f"{call['kind']} {call['table']}" + (f" WHERE {where}" if where else "")
+    if call.get("order"):
+        out += " ORDER BY " + ", ".join(f"{c}{' DESC' if d else ''}" for c, d in call["order"])
+    if call.get("limit") is not None:
+        out += f" LIMIT {call['limit']}"
+    return out
+
+
+def statement(store: PostgresStore, call: Dict[str, Any]):
+    """The (query, params) PostgresStore sends for a recorded call."""
+    from psycopg import sql  # type: ignore
+
+    kind, table = call["kind"], call["table"]
+    if kind == "select":
+        return store._select_sql(table, call["columns"], call["filters"], call["order"], call["limit"])
+    if kind == "latest":
+        return store._latest_sql(call["ids"], call["since"], call["until"])
+    where, params = store._where_sql(call["filters"])
+    if kind == "update":
+        values = call["values"]
+        sets = sql.SQL(", ").join(sql.SQL("{} = %s").format(sql.Identifier(k)) for k in values)
+        query = sql.SQL("UPDATE {} SET {}").format(sql.Identifier("public", table), sets) + where
+        return query, [store._adapt(v) for v in values.values()] + params
+    if kind == "delete":
+        return sql.SQL("DELETE FROM {}").format(sql.Identifier("public", table)) + where, params
+    raise ValueError(f"unknown statement kind {kind!r}")
+
+
+# -----------------------
+# EXPLAIN
+# -----------------------
+def _nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans") or ():
+        yield from _nodes(child)
+
+
+def explain(conn, query, params) -> Dict[str, Any]:
+    """EXPLAIN (FORMAT JSON) with the values inlined, so the plan is the one those values get."""
+    from psycopg import ClientCursor, sql  # type: ignore
+
+    with ClientCursor(conn) as cur:
+        cur.execute(sql.SQL("EXPLAIN (FORMAT JSON) ") + query, params)
+        return cur.fetchone()[0][0]["Plan"]
+
+
+def _relation_rows(conn, relation: str, cache: Dict[str, int]) -> int:
+    if relation not in cache:
+        with conn.cursor() as cur:
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", (f"public.{relation}",))
+            row = cur.fetchone()
+            cache[relation] = max(0, int(row[0])) if row and row[0] is not None else 0
+    return cache[relation]
+
+
+def check(conn, store: PostgresStore, calls: List[Dict[str, Any]], *, threshold: int) -> List[Dict[str, Any]]:
+    """EXPLAIN each distinct recorded statement; returns one result per statement."""
+    seen, results = set(), []
+    rel_rows: Dict[str, int] = {}
+    for call in calls:
+        shape = _shape(call)
+        if shape in seen:
+            continue
+        seen.add(shape)
+        query, params = statement(store, call)
+        plan = explain(conn, query, params)
+        scans, flagged = [], []
+        for node in _nodes(plan):
+            rel = node.get("Relation Name")
+            if not rel:
+                continue
+            desc = node["Node Type"] + (f" using {node['Index Name']}" if node.get("Index Name") else "") + f" on {rel}"
+            scans.append(desc)
+            if node["Node Type"] == "Seq Scan":
+                rows = _relation_rows(conn, rel, rel_rows)
+                if rows > threshold:
+                    flagged.append(f"{desc} ({rows} rows)")
+        results.append({"statement": _label(call), "scans": scans, "flagged": flagged, "cost": plan.get("Total Cost")})
+    return results
+
+
+def run_planner(recorder: RecordingStore, user_id: str, run_date: date, *, dry_run: bool = False) -> int:
+    """One scheduler_main pass for user_id/run_date with every statement going through `recorder`."""
+    from dayflow.scheduler_main import main as scheduler_main
+
+    # The env preflight wants credentials; the injected store does all the I/O.
+    os.environ.setdefault("SUPABASE_URL", "http://localhost")
+    os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "explain")
+    os.environ.pop("DAYFLOW_REPLICA_URL", None)
+    argv = ["--date", run_date.isoformat(), "--user", user_id, "--force", "--backend", "postgrest"]
+    if dry_run:
+        argv.append("--dry-run")
+    return scheduler_main(argv, supabase=recorder)
+
+
+def main(argv: Optional[list] = None) -> int:
+    p = argparse.ArgumentParser(description="EXPLAIN the planner's queries and flag large sequential scans")
+    p.add_argument("--dsn", default=os.getenv("DAYFLOW_EXPLAIN_DSN") or os.getenv("DAYFLOW_DATABASE_URL"),
+                   help="scratch database connection string")
+    p.add_argument("--seed", action="store_true", help="(re)seed synthetic users before explaining")
+    p.add_argument("--users", type=int, default=200, help="seeded users (default 200)")
+    p.add_argument("--templates", type=int, default=15, help="templates per seeded user (default 15)")
+    p.add_argument("--days", type=int, default=90, help="days of history in live and in archive (default 90)")
+    p.add_argument("--user", default=None, help="user_id to plan for (default: first seeded user)")
+    p.add_argument("--date", default=None, help="run date YYYY-MM-DD (default: today)")
+    p.add_argument("--threshold", type=int, default=int(os.getenv("DAYFLOW_EXPLAIN_SEQ_ROWS", "10000")),
+                   help="flag Seq Scans over relations with more rows than this (default 10000)")
+    p.add_argument("--dry-run", action="store_true", help="plan without writing (skips the write-path reads)")
+    args = p.parse_args(argv)
+
+    if not args.dsn:
+        p.error("--dsn (or DAYFLOW_EXPLAIN_DSN) is required")
+    if "supabase.co" in args.dsn or "supabase.com" in args.dsn:
+        p.error("the planner run writes; point --dsn at a local scratch database, not a Supabase project")
+
+    logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "WARNING"), logging.WARNING))
+    run_date = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else date.today()
+    store = PostgresStore(args.dsn)
+    try:
+        with store.connection() as conn:
+            if args.seed:
+                counts = seed(conn, users=args.users, templates=args.templates, days=args.days, run_date=run_date)
+                print("seeded " + ", ".join(f"{t}={n}" for t, n in counts.items()))
+
+            recorder = RecordingStore(store)
+            user_id = args.user or seeded_user_ids(1)[0]
+            rc = run_planner(recorder, user_id, run_date, dry_run=args.dry_run)
+            if rc:
+                print(f"scheduler run exited with status {rc}; explaining the statements it sent anyway")
+            results = check(conn, store, recorder.calls, threshold=args.threshold)
+    finally:
+        store.close()
+
+    flagged = [r for r in results if r["flagged"]]
+    for r in results:
+        print(f"{'SEQ ' if r['flagged'] else 'ok  '}{r['statement']}")
+        for scan in r["flagged"] or r["scans"]:
+            print(f"      {scan}")
+    print(f"{len(results)} statement(s), {len(flagged)} with Seq Scans over {args.threshold} rows")
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,569 @@
+# dayflow/jobs.py
+"""
+Background job queue for the server's scheduler runs.
+
+/run-scheduler used to do the whole run inside the HTTP request, so a slow run
+hit the caller's timeout (revise-schedule's 60 s maxDuration) and the retry
+started a second run. Now the request enqueues a job and returns its id at once.
+A fixed pool of worker threads runs jobs in arrival order, and GET /jobs/<id>
+reports status and result:
+
+    queued -> running -> succeeded | failed
+
+Runs for the same user and date are coalesced. Revise gets clicked several times,
+and each run rewrites the whole day, so overlapping runs are wasted work. There
+is at most one run in flight per (user, date) plus one queued behind it. A
+request that arrives while a run is queued gets that run's job id, and every
+caller polls a run that started after its request.
+
+Admission is bounded at every level, so overload is refused at once rather
+than turning into a backlog that times out behind the caller:
+  - no more than DAYFLOW_JOBS_WORKERS jobs run at once
+  - jobs of one group (the server groups by user) run one at a time. A user's
+    second run waits behind the first instead of taking another worker
+  - submit() raises QueueFull once DAYFLOW_JOBS_MAX_DEPTH jobs are waiting, or
+    once DAYFLOW_JOBS_MAX_PER_USER are waiting for the same group
+QueueFull carries a retry_after estimate in seconds, based on the queue ahead
+and recent run times. The server answers 429 with a Retry-After header. Queue
+depth, busy workers, held, coalesced and rejected requests are on /metrics.
+Time spent waiting in the queue and time spent running are reported
+separately.
+
+Job records live in memory by default and are lost on restart. With
+DAYFLOW_JOBS_DB set they are kept in a SQLite file instead. On start, jobs that
+were queued or running when the process died are queued again, oldest first. A
+scheduler run is an upsert of the day, so running an interrupted one twice is
+harmless. Only the newest DAYFLOW_JOBS_KEEP finished jobs are kept, in either
+backend.
+
+submit() also takes an idempotency key, which the server reads from the
+Idempotency-Key header. A repeat of a key within DAYFLOW_IDEMPOTENCY_TTL_S gets
+the original job back. The job may be queued, running or finished, and its
+result is in the record. So a retried request costs a dict lookup, not another
+delete-and-rewrite of the day. A job still unfinished keeps its key past the
+TTL, and is never dropped to keep the key map within DAYFLOW_JOBS_KEEP. Reusing
+a key with a different payload raises IdempotencyConflict.
+
+While a job runs, the handler can report progress through the `emit` callable
+it is given. Each job's events are kept in memory (for the newest
+DAYFLOW_JOBS_KEEP jobs), numbered from 1, and events() waits for new ones.
+GET /jobs/<id>/events streams them to the caller.
+
+Config (env, all optional):
+  DAYFLOW_JOBS_WORKERS     concurrent runs (default 2)
+  DAYFLOW_JOBS_MAX_DEPTH   queued jobs before submit() is refused (default 100)
+  DAYFLOW_JOBS_MAX_PER_USER  queued jobs per group before submit() is refused (default 5)
+  DAYFLOW_JOBS_KEEP        finished jobs kept for GET /jobs/<id> (default 1000)
+  DAYFLOW_JOBS_DB          SQLite file for a durable queue (default: memory only)
+  DAYFLOW_IDEMPOTENCY_TTL_S  how long an idempotency key returns its job (default 600)
+"""
+import os
+import json
+import uuid
+import queue
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class QueueFull(Exception):
+    """The queue (or the job's group) already holds as many waiting jobs as it may."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused with a different payload."""
+
+
+# ----------------------------------------
+# Backends: where job records live
+# ----------------------------------------
+class MemoryJobs:
+    """Job records in a dict; finished ones beyond `keep` are dropped oldest first."""
+
+    name = "memory"
+
+    def __init__(self, keep: int = 1000):
+        self.keep = keep
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._finished: deque = deque()
+        self._lock = threading.Lock()
+
+    def put(self, job: Dict) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if fields.get("status") in FINISHED:
+                self._finished.append(job_id)
+                while len(self._finished) > self.keep:
+                    self._jobs.pop(self._finished.popleft(), None)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def unfinished(self) -> List[Dict]:
+        return []
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteJobs:
+    """Job records in a SQLite file, so queued and interrupted jobs survive a restart."""
+
+    name = "sqlite"
+
+    _COLUMNS = ("id", "status", "payload", "result", "error", "attempts",
+                "created_at", "started_at", "finished_at")
+
+    def __init__(self, path: str, keep: int = 1000):
+        self.path = path
+        self.keep = keep
+        Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(Path(path).expanduser()), timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT, result TEXT, error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at TEXT NOT NULL, started_at TEXT, finished_at TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(fields: Dict) -> Dict:
+        return {k: (json.dumps(v) if k in ("payload", "result") and v is not None else v) for k, v in fields.items()}
+
+    def _decode(self, row) -> Dict:
+        job = dict(zip(self._COLUMNS, row))
+        for k in ("payload", "result"):
+            if job[k] is not None:
+                job[k] = json.loads(job[k])
+        return job
+
+    def put(self, job: Dict) -> None:
+        row = self._encode({k: job.get(k) for k in self._COLUMNS})
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(self._COLUMNS)}) VALUES ({', '.join('?' * len(self._COLUMNS))})",
+                [row[k] for k in self._COLUMNS],
+            )
+            self._conn.commit()
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        row = self._encode(fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in row)} WHERE id = ?",
+                [*row.values(), job_id],
+            )
+            if fields.get("status") in FINISHED:
+                self._conn.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND id NOT IN ("
+                    " SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY finished_at DESC LIMIT ?)",
+                    [*FINISHED, *FINISHED, self.keep],
+                )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", [job_id]
+            ).fetchone()
+        return self._decode(row) if row else None
+
+    def unfinished(self) -> List[Dict]:
+        """Jobs a previous process left queued or running, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                [QUEUED, RUNNING],
+            ).fetchall()
+        return [self._decode(r) for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# ----------------------------------------
+# Queue
+# ----------------------------------------
+class JobQueue:
+    """
+    Bounded FIFO of jobs run by `workers` threads. `handler(payload, emit)` does the
+    work and returns a JSON-able result; an exception fails the job with its message.
+    `emit(event)` appends a JSON-able dict to the job's event log (see events()).
+
+    With `key(payload)`, jobs with the same key are coalesced: at most one runs and
+    at most one more waits behind it. A submit that finds a waiting job for its key
+    gets that job back instead of a new one. The waiting job starts after the
+    request was made, so its result covers the request. The job behind a running
+    one is held back from the workers until the running one finishes, so two runs
+    for the same key never overlap.
+
+    With `group(payload)`, jobs in the same group run one at a time (at most one
+    worker per group), and at most `max_per_group` of a group's jobs may wait.
+    A job whose group is busy when a worker takes it is held until the group's
+    running job finishes.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict], Any],
+        *,
+        workers: int = 2,
+        max_depth: int = 100,
+        backend: Any = None,
+        key: Optional[Callable[[Dict], Hashable]] = None,
+        group: Optional[Callable[[Dict], Hashable]] = None,
+        max_per_group: int = 5,
+        keep_events: int = 1000,
+        idempotency_ttl: float = 600.0,
+    ):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_depth = max(1, max_depth)
+        self.backend = backend or MemoryJobs()
+        self.key = key
+        self.group = group
+        self.max_per_group = max(1, max_per_group)
+        self._queue: queue.Queue = queue.Queue()   # (job id, monotonic enqueue time)
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._depth = 0                            # queued jobs, held ones included
+        self._busy = 0
+        self._job_keys: Dict[str, Hashable] = {}   # job id -> key, until the job finishes
+        self._running: Dict[Hashable, str] = {}    # key -> running job id
+        self._waiting: Dict[Hashable, str] = {}    # key -> queued job id (at most one)
+        self._held: Dict[Hashable, Tuple[str, float]] = {}   # key -> waiting job kept off the queue
+        self._job_groups: Dict[str, Hashable] = {}             # job id -> group, until the job finishes
+        self._group_depth: Dict[Hashable, int] = {}            # group -> queued jobs
+        self._group_running: Dict[Hashable, str] = {}          # group -> running job id
+        self._group_held: Dict[Hashable, deque] = {}           # group -> jobs waiting for its running one
+        self.idempotency_ttl = idempotency_ttl
+        # idempotency key -> (job id, payload, expiry); insertion order is expiry order
+        self._idempotent: "OrderedDict[Hashable, Tuple[str, Dict, float]]" = OrderedDict()
+        self._counters = {"submitted": 0, "coalesced": 0, "replayed": 0, "rejected": 0, "recovered": 0,
+                          SUCCEEDED: 0, FAILED: 0}
+        self._waits: deque = deque(maxlen=500)
+        self._runs: deque = deque(maxlen=500)
+        self.keep_events = max(1, keep_events)
+        self._events: "OrderedDict[str, List[Dict]]" = OrderedDict()   # job id -> events, oldest job first
+        self._finished_ids: set = set()                                # jobs in _events that have finished
+        self._changed = threading.Condition(self._lock)
+
+    def start(self) -> "JobQueue":
+        """Re-queue jobs a previous process didn't finish, then start the workers."""
+        if self._threads:
+            return self
+        for job in self.backend.unfinished():
+            with self._lock:
+                k = self._key(job["payload"])
+                if k is not None and k in self._waiting:
+                    # Two unfinished runs for one key: the re-queued one runs after both requests
+                    self.backend.update(job["id"], status=SUCCEEDED, finished_at=_now_iso(),
+                                        result={"coalesced_into": self._waiting[k]})
+                    continue
+                self.backend.update(job["id"], status=QUEUED, started_at=None)
+                self._admit(job["id"], k, self._group_of(job["payload"]))
+                self._counters["recovered"] += 1
+        if self._counters["recovered"]:
+            logging.info("jobs: re-queued %d unfinished job(s) from %s", self._counters["recovered"], self.backend.name)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"dayflow-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def submit(self, payload: Dict, idempotency_key: Optional[Hashable] = None) -> Dict:
+        """
+        Queue a job and return its record, or the waiting job already queued for the
+        same key. Raises QueueFull when max_depth jobs, or max_per_group jobs of the
+        payload's group, are waiting.
+
+        A repeated `idempotency_key` returns its first job's current record, marked
+        "replayed", without queueing anything; IdempotencyConflict if the payload differs.
+        """
+        with self._lock:
+            if idempotency_key is not None:
+                replay = self._replay(idempotency_key, payload)
+                if replay is not None:
+                    return replay
+            k = self._key(payload)
+            g = self._group_of(payload)
+            if k is not None and k in self._waiting:
+                self._counters["coalesced"] += 1
+                job_id = self._waiting[k]
+            else:
+                if self._depth >= self.max_depth:
+                    self._counters["rejected"] += 1
+                    raise QueueFull(f"{self._depth} jobs already queued (max {self.max_depth})",
+                                    self._retry_after(self._depth - self.max_depth + 1, self.workers))
+                if g is not None and self._group_depth.get(g, 0) >= self.max_per_group:
+                    self._counters["rejected"] += 1
+                    raise QueueFull(f"{self._group_depth[g]} jobs already queued for this user (max {self.max_per_group})",
+                                    self._retry_after(self._group_depth[g] - self.max_per_group + 1, 1))
+                self._counters["submitted"] += 1
+                job = {
+                    "id": uuid.uuid4().hex,
+                    "status": QUEUED,
+                    "payload": payload,
+                    "result": None,
+                    "error": None,
+                    "attempts": 0,
+                    "created_at": _now_iso(),
+                    "started_at": None,
+                    "finished_at": None,
+                }
+                self.backend.put(job)
+                self._admit(job["id"], k, g)
+                job_id = job["id"]
+            if idempotency_key is not None:
+                self._remember(idempotency_key, job_id, payload)
+        return self.backend.get(job_id) or {"id": job_id, "status": QUEUED}
+
+    def _replay(self, ikey: Hashable, payload: Dict) -> Optional[Dict]:
+        entry = self._idempotent.get(ikey)
+        if entry is None:
+            return None
+        job_id, first_payload, expires = entry
+        if first_payload != payload:
+            raise IdempotencyConflict("Idempotency key reused with a different request")
+        job = self.backend.get(job_id)
+        if job is None or (job["status"] in FINISHED and time.monotonic() >= expires):
+            del self._idempotent[ikey]
+            return None
+        self._counters["replayed"] += 1
+        return dict(job, replayed=True)
+
+    def _remember(self, ikey: Hashable, job_id: str, payload: Dict) -> None:
+        now = time.monotonic()
+        self._idempotent[ikey] = (job_id, payload, now + self.idempotency_ttl)
+        self._idempotent.move_to_end(ikey)
+        # Drop keys of finished jobs, oldest first: expired ones, and unexpired ones while the
+        # map is over the job-record cap. A queued or running job keeps its key, so the map
+        # can exceed the cap while that many jobs are unfinished
+        over = len(self._idempotent) - self.keep_events
+        for old_key, (old_id, _, expires) in list(self._idempotent.items()):
+            if expires > now and over <= 0:
+                break
+            job = self.backend.get(old_id)
+            if job is not None and job["status"] not in FINISHED:
+                continue
+            del self._idempotent[old_key]
+            over -= 1
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.backend.get(job_id)
+
+    def events(self, job_id: str, after: int = 0, timeout: Optional[float] = None) -> Tuple[List[Dict], bool]:
+        """
+        The job's events numbered above `after` (each has "seq"), and whether the job
+        has finished. Waits up to `timeout` seconds for a new event while the job is
+        unfinished; events of jobs this process never ran come back empty.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._changed:
+            while True:
+                log = self._events.get(job_id, [])
+                finished = job_id in self._finished_ids
+                if len(log) > after or finished or deadline is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            new = log[after:]
+        if not finished and not new:
+            job = self.backend.get(job_id)
+            finished = job is None or job["status"] in FINISHED
+        return new, finished
+
+    def _emit(self, job_id: str, event: Dict) -> None:
+        with self._changed:
+            log = self._events.get(job_id)
+            if log is None:
+                log = self._events[job_id] = []
+                while len(self._events) > self.keep_events:
+                    old, _ = self._events.popitem(last=False)
+                    self._finished_ids.discard(old)
+            log.append(dict(event, seq=len(log) + 1))
+            self._changed.notify_all()
+
+    def _key(self, payload: Dict) -> Optional[Hashable]:
+        return self.key(payload) if self.key else None
+
+    def _group_of(self, payload: Dict) -> Optional[Hashable]:
+        return self.group(payload) if self.group else None
+
+    def _retry_after(self, ahead: int, slots: int) -> int:
+        """Seconds until about `ahead` more jobs have finished on `slots` workers (recent median run time)."""
+        runs = sorted(self._runs)
+        typical = runs[len(runs) // 2] if runs else 5.0
+        return max(1, min(300, int(typical * -(-max(1, ahead) // max(1, slots)) + 0.999)))
+
+    def _admit(self, job_id: str, k: Optional[Hashable], g: Optional[Hashable] = None) -> None:
+        """Count a new queued job and hand it to the workers, or hold it behind its key's running job."""
+        self._depth += 1
+        if g is not None:
+            self._job_groups[job_id] = g
+            self._group_depth[g] = self._group_depth.get(g, 0) + 1
+        now = time.monotonic()
+        if k is None:
+            self._queue.put((job_id, now))
+            return
+        self._job_keys[job_id] = k
+        self._waiting[k] = job_id
+        if k in self._running:
+            self._held[k] = (job_id, now)
+        else:
+            self._queue.put((job_id, now))
+
+    def _work(self) -> None:
+        while True:
+            job_id, queued_at = self._queue.get()
+            with self._lock:
+                g = self._job_groups.get(job_id)
+                if g is not None and g in self._group_running:
+                    # The group's one slot is taken: wait behind it, still counted as queued
+                    self._group_held.setdefault(g, deque()).append((job_id, queued_at))
+                    self._queue.task_done()
+                    continue
+                self._depth -= 1
+                self._busy += 1
+                self._waits.append(time.monotonic() - queued_at)
+                if g is not None:
+                    self._group_running[g] = job_id
+                    self._group_depth[g] -= 1
+                    if not self._group_depth[g]:
+                        del self._group_depth[g]
+                k = self._job_keys.get(job_id)
+                if k is not None:
+                    # From here on a new request for this key needs a new run
+                    if self._waiting.get(k) == job_id:
+                        del self._waiting[k]
+                    self._running[k] = job_id
+            try:
+                self._run(job_id)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    k = self._job_keys.pop(job_id, None)
+                    if k is not None:
+                        self._running.pop(k, None)
+                        held = self._held.pop(k, None)
+                        if held:
+                            self._queue.put(held)
+                    g = self._job_groups.pop(job_id, None)
+                    if g is not None:
+                        del self._group_running[g]
+                        waiting = self._group_held.get(g)
+                        if waiting:
+                            self._queue.put(waiting.popleft())
+                            if not waiting:
+                                del self._group_held[g]
+                self._queue.task_done()
+
+    def _run(self, job_id: str) -> None:
+        job = self.backend.get(job_id)
+        if job is None:
+            return
+        self.backend.update(job_id, status=RUNNING, started_at=_now_iso(), attempts=(job.get("attempts") or 0) + 1)
+        t0 = time.monotonic()
+        self._emit(job_id, {"stage": RUNNING})
+        try:
+            result = self.handler(job["payload"], lambda event: self._emit(job_id, event))
+            status, fields = SUCCEEDED, {"result": result}
+        except Exception as e:
+            logging.exception("jobs: job %s failed", job_id)
+            status, fields = FAILED, {"error": str(e) or e.__class__.__name__}
+        self.backend.update(job_id, status=status, finished_at=_now_iso(), **fields)
+        with self._changed:
+            self._counters[status] += 1
+            self._runs.append(time.monotonic() - t0)
+            if job_id in self._events:
+                self._finished_ids.add(job_id)
+            self._changed.notify_all()
+
+    def join(self) -> None:
+        """Block until every queued job has run (for tests and shutdown)."""
+        self._queue.join()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            waits, runs = sorted(self._waits), sorted(self._runs)
+            return {
+                "backend": self.backend.name,
+                "workers": self.workers,
+                "busy": self._busy,
+                "depth": self._depth,
+                "held": len(self._held) + sum(len(q) for q in self._group_held.values()),
+                "max_per_group": self.max_per_group,
+                "idempotency_keys": len(self._idempotent),
+                "max_depth": self.max_depth,
+                **self._counters,
+                "wait_p50_ms": _pct_ms(waits, 0.5),
+                "wait_p95_ms": _pct_ms(waits, 0.95),
+                "run_p50_ms": _pct_ms(runs, 0.5),
+                "run_p95_ms": _pct_ms(runs, 0.95),
+                "run_max_ms": round(runs[-1] * 1000, 1) if runs else None,
+            }
+
+
+def _pct_ms(values: List[float], p: float) -> Optional[float]:
+    return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 1) if values else None
+
+
+def build(
+    handler: Callable[[Dict], Any],
+    key: Optional[Callable[[Dict], Hashable]] = None,
+    group: Optional[Callable[[Dict], Hashable]] = None,
+) -> JobQueue:
+    """A started JobQueue configured from DAYFLOW_JOBS_* env; `key` coalesces jobs, `group` serializes them (see JobQueue)."""
+    keep = max(1, _env_int("DAYFLOW_JOBS_KEEP", 1000))
+    path = os.getenv("DAYFLOW_JOBS_DB")
+    backend = SqliteJobs(path, keep=keep) if path else MemoryJobs(keep=keep)
+    return JobQueue(
+        handler,
+        workers=_env_int("DAYFLOW_JOBS_WORKERS", 2),
+        max_depth=_env_int("DAYFLOW_JOBS_MAX_DEPTH", 100),
+        backend=backend,
+        key=key,
+        group=group,
+        max_per_group=_env_int("DAYFLOW_JOBS_MAX_PER_USER", 5),
+        keep_events=keep,
+        idempotency_ttl=float(_env_int("DAYFLOW_IDEMPOTENCY_TTL_S", 600)),
+    ).start()
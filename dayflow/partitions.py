@@ -0,0 +1,189 @@
+# dayflow/partitions.py
+"""
+local_date bounds for planner reads on the month-partitioned scheduled_tasks and
+scheduled_tasks_archive (supabase/partition-scheduled-tasks.sql).
+
+Postgres only prunes partitions when a query bounds local_date. Most planner reads
+are already pinned to a day (today, yesterday + today, the missed days). The
+open-ended ones walk backwards through widening windows instead. These are "the
+last day the scheduler ran" and "the latest instance of each template". The
+windows are [before - 31d, before), then the 62 days before that, then 124, and
+so on down to the history floor. A daily run finds its answer in the first
+window, so it touches the current month's partition and at most the previous one,
+however much history exists.
+
+The floor is the oldest local_date actually stored (live or archive), looked up
+once per backend and cached for DAYFLOW_HISTORY_TTL_S, so no history is cut
+off: a one-off completed long ago still blocks re-instantiation and an old last
+run still anchors carry-forward. DAYFLOW_HISTORY_START only applies if the
+lookup fails or there is no data; if it is set later than the data, a warning
+is logged and the older date wins.
+
+The one-off history scan is bounded below by the earliest day any of the user's
+one-off templates could have been used (see one_off_history_start).
+
+Config (env, all optional):
+  DAYFLOW_HISTORY_START   floor when the data can't be checked (default 2024-01-01)
+  DAYFLOW_HISTORY_TTL_S   how long the discovered floor is cached (default 3600)
+  DAYFLOW_LOOKBACK_DAYS   size of the first window in days (default 31)
+"""
+import os
+import time
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_DEFAULT_HISTORY_START = date(2024, 1, 1)
+HISTORY_TABLES = ("scheduled_tasks", "scheduled_tasks_archive")
+
+_lock = threading.Lock()
+_floor_cache: Dict[str, Tuple[float, date]] = {}   # backend -> (expires_at, floor)
+_warned: set = set()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _as_date(value: Any) -> Optional[date]:
+    """date from a date/datetime/ISO string (None if it can't be read)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.fromisoformat(str(value)[:10]).date()
+    except ValueError:
+        return None
+
+
+def _configured_start() -> date:
+    raw = os.getenv("DAYFLOW_HISTORY_START")
+    start = _as_date(raw) if raw else None
+    if raw and start is None:
+        logging.warning("DAYFLOW_HISTORY_START=%r is not a date; using %s", raw, _DEFAULT_HISTORY_START)
+    return start or _DEFAULT_HISTORY_START
+
+
+def _warn_once(key: str, msg: str, *args) -> None:
+    with _lock:
+        if key in _warned:
+            return
+        _warned.add(key)
+    logging.warning(msg, *args)
+
+
+def oldest_local_date(store: Any) -> Optional[date]:
+    """Oldest local_date in scheduled_tasks / scheduled_tasks_archive (None if both are empty)."""
+    found = []
+    for table in HISTORY_TABLES:
+        rows = store.select(table, "local_date", order=[("local_date", False)], limit=1)
+        d = _as_date(rows[0].get("local_date")) if rows else None
+        if d is not None:
+            found.append(d)
+    return min(found) if found else None
+
+
+def history_start(store: Any = None) -> date:
+    """
+    Earliest local_date planner reads need to reach: the oldest stored day when
+    `store` is given (cached per backend), never later than the data.
+    """
+    configured = _configured_start()
+    if store is None:
+        return configured
+    key = getattr(store, "backend", type(store).__name__)
+    now = time.monotonic()
+    with _lock:
+        hit = _floor_cache.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    try:
+        oldest = oldest_local_date(store)
+    except Exception as e:
+        _warn_once(f"lookup:{key}", "partitions: couldn't find the oldest local_date (%s); history before %s "
+                   "is not searched", e, configured)
+        return configured
+    floor = configured
+    if oldest is not None:
+        if oldest < configured:
+            _warn_once(f"older:{key}:{oldest}", "partitions: data goes back to %s, before DAYFLOW_HISTORY_START "
+                       "(%s); searching from %s", oldest, configured, oldest)
+        floor = min(configured, oldest)
+    with _lock:
+        _floor_cache[key] = (now + max(0, _env_int("DAYFLOW_HISTORY_TTL_S", 3600)), floor)
+    return floor
+
+
+def windows_back(before: date, floor: Optional[date] = None) -> Iterator[Tuple[date, date]]:
+    """(since, until) windows, until exclusive, newest first, doubling in size down to `floor`."""
+    floor = floor or history_start()
+    size = max(1, _env_int("DAYFLOW_LOOKBACK_DAYS", 31))
+    until = before
+    while until > floor:
+        since = max(floor, until - timedelta(days=size))
+        yield since, until
+        until, size = since, size * 2
+
+
+def last_date_before(store: Any, before: date, filters: Iterable = ()) -> Optional[str]:
+    """Most recent scheduled_tasks.local_date < `before` among rows matching `filters`, or None."""
+    filters = list(filters or ())
+    for since, until in windows_back(before, history_start(store)):
+        rows = store.select(
+            "scheduled_tasks", "local_date",
+            filters=filters + [("gte", "local_date", since.isoformat()), ("lt", "local_date", until.isoformat())],
+            order=[("local_date", True)],
+            limit=1,
+        )
+        if rows:
+            return rows[0]["local_date"]
+    return None
+
+
+def latest_per_template(store: Any, template_ids: Iterable[str], today: date) -> List[Dict]:
+    """
+    store.latest_per_template() in bounded windows. The first window is open-ended
+    upwards so future-dated (deferred) instances still count as the latest; only
+    templates with nothing in it are looked up in earlier windows.
+    """
+    remaining = {str(t) for t in template_ids or () if t}
+    out: List[Dict] = []
+    for i, (since, until) in enumerate(windows_back(today + timedelta(days=1), history_start(store))):
+        if not remaining:
+            break
+        rows = store.latest_per_template(
+            sorted(remaining), since=since.isoformat(), until=None if i == 0 else until.isoformat()
+        )
+        for r in rows:
+            tid = str(r.get("template_id"))
+            if tid in remaining:
+                remaining.discard(tid)
+                out.append(r)
+    return out
+
+
+def one_off_history_start(templates: Iterable[Dict], store: Any = None) -> date:
+    """
+    Earliest local_date an instance of these templates can have: a template is only
+    instantiated once it exists, so min(created_at, date) over them, less a day for
+    timezone slack. Falls back to history_start(store) if any template lacks created_at.
+    """
+    floor = history_start(store)
+    earliest: Optional[date] = None
+    for t in templates:
+        created = _as_date(t.get("created_at"))
+        if created is None:
+            return floor
+        candidates = [created] + [d for d in (_as_date(t.get("date")),) if d is not None]
+        first = min(candidates)
+        earliest = first if earliest is None else min(earliest, first)
+    if earliest is None:
+        return floor
+    return max(floor, earliest - timedelta(days=1))
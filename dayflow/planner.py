@@ -10,6 +10,13 @@ from zoneinfo import ZoneInfo
 from typing import Set
 
 from typing import Tuple, Dict as TDict, List as TList
+
+from dayflow.store import as_store
+from dayflow import columns as column_registry
+from dayflow.writer import upsert_rows
+from dayflow import partitions
+from dayflow import serialize
+from dayflow import progress as run_progress
 # ... existing imports and helpers ...
 
 def archive_delete_for_user_day(sb, user_id: str, run_date, day_start=None) -> int:
@@ -20,10 +27,19 @@ def archive_delete_for_user_day(sb, user_id: str, run_date, day_start=None) -> i
     Preserves ALL deleted/skipped tasks so the scheduler knows not to re-instantiate them.
     Skip archiving since reschedule can happen multiple times a day causing duplicate key errors.
     """
+    store = as_store(sb)
     # 1) Fetch ids of tasks that are NOT completed AND NOT deleted (we keep completed + skipped tasks)
-    resp = sb.table("scheduled_tasks").select("id, title, template_id").eq("user_id", user_id).eq("local_date", str(run_date)).eq("is_completed", False).eq("is_deleted", False).execute()
+    rows = store.select(
+        "scheduled_tasks", "id, title, template_id",
+        filters=[
+            ("eq", "user_id", user_id),
+            ("eq", "local_date", str(run_date)),
+            ("eq", "is_completed", False),
+            ("eq", "is_deleted", False),
+        ],
+    )
 
-    ids_to_delete = [row["id"] for row in (resp.data or [])]
+    ids_to_delete = [row["id"] for row in rows]
     
     if not ids_to_delete:
         logging.info(f"[archive_delete_for_user_day] No incomplete tasks to delete for {run_date}")
@@ -31,12 +47,12 @@ def archive_delete_for_user_day(sb, user_id: str, run_date, day_start=None) -> i
 
     # Log what we're about to delete
     logging.info(f"[archive_delete_for_user_day] Deleting {len(ids_to_delete)} task(s) for {run_date}")
-    for row in (resp.data or [])[:10]:  # Log first 10
+    for row in rows[:10]:  # Log first 10
         logging.info(f"  - Deleting: {row.get('title', 'Untitled')} (template: {row.get('template_id', 'None')[:8] if row.get('template_id') else 'None'})")
 
     # 2) Delete directly without archiving (avoids duplicate key errors on repeated reschedules)
     try:
-        result = sb.table("scheduled_tasks").delete().in_("id", ids_to_delete).execute()
+        store.delete("scheduled_tasks", filters=[("eq", "local_date", str(run_date)), ("in", "id", ids_to_delete)])
         deleted_count = len(ids_to_delete)  # Trust that we deleted all requested IDs
         logging.info(f"[archive_delete_for_user_day] Successfully deleted {deleted_count} task(s) for {run_date}")
     except Exception as e:
@@ -80,11 +96,11 @@ def _dedupe_by_conflict(rows: TList[dict]) -> TList[dict]:
         logging.info("De-dup: dropped %s duplicate row(s) on (user_id,local_date,template_id)", dropped)
     return result
 def _discover_table_columns(supabase, table: str) -> Set[str]:
-    """Try to discover existing columns by selecting one row."""
+    """Try to discover existing columns (one-row probe, or the catalog on direct Postgres)."""
     try:
-        resp = supabase.table(table).select("*").limit(1).execute()
-        if resp.data and isinstance(resp.data, list) and len(resp.data) > 0:
-            return set(resp.data[0].keys())
+        cols = column_registry.table_columns(as_store(supabase), table)
+        if cols:
+            return set(cols)
     except Exception:
         pass
     # fallback: a minimal, safe set you know exists in your schema
@@ -116,9 +132,11 @@ def to_utc_timestamp(local_date_str: str, time_str: str, tz_name: str) -> str:
 # --- Tiny data access helpers (Supabase) ---
 
 def get_templates_for_user(supabase: Any, user_id: str) -> List[Dict]:
-    """Fetch task_templates for one user. Adjust the selected columns as needed."""
-    resp = supabase.table("task_templates").select("*").eq("user_id", user_id).eq("is_deleted", False).execute()
-    data = resp.data or []
+    """Fetch task_templates for one user (columns declared in dayflow.columns)."""
+    data = column_registry.fetch(
+        as_store(supabase), "templates",
+        filters=[("eq", "user_id", user_id), ("eq", "is_deleted", False)],
+    )
     logging.info("Fetched %s template(s) for user %s", len(data), user_id)
     return data
 
@@ -184,11 +202,7 @@ def upsert_scheduled_tasks(supabase, instances):
         if missing:
             raise ValueError(f"Missing required upsert keys on row: {missing}")
 
-    resp = supabase.table("scheduled_tasks") \
-        .upsert(clean, on_conflict="user_id,local_date,template_id") \
-        .execute()
-
-    upserted = len(resp.data or [])
+    upserted = len(upsert_rows(as_store(supabase), "scheduled_tasks", clean, on_conflict="user_id,local_date,template_id"))
     logging.info("Upserted %s scheduled task(s)", upserted)
     return (upserted, 0)
 
@@ -239,17 +253,57 @@ from zoneinfo import ZoneInfo
 from typing import Any, Dict, List
 import pandas as pd
 
-LOCAL_TIMEZONE = ZoneInfo(os.getenv("TZ", "Europe/London"))
+LOCAL_TIMEZONE = ZoneInfo(os.getenv("TZ", "Europe/London"))   # default only; runs pass tz explicitly
 UTC_TIMEZONE   = ZoneInfo("UTC")
 
+def run_timezone(tz: Any = None) -> ZoneInfo:
+    """A run's timezone from a ZoneInfo / IANA name; None means LOCAL_TIMEZONE (TZ at import)."""
+    if tz is None:
+        return LOCAL_TIMEZONE
+    return tz if isinstance(tz, ZoneInfo) else ZoneInfo(str(tz))
+
 def to_utc_timestamp(local_date_str: str, time_str: str, tz_name: str) -> str:
     # e.g., "2025-10-09" + "09:00:00" in Europe/London -> "2025-10-09T08:00:00+00:00" (UTC summer)
     dt_local = datetime.fromisoformat(f"{local_date_str}T{time_str}").replace(tzinfo=ZoneInfo(tz_name))
     return dt_local.astimezone(UTC_TIMEZONE).isoformat()
 
+# Read filters shared by the fetch helpers and prefetch_planning_reads, so a prefetched
+# read is the same query the planner makes
+def _template_filters(user_id: str) -> List[Tuple]:
+    return [("eq", "user_id", user_id), ("eq", "is_deleted", False)]
+
+
+def _old_schedule_filters(user_id: str, today: pd.Timestamp) -> List[Tuple]:
+    today_str = today.date().isoformat()
+    yday_str = (today - pd.Timedelta(days=1)).date().isoformat()
+    return [("eq", "user_id", user_id), ("in", "local_date", [yday_str, today_str])]
+
+
+def _unscheduled_filters(user_id: str, today_str: str) -> List[Tuple]:
+    return [
+        ("eq", "user_id", user_id),
+        ("eq", "local_date", today_str),
+        ("is", "start_time", None),
+        ("eq", "is_completed", False),
+        ("eq", "is_deleted", False),
+    ]
+
+
+ONE_OFF_HISTORY_TABLES = ("scheduled_tasks", "scheduled_tasks_archive")
+ONE_OFF_HISTORY_COLUMNS = "template_id, is_completed, is_deleted"
+
+
+def _one_off_history_filters(user_id: str, since: date, today_str: str) -> List[Tuple]:
+    return [
+        ("eq", "user_id", user_id),
+        ("gte", "local_date", since.isoformat()),
+        ("neq", "local_date", today_str),
+    ]
+
+
 def _fetch_templates_df(supabase: Any, user_id: str) -> pd.DataFrame:
-    resp = supabase.table("task_templates").select("*").eq("user_id", user_id).eq("is_deleted", False).execute()
-    df = pd.DataFrame(resp.data or [])
+    rows = column_registry.fetch(as_store(supabase), "templates", filters=_template_filters(user_id))
+    df = pd.DataFrame(rows)
     # 🔎 Debug: show how many templates we actually got and a small preview
     try:
         logging.info("templates: fetched %d row(s) for user_id=%s", len(df), user_id)
@@ -282,10 +336,9 @@ def _fetch_old_schedule_df(supabase: Any, user_id: str, today: pd.Timestamp) ->
     today_str = today.date().isoformat()
     yday_str  = (today - pd.Timedelta(days=1)).date().isoformat()
     # Pull rows for yesterday and today (plus any others if you prefer)
-    resp = supabase.table("scheduled_tasks").select("*").eq("user_id", user_id) \
-        .in_("local_date", [yday_str, today_str]).execute()
-    logging.info("Fetched %d rows from scheduled_tasks for dates %s, %s", len(resp.data or []), yday_str, today_str)
-    df = pd.DataFrame(resp.data or [])
+    rows = column_registry.fetch(as_store(supabase), "old_schedule", filters=_old_schedule_filters(user_id, today))
+    logging.info("Fetched %d rows from scheduled_tasks for dates %s, %s", len(rows), yday_str, today_str)
+    df = pd.DataFrame(rows)
     if not df.empty and 'title' in df.columns:
         logging.info("Fetched titles: %s", df['title'].tolist()[:10])
 
@@ -393,7 +446,34 @@ def _name_for_log(row_or_task) -> str:
     name = (get("task") or get("title") or "").strip()
     return name if name else f"Template {get('id') or get('template_id') or 'unknown'}"
 
-def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[str] = None) -> List[Dict]:
+def _is_one_off(template: Dict) -> bool:
+    """repeat_unit (else legacy repeat) is 'none' - or missing, which the planner reads as 'None'."""
+    unit = template.get("repeat_unit")
+    return str(unit if unit is not None else template.get("repeat")).lower() == "none"
+
+
+def prefetch_planning_reads(store: Any, user_id: Optional[str], run_date: date, tz: Any = None) -> None:
+    """
+    Issue preprocess_recurring_tasks' reads ahead of it on a dayflow.prefetch.PrefetchStore:
+    old schedule and unscheduled rows alongside the templates, then the live and archive
+    one-off history side by side once the templates are in. The queries are built by the
+    same helpers preprocess_recurring_tasks uses; if they ever differ it just reads twice.
+    """
+    if not user_id:
+        return
+    today = pd.Timestamp(run_date, tz=run_timezone(tz)).normalize()
+    today_str = str(today.date())
+    store.submit(lambda s: column_registry.fetch(s, "old_schedule", filters=_old_schedule_filters(user_id, today)))
+    store.submit(lambda s: column_registry.fetch(s, "unscheduled", filters=_unscheduled_filters(user_id, today_str)))
+    one_offs = [t for t in column_registry.fetch(store, "templates", filters=_template_filters(user_id)) if _is_one_off(t)]
+    if not one_offs:
+        return
+    filters = _one_off_history_filters(user_id, partitions.one_off_history_start(one_offs, store), today_str)
+    for table in ONE_OFF_HISTORY_TABLES:
+        store.submit(lambda s, table=table: list(s.stream(table, ONE_OFF_HISTORY_COLUMNS, filters=filters)))
+
+
+def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[str] = None, tz: Any = None) -> List[Dict]:
     """
     Adapter version of your original function:
     - loads templates + "old schedule" from Supabase
@@ -401,7 +481,11 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
     - returns a list of instance dicts for upsert into scheduled_tasks
 
     NOTE: If user_id not provided, falls back to TEST_USER_ID environment variable.
+    NOTE: `supabase` is a dayflow Store; a raw Supabase client is wrapped automatically.
+    NOTE: `tz` is the user's timezone (ZoneInfo or IANA name; default LOCAL_TIMEZONE).
     """
+    supabase = as_store(supabase)
+    local_tz = run_timezone(tz)
     if not user_id:
         user_id = os.getenv("TEST_USER_ID")
     if not user_id:
@@ -409,7 +493,7 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
         return []
 
     # create the Timestamp for today (local midnight)
-    today = pd.Timestamp(run_date, tz=LOCAL_TIMEZONE).normalize()
+    today = pd.Timestamp(run_date, tz=local_tz).normalize()
     # instantiation debug collector
     instantiation_events: List[Dict[str, Any]] = []
     # skip debug collector
@@ -457,8 +541,8 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
         "task": None,
         "title": None,
         "origin_template_id": None,
-        "date": pd.Timestamp(run_date, tz=LOCAL_TIMEZONE).date(),
-        "local_date": pd.Timestamp(run_date, tz=LOCAL_TIMEZONE).date(),
+        "date": pd.Timestamp(run_date, tz=local_tz).date(),
+        "local_date": pd.Timestamp(run_date, tz=local_tz).date(),
         "is_template": False,
         "is_completed": False,
         "is_deleted": False,
@@ -497,31 +581,31 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
     try:
         today_str = str(today.date())
 
+        one_off_mask = tasks_df["repeat_unit"].astype(str).str.lower().eq("none")
+
         # Fetch tasks used on other days with their completion and deletion status
-        used_live = supabase.table("scheduled_tasks") \
-            .select("template_id, local_date, is_completed, is_deleted") \
-            .eq("user_id", user_id) \
-            .neq("local_date", today_str) \
-            .execute()
-        used_arch = supabase.table("scheduled_tasks_archive") \
-            .select("template_id, local_date, is_completed, is_deleted") \
-            .eq("user_id", user_id) \
-            .neq("local_date", today_str) \
-            .execute()
-
-        # Build set of templates that were COMPLETED on other days
-        completed_other_ids = {row["template_id"] 
-                               for row in (used_live.data or []) + (used_arch.data or [])
-                               if row.get("template_id") and row.get("is_completed")}
-        
-        # Build set of templates that were USED (not deleted) on other days
-        used_not_deleted_ids = {row["template_id"]
-                                for row in (used_live.data or []) + (used_arch.data or [])
-                                if row.get("template_id") and not row.get("is_deleted")}
+        # Full history (live + archive) is streamed page by page in constant memory;
+        # a capped/truncated read raises instead of silently under-blocking.
+        # Only one-offs are ever blocked, so the scan starts at the earliest day one of
+        # them could have been used (partition pruning) and is skipped if there are none.
+        completed_other_ids = set()   # templates that were COMPLETED on other days
+        used_not_deleted_ids = set()  # templates that were USED (not deleted) on other days
+        history_tables = ONE_OFF_HISTORY_TABLES if one_off_mask.any() else ()
+        if history_tables:
+            since = partitions.one_off_history_start(tasks_df.loc[one_off_mask].to_dict(orient="records"), supabase)
+            used_filters = _one_off_history_filters(user_id, since, today_str)
+        for table in history_tables:
+            for row in supabase.stream(table, ONE_OFF_HISTORY_COLUMNS, filters=used_filters):
+                tid = row.get("template_id")
+                if not tid:
+                    continue
+                if row.get("is_completed"):
+                    completed_other_ids.add(tid)
+                if not row.get("is_deleted"):
+                    used_not_deleted_ids.add(tid)
 
         # Normalize types for comparison
         tasks_df["id"] = tasks_df["id"].astype(str)
-        one_off_mask = tasks_df["repeat_unit"].astype(str).str.lower().eq("none")
         
         # Block if: one-off AND (completed elsewhere OR has date field != today OR used without date field)
         completed_mask = tasks_df["id"].isin(completed_other_ids)
@@ -747,7 +831,7 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
 
         # establish, test and manipulate the timing (UTC instant for DB)
         try:
-            start_time_local = pd.Timestamp(f"{today.date()} {task_time_str}", tz=LOCAL_TIMEZONE)
+            start_time_local = pd.Timestamp(f"{today.date()} {task_time_str}", tz=local_tz)
             start_time_utc = start_time_local.astimezone(UTC_TIMEZONE)
             end_time_utc = start_time_utc + timedelta(minutes=duration_minutes)
         except Exception as e:
@@ -823,9 +907,9 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
         if pd.isna(reference_date):
             reference_date = today
         if reference_date.tzinfo is None:
-            reference_date = reference_date.tz_localize(LOCAL_TIMEZONE)
+            reference_date = reference_date.tz_localize(local_tz)
         else:
-            reference_date = reference_date.tz_convert(LOCAL_TIMEZONE)
+            reference_date = reference_date.tz_convert(local_tz)
         
         # DEBUG: Log reference date check for daily tasks
         if repeat_unit == "daily":
@@ -961,7 +1045,7 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
                 "is_fixed": False,
                 "is_floating": True,
                 "repeat_unit": repeat_unit,
-                "tz_id": os.getenv("TZ", "Europe/London"),
+                "tz_id": local_tz.key,
                 "kind": "floating",
                 "priority": _normalize_priority(task.get("priority")),
                 # keep the window for the floating placer
@@ -990,7 +1074,7 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
                 "is_reschedulable": True,
                 "is_fixed": tmpl_is_fixed,
                 "repeat_unit": repeat_unit,
-                "tz_id": os.getenv("TZ", "Europe/London"),
+                "tz_id": local_tz.key,
                 "kind": tmpl_kind or None,
                 "priority": _normalize_priority(task.get("priority")),
             }
@@ -1176,18 +1260,11 @@ def preprocess_recurring_tasks(run_date: date, supabase: Any, user_id: Optional[
     unscheduled_tasks = []
     try:
         today_str = str(today.date())
-        unscheduled_resp = supabase.table("scheduled_tasks") \
-            .select("*") \
-            .eq("user_id", user_id) \
-            .eq("local_date", today_str) \
-            .is_("start_time", "null") \
-            .eq("is_completed", False) \
-            .eq("is_deleted", False) \
-            .execute()
+        unscheduled_rows = column_registry.fetch(supabase, "unscheduled", filters=_unscheduled_filters(user_id, today_str))
         
-        if unscheduled_resp.data:
-            logging.info("Found %d unscheduled task(s) that need time slots", len(unscheduled_resp.data))
-            for task in unscheduled_resp.data:
+        if unscheduled_rows:
+            logging.info("Found %d unscheduled task(s) that need time slots", len(unscheduled_rows))
+            for task in unscheduled_rows:
                 # Fetch template details to get window constraints
                 tid = task.get("template_id")
                 if tid and tid in tasks_df["id"].values:
@@ -1237,7 +1314,9 @@ def schedule_day(
     supabase=None,                     # NEW: pass a supabase client to enable DB writes
     user_id=None,                      # NEW: required for DB writes
     whitelist_template_ids=None,       # NEW: optional set/list of template_ids to allow
-    dry_run=False                       # NEW: override DRY_RUN env for this call (True/False). If None, read env.
+    dry_run=False,                      # NEW: override DRY_RUN env for this call (True/False). If None, read env.
+    tz=None,                            # the user's timezone (ZoneInfo or IANA name); default LOCAL_TIMEZONE
+    progress=None,                      # progress(stage, **counts) after placement and after the writes (dayflow/progress.py)
 ):
 
     import os
@@ -1247,11 +1326,8 @@ def schedule_day(
     import pandas as pd
 
     # helper constants (assumes these exist in your module; fallback if not)
-    try:
-        tz = LOCAL_TIMEZONE
-    except NameError:
-        from zoneinfo import ZoneInfo
-        tz = ZoneInfo("Europe/London")
+    tz = run_timezone(tz)
+    progress = progress or run_progress.ignore
     try:
         utc_tz = UTC_TIMEZONE
     except NameError:
@@ -1289,26 +1365,6 @@ def schedule_day(
 
     import pandas as pd  # ensure this import exists at top of file
 
-    def _is_blank(v):
-        if v is None:
-            return True
-        try:
-            if pd.isna(v):
-                return True
-        except Exception:
-            pass
-        return isinstance(v, str) and v.strip() == ""
-
-    def _safe_title(row):
-        # Prefer title, then task; treat NaN/empty as blank
-        for key in ("title", "task"):
-            v = row.get(key)
-            if not _is_blank(v):
-                return str(v)
-        # Final fallback
-        return f"Template {row.get('origin_template_id') or row.get('template_id') or row.get('id') or 'unknown'}"
-
-
     def _row_template_id(row):
         # Prefer origin_template_id -> template_id -> id
         tid = row.get("origin_template_id") or row.get("template_id") or row.get("id")
@@ -1322,13 +1378,6 @@ def schedule_day(
             pass
         return str(tid)
 
-    def _to_utc_iso(ts):
-        # Ensure tz-aware, convert to UTC, ISO string
-        if pd.isna(ts):
-            return None
-        ts = pd.to_datetime(ts, utc=True)
-        return ts.tz_convert(utc_tz).isoformat()
-
     unscheduled_tasks = []
     # preserved_tasks = preserved_tasks or []
 
@@ -1336,6 +1385,7 @@ def schedule_day(
     # Guard: nothing to schedule
     if tasks_df is None or len(tasks_df) == 0:
         logging.info("schedule_day: received empty tasks_df; nothing to schedule.")
+        progress("placed", placed=0, unscheduled=0)
         return []
 
     # Robustly derive is_template when column missing
@@ -1466,7 +1516,7 @@ def schedule_day(
     for col in ['start_time', 'end_time']:
         if col in prescheduled_df.columns:
             prescheduled_df[col] = pd.to_datetime(prescheduled_df[col], errors='coerce', utc=True)
-            prescheduled_df[col] = prescheduled_df[col].dt.tz_convert(LOCAL_TIMEZONE)
+            prescheduled_df[col] = prescheduled_df[col].dt.tz_convert(tz)
         else:
             prescheduled_df[col] = pd.NaT
 
@@ -1491,7 +1541,7 @@ def schedule_day(
         #    prescheduled_df['start_time'] = prescheduled_df['start_time'].dt.tz_localize(UTC_TIMEZONE)
 
         # convert all start_time values to LOCAL timezone for safe comparison
-        prescheduled_df['start_time'] = prescheduled_df['start_time'].dt.tz_convert(LOCAL_TIMEZONE)
+        prescheduled_df['start_time'] = prescheduled_df['start_time'].dt.tz_convert(tz)
 
     # match on 'date' column if it exists
     if 'date' in prescheduled_df.columns:
@@ -2165,12 +2215,14 @@ def schedule_day(
 
     # final sort by start time
     full_schedule_df = full_schedule_df.sort_values(by='start_time').reset_index(drop=True)
+    progress("placed", placed=len(full_schedule_df), unscheduled=len(unscheduled_tasks))
 
 
     # ===== NEW: Supabase integration (UTC timestamptz + whitelist + pre-upsert dedupe) =====
     # Only perform DB writes if supabase and user_id are provided.
     if supabase is None or user_id is None:
         return full_schedule_df
+    supabase = as_store(supabase)
 
     # Compute local_date from day_start (the date we're scheduling for)
     local_date = day_start.date()
@@ -2179,13 +2231,12 @@ def schedule_day(
     # Fetch existing scheduled_tasks to preserve their descriptions (notes)
     existing_notes = {}
     try:
-        existing_resp = supabase.table("scheduled_tasks") \
-            .select("template_id, description") \
-            .eq("user_id", user_id) \
-            .eq("local_date", local_date_str) \
-            .execute()
-        if existing_resp.data:
-            for task in existing_resp.data:
+        existing_rows = supabase.select(
+            "scheduled_tasks", "template_id, description",
+            filters=[("eq", "user_id", user_id), ("eq", "local_date", local_date_str)],
+        )
+        if existing_rows:
+            for task in existing_rows:
                 tid = task.get("template_id")
                 desc = task.get("description")
                 if tid and desc:
@@ -2195,130 +2246,41 @@ def schedule_day(
     except Exception as e:
         print(f"schedule_day: Warning - failed to fetch existing notes: {e}")
 
-    # Build candidate rows from the computed schedule
-    # Separate existing tasks (with id but no/invalid template_id) from new tasks
-    candidate_rows = []
-    existing_task_updates = []
-    
-    for _, row in full_schedule_df.iterrows():
-        row_dict = row.to_dict()
-        template_id = _row_template_id(row_dict)
-        row_id = row_dict.get("id")
-        has_existing_id = row_id and not pd.isna(row_id)
-        
-        # Check if this is an existing task (has id but template_id is None or doesn't match a template)
-        # Existing tasks need to be updated by id, not upserted by template_id
-        if has_existing_id and (template_id is None or template_id == str(row_id)):
-            # This is an existing scheduled task - handle separately
-            existing_task_updates.append((str(row_id), row_dict))
-            continue
-        
-        if template_id is None:
-            # No template_id and not an existing task - skip
-            continue
-
-        # Whitelist filter (if provided)
-        if whitelist_template_ids:
-            if isinstance(whitelist_template_ids, (set, list, tuple)):
-                if template_id not in set(whitelist_template_ids):
-                    continue
-
-        start_ts = row_dict.get("start_time")
-        if pd.isna(start_ts):
-            continue
-
-        # Convert times to UTC ISO strings and build row for actual schema
-        start_time_utc_iso = _to_utc_iso(start_ts)
-        if not start_time_utc_iso:
-            continue
-        end_ts = row_dict.get("end_time")
-        end_time_utc_iso = _to_utc_iso(end_ts) if pd.notna(end_ts) else None
-        try:
-            dur = int(row_dict.get("duration_minutes")) if row_dict.get("duration_minutes") is not None else None
-        except Exception:
-            dur = None
-        
-        # Preserve description (notes) if it exists for this template_id
-        # BUT: Clear error messages when task is successfully scheduled
-        preserved_description = existing_notes.get(str(template_id))
-        if preserved_description and ("No available time slot" in preserved_description or "window" in preserved_description.lower()):
-            # Task is now successfully scheduled - clear the error message
-            preserved_description = None
-        
-        row_data = {
-            "user_id": user_id,
-            "local_date": local_date_str,
-            "template_id": str(template_id),
-            "title": _safe_title(row_dict),
-            "start_time": start_time_utc_iso,
-            "end_time": end_time_utc_iso,
-            "duration_minutes": dur,
-            "timezone": os.getenv("TZ", "Europe/London"),
-            # include flags if present on the row
-            "is_appointment": bool(row_dict.get("is_appointment")),
-            "is_routine": bool(row_dict.get("is_routine")),
-            "is_fixed": bool(row_dict.get("is_fixed")),
-            "priority": _normalize_priority(row_dict.get("priority")),
-        }
-        
-        # Only include description if we have one to preserve (don't overwrite with None)
-        if preserved_description is not None:
-            row_data["description"] = preserved_description
-        
-        candidate_rows.append(row_data)    # Early exit if nothing to write
+    # Build candidate rows from the computed schedule, column-wise (dayflow/serialize.py).
+    # Existing tasks (with id but no/invalid template_id) are updated by id, not upserted.
+    candidate_rows, existing_task_updates = serialize.schedule_rows(
+        full_schedule_df,
+        user_id=user_id,
+        local_date=local_date_str,
+        timezone=tz.key,
+        notes=existing_notes,
+        whitelist=whitelist_template_ids,
+    )
+    # Early exit if nothing to write
     if not candidate_rows:
         print("schedule_day: no candidate rows to upsert.")
         return full_schedule_df
 
-    # Always attempt to upsert so changed fields (e.g., priority) get updated.
-    rows_to_write = candidate_rows
-
-
     # 🚫 No dry-run branch — we always write if we have rows and a client
     if supabase is None:
         raise RuntimeError("schedule_day: supabase client is None but a write is required")
-    # Filter out fields not present in the DB to avoid column errors
-    allowed_cols = _discover_table_columns(supabase, "scheduled_tasks")
-
-    rows_to_write = [{k: v for k, v in r.items() if k in allowed_cols} for r in rows_to_write]
-
-    # Filter to only real table columns and avoid GENERATED columns like "date"
+    # Filter to only real table columns and avoid GENERATED columns like "date".
+    # Description is only sent when there is one to preserve (don't overwrite with None).
     allowed_cols = _discover_table_columns(supabase, "scheduled_tasks")
     generated_cols = {"date"}
-    filtered_rows = [
-        {k: v for k, v in r.items() if (k in allowed_cols and k not in generated_cols)}
-        for r in rows_to_write
-    ]
+    filtered_rows = candidate_rows.records(allowed_cols, exclude=generated_cols, omit_none=("description",))
     if not filtered_rows:
         print("schedule_day: nothing to upsert after column filtering.")
         return full_schedule_df
 
-    # ✅ Sanitize: replace NaN with None to keep JSON valid
-    import pandas as pd
-    def _json_sanitize(obj):
-        out = {}
-        for k, v in obj.items():
-            try:
-                if pd.isna(v):
-                    out[k] = None
-                    continue
-            except Exception:
-                pass
-            out[k] = v
-        return out
-
-    filtered_rows = [_json_sanitize(r) for r in filtered_rows]
-
     # Filter out any tasks whose template_id matches an existing deleted record
     # This prevents the upsert from overwriting is_deleted=true back to false
     try:
-        deleted_template_ids_resp = supabase.table("scheduled_tasks") \
-            .select("template_id") \
-            .eq("user_id", user_id) \
-            .eq("local_date", str(local_date)) \
-            .eq("is_deleted", True) \
-            .execute()
-        deleted_template_ids = {r["template_id"] for r in (deleted_template_ids_resp.data or []) if r.get("template_id")}
+        deleted_rows = supabase.select(
+            "scheduled_tasks", "template_id",
+            filters=[("eq", "user_id", user_id), ("eq", "local_date", str(local_date)), ("eq", "is_deleted", True)],
+        )
+        deleted_template_ids = {r["template_id"] for r in deleted_rows if r.get("template_id")}
         
         if deleted_template_ids:
             before_count = len(filtered_rows)
@@ -2347,11 +2309,21 @@ def schedule_day(
     print(f"schedule_day: DELETING old tasks for {local_date_str}")
     if existing_task_updates:
         # Get IDs of tasks to preserve
-        preserve_ids = [task_id for task_id, _ in existing_task_updates]
-        resp = supabase.table("scheduled_tasks").select("id").eq("user_id", user_id).eq("local_date", str(local_date)).eq("is_completed", False).eq("is_deleted", False).execute()
-        ids_to_delete = [row["id"] for row in (resp.data or []) if row["id"] not in preserve_ids]
+        preserve_ids = existing_task_updates.column("id")
+        rows = supabase.select(
+            "scheduled_tasks", "id",
+            filters=[
+                ("eq", "user_id", user_id),
+                ("eq", "local_date", str(local_date)),
+                ("eq", "is_completed", False),
+                ("eq", "is_deleted", False),
+            ],
+        )
+        ids_to_delete = [row["id"] for row in rows if row["id"] not in preserve_ids]
         if ids_to_delete:
-            supabase.table("scheduled_tasks").delete().in_("id", ids_to_delete).execute()
+            supabase.delete(
+                "scheduled_tasks", filters=[("eq", "local_date", str(local_date)), ("in", "id", ids_to_delete)]
+            )
         deleted_count = len(ids_to_delete)
     else:
         deleted_count = archive_delete_for_user_day(supabase, user_id, local_date, day_start=day_start)
@@ -2371,20 +2343,16 @@ def schedule_day(
     # Dedupe filtered_rows by (user_id, local_date, template_id) to prevent constraint violations
     filtered_rows = _dedupe_by_conflict(filtered_rows)
 
+    upserted = updated = unscheduled_written = 0
     try:
-        result = (
-            supabase.table("scheduled_tasks")
-            
-
-            .upsert(
-                filtered_rows,
-                on_conflict="user_id,local_date,template_id",
-                ignore_duplicates=False
-            )
-            .execute()
-             )
+        result = upsert_rows(
+            supabase, "scheduled_tasks",
+            filtered_rows,
+            on_conflict="user_id,local_date,template_id",
+            ignore_duplicates=False,
+        )
 
-        upserted = len(result.data or [])
+        upserted = len(result)
         print(
             f"schedule_day upserted={upserted} "
             f"attempted={len(candidate_rows)} "
@@ -2394,24 +2362,11 @@ def schedule_day(
         # Update existing tasks by their id
         if existing_task_updates:
             print(f"schedule_day: UPDATING {len(existing_task_updates)} existing task(s)")
-            for task_id, row_dict in existing_task_updates:
-                start_ts = row_dict.get("start_time")
-                start_time_utc_iso = _to_utc_iso(start_ts)
-                if not start_time_utc_iso:
+            update_dates = [(local_date - timedelta(days=1)).isoformat(), local_date_str]
+            for update_data in existing_task_updates.records():
+                task_id = update_data.pop("id")
+                if not update_data["start_time"]:
                     continue
-                end_ts = row_dict.get("end_time")
-                end_time_utc_iso = _to_utc_iso(end_ts) if pd.notna(end_ts) else None
-                try:
-                    dur = int(row_dict.get("duration_minutes")) if row_dict.get("duration_minutes") is not None else None
-                except Exception:
-                    dur = None
-                
-                update_data = {
-                    "start_time": start_time_utc_iso,
-                    "end_time": end_time_utc_iso,
-                    "duration_minutes": dur,
-                    "priority": _normalize_priority(row_dict.get("priority")),
-                }
                 # Clear error messages when task is successfully scheduled
                 update_data["description"] = None
                 
@@ -2419,7 +2374,13 @@ def schedule_day(
                 update_data = {k: v for k, v in update_data.items() if v is not None or k == "description"}
                 
                 if update_data:
-                    supabase.table("scheduled_tasks").update(update_data).eq("id", task_id).execute()
+                    # Existing rows were read from yesterday + today (carried rows keep their
+                    # stored local_date), so this bound prunes to at most two partitions
+                    supabase.update(
+                        "scheduled_tasks", update_data,
+                        filters=[("in", "local_date", update_dates), ("eq", "id", task_id)],
+                    )
+                    updated += 1
         
         # Write unscheduled tasks to database so UI can display them with explanations
         if unscheduled_tasks:
@@ -2467,7 +2428,7 @@ def schedule_day(
                     "start_time": None,
                     "end_time": None,
                     "duration_minutes": int(duration) if duration else None,
-                    "timezone": os.getenv("TZ", "Europe/London"),
+                    "timezone": tz.key,
                     "is_appointment": False,
                     "is_routine": False,
                     "is_fixed": False,
@@ -2477,18 +2438,24 @@ def schedule_day(
                 })
             
             if unscheduled_rows:
-                filtered_unscheduled = [{k: v for k, v in r.items() if k in allowed_cols} for r in unscheduled_rows]
-                filtered_unscheduled = [_json_sanitize(r) for r in filtered_unscheduled]
+                filtered_unscheduled = serialize.Rows.from_dicts(unscheduled_rows).records(allowed_cols)
                 
                 print(f"schedule_day: WRITING {len(filtered_unscheduled)} unscheduled task(s) with explanations")
-                supabase.table("scheduled_tasks").upsert(
+                upsert_rows(
+                    supabase, "scheduled_tasks",
                     filtered_unscheduled,
                     on_conflict="user_id,local_date,template_id",
-                    ignore_duplicates=False
-                ).execute()
+                    ignore_duplicates=False,
+                )
+                unscheduled_written = len(filtered_unscheduled)
+
+        progress("written", upserted=upserted, updated=updated, deleted=deleted_count,
+                 unscheduled=unscheduled_written)
 
     except Exception as e:
         err_msg = getattr(e, "message", None) or str(e)
+        progress("written", upserted=upserted, updated=updated, deleted=deleted_count,
+                 unscheduled=unscheduled_written, error=err_msg)
         try:
             from pprint import pformat
             print("schedule_day upsert failed. Exception:", err_msg)
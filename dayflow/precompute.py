@@ -0,0 +1,414 @@
+# dayflow/precompute.py
+"""
+Overnight precomputation: plan each user's day before anyone asks for it, and
+make the morning run a cheap commit.
+
+The 07:00 batch and the first page load of the day each used to do a full
+planning run, at the busiest time of the morning. Precompute moves that work
+into the night:
+
+    python -m dayflow.scheduler_main --all-users --precompute     # after local midnight, e.g. 03:00
+
+A precompute run is an ordinary run_for_user with RunOptions(precompute=True).
+Carry-forward runs as usual. It is idempotent, and once the previous day is
+over its result is final. Before anything else, the run records a snapshot of
+its inputs: a hash of each of the user's templates, and a hash of each
+scheduled row for the day and the day before. The planning then runs against a
+StagingStore. Reads go to the database, but the run's writes are recorded in
+order instead of applied: the deferred-task deletes, schedule_day's delete,
+upsert and update calls. The recorded writes, the snapshot and the day start
+the plan assumed are saved to staged_schedules (supabase/staged-schedules.sql).
+Nothing the user sees changes.
+
+The next normal run for that user and day commits the staged plan. It might be
+the 07:00 batch, or the first /run-scheduler or revise on first access. After
+carry-forward, the run re-reads the inputs and compares them with the snapshot:
+  - unchanged: the recorded writes are replayed (a few upserts) and the plan is
+    committed
+  - only removals: a row of the day was deleted, completed or removed, or a
+    template was soft-deleted. The writes that touch those rows and templates
+    are dropped, and the rest is replayed. The freed time is not re-planned
+  - anything else (new or edited templates, new rows, yesterday's rows), a
+    different timezone or a whitelist: the staged plan is discarded and the run
+    plans as before
+The server's runs are forced, so a first access after 08:00 starts the day at
+the current time. Placements at or after it are kept, and so are appointments,
+which the planner never moves. Each task staged before it moves to the next
+free slot, in its staged order, keeping its length. A task with no slot left
+before 23:00 is written unscheduled, and so is a fixed task whose time has
+passed (the planner skips those).
+A staged plan is used at most once. A run claims it first with a conditional
+update (staged -> committing) and only the run whose update changed the row goes
+on, so two first runs for the same day (the 07:00 batch and a /run-scheduler job
+are different processes) can't both replay it; the other plans in full. The
+claimed plan then moves to committed or discarded (also if the replay fails).
+
+Config (env, all optional):
+  DAYFLOW_PRECOMPUTE   0 to ignore staged plans and always plan in full (default 1)
+"""
+import os
+import copy
+import json
+import hashlib
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from dayflow.store import Store, DEFAULT_KEYSET
+
+TABLE = "staged_schedules"
+STAGED, COMMITTING, COMMITTED, DISCARDED = "staged", "committing", "committed", "discarded"
+
+
+def enabled() -> bool:
+    return str(os.getenv("DAYFLOW_PRECOMPUTE", "1")).lower() not in ("0", "false", "no", "off")
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _row_hash(row: Dict) -> str:
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+# ----------------------------------------
+# Input snapshot
+# ----------------------------------------
+def snapshot(store: Store, user_id: str, run_date: date) -> Dict[str, Dict[str, Any]]:
+    """
+    What the plan for `run_date` is computed from: {"templates": {id: hash},
+    "rows": {id: {"hash", "template_id", "local_date", "gone"}}} for the user's
+    templates (deleted ones too) and their scheduled rows for the day and the day before.
+    """
+    templates = store.select("task_templates", "*", filters=[("eq", "user_id", user_id)])
+    days = [(run_date - timedelta(days=1)).isoformat(), run_date.isoformat()]
+    rows = store.select("scheduled_tasks", "*", filters=[("eq", "user_id", user_id), ("in", "local_date", days)])
+    return {
+        "templates": {str(t["id"]): _row_hash(t) for t in templates},
+        "deleted_templates": sorted(str(t["id"]) for t in templates if t.get("is_deleted")),
+        "rows": {
+            str(r["id"]): {
+                "hash": _row_hash(r),
+                "template_id": r.get("template_id"),
+                "local_date": str(r.get("local_date")),
+                "gone": bool(r.get("is_deleted") or r.get("is_completed")),
+            }
+            for r in rows
+        },
+    }
+
+
+def diff(before: Dict, after: Dict, run_date: date) -> Tuple[bool, Set[str], Set[str]]:
+    """
+    (ok, removed_row_ids, removed_template_ids). ok is False when something changed
+    that needs a real planning run. Otherwise the sets hold what went away since the
+    snapshot: rows of the day deleted, completed or removed, and soft-deleted templates.
+    """
+    day = run_date.isoformat()
+    removed_rows: Set[str] = set()
+    removed_templates: Set[str] = set(after["deleted_templates"]) - set(before["deleted_templates"])
+
+    for tid, h in after["templates"].items():
+        if tid not in before["templates"]:
+            return False, set(), set()              # a new template
+        if h != before["templates"][tid] and tid not in removed_templates:
+            return False, set(), set()              # an edited template
+    removed_templates |= set(before["templates"]) - set(after["templates"])
+
+    for rid, row in after["rows"].items():
+        old = before["rows"].get(rid)
+        if old is None:
+            return False, set(), set()              # a new scheduled row
+        if row["hash"] == old["hash"]:
+            continue
+        if row["local_date"] == day and row["gone"] and not old["gone"]:
+            removed_rows.add(rid)                   # deleted or completed since
+            if row.get("template_id"):
+                removed_templates.add(str(row["template_id"]))
+            continue
+        return False, set(), set()                  # any other change
+    for rid, old in before["rows"].items():
+        if rid in after["rows"]:
+            continue
+        if old["local_date"] != day:
+            return False, set(), set()
+        removed_rows.add(rid)
+        if old.get("template_id"):
+            removed_templates.add(str(old["template_id"]))
+    return True, removed_rows, removed_templates
+
+
+# ----------------------------------------
+# Recording writes
+# ----------------------------------------
+def _jsonable(value: Any) -> Any:
+    return json.loads(json.dumps(value, default=str))
+
+
+class StagingStore(Store):
+    """Store wrapper that passes reads through and records writes (in order) instead of applying them."""
+
+    def __init__(self, inner: Store):
+        self.inner = inner
+        self.backend = inner.backend
+        self.writes: List[Dict[str, Any]] = []
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        return self.inner.select(table, columns, filters=filters, order=order, limit=limit)
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        return self.inner.select_page(table, columns, filters=filters, order=order, limit=limit, count=count)
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable = (),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key=DEFAULT_KEYSET,
+    ):
+        return self.inner.stream(table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        return self.inner.latest_per_template(template_ids, since=since, until=until)
+
+    def table_columns(self, table):
+        return self.inner.table_columns(table)
+
+    def replication_lag(self):
+        return self.inner.replication_lag()
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        rows = _jsonable(list(rows))
+        self.writes.append({"op": "upsert", "table": table, "rows": rows,
+                            "on_conflict": on_conflict, "ignore_duplicates": ignore_duplicates})
+        return rows
+
+    def update(self, table, values, *, filters):
+        self.writes.append({"op": "update", "table": table, "values": _jsonable(values),
+                            "filters": _jsonable(list(filters))})
+        return []
+
+    def delete(self, table, *, filters):
+        filters = _jsonable(list(filters))
+        self.writes.append({"op": "delete", "table": table, "filters": filters})
+        ids = next((f[2] for f in filters if f[0] == "in" and f[1] == "id"), None)
+        return len(ids) if ids is not None else 0
+
+    def close(self) -> None:
+        self.inner.close()
+
+    @property
+    def unrecovered_errors(self) -> int:
+        return getattr(self.inner, "unrecovered_errors", 0)
+
+
+def _without(writes: List[Dict], row_ids: Set[str], template_ids: Set[str]) -> List[Dict]:
+    """The recorded writes minus anything touching the removed rows or templates."""
+    out = []
+    for w in writes:
+        if w["op"] == "upsert":
+            rows = [r for r in w["rows"]
+                    if str(r.get("id")) not in row_ids and str(r.get("template_id")) not in template_ids]
+            if rows:
+                out.append(dict(w, rows=rows))
+            continue
+        filters = []
+        for op, col, val in w["filters"]:
+            if col == "id" and op == "eq" and str(val) in row_ids:
+                break
+            if col == "id" and op == "in":
+                val = [v for v in val if str(v) not in row_ids]
+                if not val:
+                    break
+            filters.append([op, col, val])
+        else:
+            out.append(dict(w, filters=filters))
+    return out
+
+
+def _parse_dt(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _placements(writes: List[Dict]) -> List[Dict]:
+    """The timed scheduled_tasks rows in `writes` (upserted rows, update values), by start time."""
+    out = []
+    for w in writes:
+        if w["table"] != "scheduled_tasks":
+            continue
+        if w["op"] == "upsert":
+            out.extend(r for r in w["rows"] if _parse_dt(r.get("start_time")))
+        elif w["op"] == "update" and _parse_dt(w["values"].get("start_time")):
+            out.append(w["values"])
+    return sorted(out, key=lambda r: _parse_dt(r["start_time"]))
+
+
+def _free_slot(busy: List[Tuple[datetime, datetime]], at: datetime, length: timedelta,
+               end: datetime) -> Optional[Tuple[datetime, datetime]]:
+    for s, e in sorted(busy):
+        if at + length <= s:
+            break
+        at = max(at, e)
+    return (at, at + length) if at + length <= end else None
+
+
+def _from_start(writes: List[Dict], start: datetime, end: datetime) -> Tuple[List[Dict], int, int]:
+    """
+    The writes re-timed for a day that starts at `start` rather than the plan's start
+    (see the module docstring). Returns (writes, moved, unscheduled).
+    """
+    writes = copy.deepcopy(writes)
+    busy: List[Tuple[datetime, datetime]] = []
+    late: List[Tuple[Dict, timedelta]] = []
+    for row in _placements(writes):
+        s = _parse_dt(row["start_time"])
+        e = _parse_dt(row.get("end_time")) or s + timedelta(minutes=int(row.get("duration_minutes") or 0))
+        if row.get("is_appointment") or s >= start:
+            busy.append((s, e))
+        else:
+            late.append((row, e - s))
+    unscheduled = 0
+    for row, length in late:
+        slot = None if row.get("is_fixed") and not row.get("is_routine") else _free_slot(busy, start, length, end)
+        if slot is None:
+            row["start_time"] = row["end_time"] = None
+            unscheduled += 1
+            continue
+        busy.append(slot)
+        row["start_time"], row["end_time"] = (t.astimezone(timezone.utc).isoformat() for t in slot)
+    return writes, len(late) - unscheduled, unscheduled
+
+
+def _timed_rows(writes: List[Dict]) -> int:
+    return sum(1 for w in writes if w["op"] == "upsert" for r in w["rows"] if r.get("start_time"))
+
+
+def _replay(store: Store, writes: List[Dict]) -> None:
+    for w in writes:
+        if w["op"] == "upsert":
+            store.upsert(w["table"], w["rows"], on_conflict=w["on_conflict"], ignore_duplicates=w["ignore_duplicates"])
+        elif w["op"] == "update":
+            store.update(w["table"], w["values"], filters=[tuple(f) for f in w["filters"]])
+        elif w["op"] == "delete":
+            store.delete(w["table"], filters=[tuple(f) for f in w["filters"]])
+
+
+# ----------------------------------------
+# Stage / commit
+# ----------------------------------------
+def stage(
+    store: Store,
+    user_id: str,
+    run_date: date,
+    *,
+    inputs: Dict,
+    writes: List[Dict],
+    day_start: datetime,
+    tz_name: str,
+    placed: Optional[int],
+) -> bool:
+    """Save a precomputed plan for (user, day), replacing any earlier one. False if it couldn't be saved."""
+    try:
+        store.upsert(TABLE, [{
+            "user_id": user_id,
+            "local_date": run_date.isoformat(),
+            "status": STAGED,
+            "day_start": day_start.isoformat(),
+            "timezone": tz_name,
+            "inputs": inputs,
+            "writes": writes,
+            "placed": placed,
+            "computed_at": _now_iso(),
+            "committed_at": None,
+        }], on_conflict="user_id,local_date")
+        return True
+    except Exception as e:
+        logging.warning("precompute: could not stage the plan (%s). Apply supabase/staged-schedules.sql.", e)
+        return False
+
+
+def _mark(store: Store, user_id: str, run_date: date, status: str, *, expect: str = COMMITTING) -> List[Dict]:
+    """Move the (user, day) plan from status `expect` to `status`; the rows changed (none if it wasn't `expect`)."""
+    return store.update(TABLE, {"status": status, "committed_at": _now_iso()}, filters=[
+        ("eq", "user_id", user_id), ("eq", "local_date", run_date.isoformat()), ("eq", "status", expect)])
+
+
+def commit(
+    store: Store,
+    user_id: str,
+    run_date: date,
+    *,
+    day_start: datetime,
+    tz_name: str,
+    whitelist: Optional[Iterable] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Commit the plan staged for (user, day) if it still holds, re-timed if the day starts
+    later than the plan assumed. Returns {"placed", "writes", "removed", "moved",
+    "unscheduled"} when committed; None when there is no usable staged plan and the
+    caller should plan in full (a stale one is marked discarded).
+    """
+    try:
+        rows = store.select(TABLE, "*", filters=[
+            ("eq", "user_id", user_id), ("eq", "local_date", run_date.isoformat()), ("eq", "status", STAGED)])
+    except Exception as e:
+        logging.debug("precompute: no staged plans available (%s)", e)
+        return None
+    if not rows:
+        return None
+    if not _mark(store, user_id, run_date, COMMITTING, expect=STAGED):
+        logging.info("precompute: the staged plan for %s was claimed by another run; planning in full.", run_date)
+        return None
+    staged = rows[0]
+    staged_start = datetime.fromisoformat(str(staged["day_start"]))
+
+    reason = None
+    if whitelist is not None:
+        reason = "a template whitelist is active"
+    elif staged.get("timezone") != tz_name:
+        reason = f"timezone changed ({staged.get('timezone')} -> {tz_name})"
+    elif day_start < staged_start:
+        reason = f"day starts at {day_start:%H:%M}, before the plan's {staged_start:%H:%M}"
+    if reason is None:
+        ok, removed_rows, removed_templates = diff(staged["inputs"], snapshot(store, user_id, run_date), run_date)
+        if not ok:
+            reason = "templates or scheduled rows changed since it was computed"
+    if reason is not None:
+        logging.info("precompute: discarding the staged plan for %s: %s.", run_date, reason)
+        _mark(store, user_id, run_date, DISCARDED)
+        return None
+
+    writes = _without(staged["writes"], removed_rows, removed_templates)
+    if removed_rows or removed_templates:
+        logging.info("precompute: %d row(s) and %d template(s) removed since the plan was computed; dropping their writes.",
+                     len(removed_rows), len(removed_templates))
+    placed = staged.get("placed")
+    if placed is not None:
+        placed -= _timed_rows(staged["writes"]) - _timed_rows(writes)
+    moved = unscheduled = 0
+    if day_start > staged_start:
+        # run_for_user's day end
+        day_end = datetime.combine(run_date, time(23, 0), tzinfo=day_start.tzinfo)
+        writes, moved, unscheduled = _from_start(writes, day_start, day_end)
+        logging.info("precompute: day starts at %s, the plan at %s: %d task(s) moved, %d left unscheduled.",
+                     f"{day_start:%H:%M}", f"{staged_start:%H:%M}", moved, unscheduled)
+        if placed is not None:
+            placed -= unscheduled
+    try:
+        _replay(store, writes)
+    except Exception:
+        _mark(store, user_id, run_date, DISCARDED)
+        raise
+    _mark(store, user_id, run_date, COMMITTED)
+    return {"placed": placed, "writes": len(writes), "removed": len(removed_rows | removed_templates),
+            "moved": moved, "unscheduled": unscheduled}
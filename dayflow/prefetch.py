@@ -0,0 +1,211 @@
+# dayflow/prefetch.py
+"""
+Per-run read-ahead: issue a run's independent reads concurrently, then let the
+planner make its usual calls against the results.
+
+A run's opening reads used to go out one after another, although none of them
+waits on another's result: templates, the old schedule, the live and archive
+one-off history, deleted-today ids, soft-deleted templates, and both
+unscheduled-row reads. PrefetchStore wraps the run's Store for the length of
+the run:
+
+    store = prefetch.PrefetchStore(store)
+    store.submit(planner.prefetch_planning_reads, user_id, run_date, tz)
+    store.submit(...)                 # each task runs fn(store, ...) on the pool
+    store.join()                      # before the CPU stages
+    ... planner code as before ...
+    store.shutdown()
+
+Every read through the store is remembered by its exact arguments: the
+planner's later call with the same table, columns, filters, order and limit
+gets a copy of the fetched rows instead of a second round trip. A call that
+arrives while the same read is still in flight waits for it. Each task is
+meant to call the same helper the planner will call, so the arguments line up.
+If they ever drift apart, the only cost is a duplicate read.
+
+Remembered reads of a table are dropped when the run writes to that table
+through the store, so a read after carry-forward or schedule_day's writes goes
+to the database again. A failed read isn't remembered: it is logged, and the
+planner's own call retries it and handles the error as before. A prefetched
+stream() is held as a list rather than paged lazily. That is fine for the
+runs' reads, which are a few narrow columns.
+
+Wall-clock read time drops to about the slowest dependency chain: templates,
+then the one-off history. Each run gets its own small thread pool, so the
+process-wide limits (transport deadlines, DAYFLOW_RATE_*) still apply to
+every query.
+
+Config (env, all optional):
+  DAYFLOW_PREFETCH           0 to issue reads one at a time, as before (default 1)
+  DAYFLOW_PREFETCH_WORKERS   concurrent reads per run (default 6)
+"""
+import os
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from dayflow.store import Store, DEFAULT_KEYSET
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def enabled() -> bool:
+    return str(os.getenv("DAYFLOW_PREFETCH", "1")).lower() not in ("0", "false", "no", "off")
+
+
+def _copy(result: Any) -> Any:
+    """Fresh row dicts per caller (the planner mutates some of the rows it reads)."""
+    if isinstance(result, list):
+        return [dict(r) if isinstance(r, dict) else r for r in result]
+    if isinstance(result, tuple):
+        return tuple(_copy(x) for x in result)
+    return result
+
+
+class PrefetchStore(Store):
+    """Store wrapper that runs read-ahead tasks concurrently and remembers their reads."""
+
+    def __init__(self, inner: Store, workers: Optional[int] = None):
+        self.inner = inner
+        self.backend = inner.backend
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, workers or _env_int("DAYFLOW_PREFETCH_WORKERS", 6)),
+            thread_name_prefix="dayflow-prefetch",
+        )
+        self._lock = threading.Lock()
+        self._reads: Dict[str, Future] = {}      # call key -> result
+        self._tables: Dict[str, str] = {}        # call key -> table
+        self._tasks: List[Future] = []
+        self.hits = 0
+        self.misses = 0
+
+    # --- read-ahead tasks ---
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Run fn(self, *args, **kwargs) on the pool; tasks may submit further tasks."""
+        def task():
+            try:
+                return fn(self, *args, **kwargs)
+            except Exception:
+                logging.warning("prefetch: %s failed; the run will read it itself", getattr(fn, "__name__", fn), exc_info=True)
+                return None
+
+        fut = self._pool.submit(task)
+        with self._lock:
+            self._tasks.append(fut)
+        return fut
+
+    def join(self) -> None:
+        """Wait for every submitted task, including ones submitted by other tasks."""
+        done = 0
+        while True:
+            with self._lock:
+                pending = self._tasks[done:]
+            if not pending:
+                return
+            for fut in pending:
+                fut.result()
+            done += len(pending)
+
+    def shutdown(self) -> None:
+        """Stop the pool; the inner store stays open (it outlives the run)."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # --- remembered reads ---
+    def _read(self, key: str, table: str, call: Callable[[], Any]) -> Any:
+        with self._lock:
+            fut = self._reads.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._reads[key] = Future()
+                self._tables[key] = table
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            try:
+                return _copy(fut.result())
+            except Exception:
+                return call()   # the owner's read failed; make our own
+        try:
+            result = call()
+        except Exception as e:
+            with self._lock:
+                if self._reads.get(key) is fut:
+                    del self._reads[key]
+                    self._tables.pop(key, None)
+            fut.set_exception(e)
+            raise
+        fut.set_result(result)
+        return _copy(result)
+
+    def _forget(self, table: str) -> None:
+        with self._lock:
+            for key in [k for k, t in self._tables.items() if t == table]:
+                del self._reads[key], self._tables[key]
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        key = repr(("select", table, columns, list(filters or ()), order, limit))
+        return self._read(key, table, lambda: self.inner.select(table, columns, filters=filters, order=order, limit=limit))
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        key = repr(("select_page", table, columns, list(filters or ()), order, limit, count))
+        return self._read(key, table, lambda: self.inner.select_page(
+            table, columns, filters=filters, order=order, limit=limit, count=count))
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable = (),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key: Sequence[str] = DEFAULT_KEYSET,
+    ):
+        call_key = repr(("stream", table, columns, list(filters or ()), desc, page_size, tuple(key)))
+        return iter(self._read(call_key, table, lambda: list(self.inner.stream(
+            table, columns, filters=filters, desc=desc, page_size=page_size, key=key))))
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        key = repr(("latest_per_template", list(template_ids or ()), since, until))
+        return self._read(key, "scheduled_tasks", lambda: self.inner.latest_per_template(
+            template_ids, since=since, until=until))
+
+    def table_columns(self, table):
+        return self.inner.table_columns(table)
+
+    def replication_lag(self):
+        return self.inner.replication_lag()
+
+    # --- writes drop what was read from the table ---
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        try:
+            return self.inner.upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+        finally:
+            self._forget(table)
+
+    def update(self, table, values, *, filters):
+        try:
+            return self.inner.update(table, values, filters=filters)
+        finally:
+            self._forget(table)
+
+    def delete(self, table, *, filters):
+        try:
+            return self.inner.delete(table, filters=filters)
+        finally:
+            self._forget(table)
+
+    def close(self) -> None:
+        self.shutdown()
+        self.inner.close()
+
+    @property
+    def unrecovered_errors(self) -> int:
+        return getattr(self.inner, "unrecovered_errors", 0)
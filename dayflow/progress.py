@@ -0,0 +1,52 @@
+# dayflow/progress.py
+"""
+Stage events for a scheduler run.
+
+run_for_user (and schedule_day inside it) report progress by calling a
+`progress(stage, **counts)` callable at each stage boundary:
+
+    carry_forward   carried, missed              previous days' rows are in today
+    prefetch        reads                        planning reads issued together
+    instances       instances, kept              templates expanded, deletions filtered
+    placed          placed, unscheduled          placement done (CPU only so far)
+    written         upserted, updated, deleted   rows written to scheduled_tasks
+    done            rc, placed                   the run is over (rc != 0: abandoned)
+
+Progress(sink) is that callable. It adds the stage's own time and the time since
+the run started to each event, then hands one dict to `sink`:
+
+    {"stage": "placed", "placed": 14, "unscheduled": 2, "ms": 31.4, "elapsed_ms": 612.0}
+
+The server's job queue keeps each job's events, and GET /jobs/<id>/events streams
+them as server-sent events (railway_server.py), so a caller can show progress
+without reading the run's log output. A sink that raises is logged and ignored:
+reporting never fails a run.
+"""
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+
+class Progress:
+    """Timed stage reporter: progress(stage, **counts) sends one event dict to `sink`."""
+
+    def __init__(self, sink: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.sink = sink
+        self.started = self._last = time.monotonic()
+
+    def __call__(self, stage: str, **counts: Any) -> None:
+        now = time.monotonic()
+        event = {"stage": stage, **counts,
+                 "ms": round((now - self._last) * 1000, 1),
+                 "elapsed_ms": round((now - self.started) * 1000, 1)}
+        self._last = now
+        if self.sink is None:
+            return
+        try:
+            self.sink(event)
+        except Exception:
+            logging.warning("progress: sink failed for stage %s", stage, exc_info=True)
+
+
+def ignore(stage: str, **counts: Any) -> None:
+    """The progress callable used when a caller doesn't want events."""
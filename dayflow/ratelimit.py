@@ -0,0 +1,237 @@
+# dayflow/ratelimit.py
+"""
+Process-wide token-bucket rate limiting for the data-access path.
+
+A nightly or backfill run across many users fires request bursts from
+carry_forward_*, preprocess_recurring_tasks and schedule_day that can trip the
+project's API limits. RateLimitedStore wraps a Store and takes one token per
+request from a shared bucket - one budget for reads, one for writes - before
+passing the call on. When a bucket is empty the caller waits (backpressure);
+it is never failed for being over budget.
+
+Tokens are taken per request actually sent. With the transport on, ResilientStore
+takes them itself (take / try_take) on every attempt, so retries and hedged reads
+are paid for too; RateLimitedStore is only used when DAYFLOW_TRANSPORT=0.
+
+Buckets are shared by everything in the process, so concurrent runs
+(threads, the chunked writer's workers) draw from one budget. Separate processes
+each have their own buckets: give each worker process rate / N.
+
+Waiting time is recorded per bucket (total, max, p95, current waiters) and shown
+on /metrics, so batch concurrency can be sized to the limit: if p95 wait grows
+while throughput stays flat, there are more workers than the budget can feed.
+
+Config (env, all optional; a rate of 0 means unlimited and no wrapping):
+  DAYFLOW_RATE_READS_PER_S     sustained read requests per second (default 0)
+  DAYFLOW_RATE_WRITES_PER_S    sustained write requests per second (default 0)
+  DAYFLOW_RATE_READ_BURST      read bucket size (default: 1 s worth, min 1)
+  DAYFLOW_RATE_WRITE_BURST     write bucket size (default: 1 s worth, min 1)
+"""
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+
+from dayflow.store import Store, DEFAULT_KEYSET, pages_via_select_page
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Token bucket with reservations: each acquire() takes a token immediately (the
+    balance may go negative) and sleeps until that token would have been refilled.
+    Callers are served in arrival order and nobody spins.
+    """
+
+    def __init__(self, name: str, rate: float, burst: Optional[float] = None):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst) if burst else self.rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._delayed = 0
+        self._waiting = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent = deque(maxlen=500)
+
+    def acquire(self, n: float = 1.0) -> float:
+        """Take n tokens, blocking as long as needed. Returns seconds spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self._acquired += 1
+            if wait > 0:
+                self._delayed += 1
+                self._waiting += 1
+        if wait > 0:
+            time.sleep(wait)
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._recent.append(wait)
+        return wait
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        """Take n tokens only if they are available now; never waits."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < n:
+                return False
+            self._tokens -= n
+            self._acquired += 1
+            self._recent.append(0.0)
+            return True
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = sorted(self._recent)
+            return {
+                "rate_per_s": self.rate,
+                "burst": self.burst,
+                "acquired": self._acquired,
+                "delayed": self._delayed,
+                "waiting_now": self._waiting,
+                "wait_total_s": round(self._wait_total, 3),
+                "wait_max_ms": round(self._wait_max * 1000, 1),
+                "wait_p95_ms": round(recent[min(len(recent) - 1, int(0.95 * len(recent)))] * 1000, 1) if recent else None,
+            }
+
+
+_UNLIMITED = object()
+_buckets: Dict[str, Any] = {}   # kind -> TokenBucket, or _UNLIMITED once resolved from env
+_buckets_lock = threading.Lock()
+
+
+def _bucket(kind: str) -> Optional[TokenBucket]:
+    """The shared 'reads' / 'writes' bucket, or None if that budget is unlimited."""
+    with _buckets_lock:
+        b = _buckets.get(kind)
+        if b is None:
+            env = "READS" if kind == "reads" else "WRITES"
+            rate = _env_float(f"DAYFLOW_RATE_{env}_PER_S", 0.0)
+            burst = _env_float(f"DAYFLOW_RATE_{env[:-1]}_BURST", 0.0) or None
+            b = _buckets[kind] = TokenBucket(kind, rate, burst) if rate > 0 else _UNLIMITED
+        return None if b is _UNLIMITED else b
+
+
+def take(kind: str) -> float:
+    """Take one 'reads' / 'writes' token, waiting if the bucket is empty. Returns seconds waited."""
+    b = _bucket(kind)
+    return b.acquire() if b is not None else 0.0
+
+
+def try_take(kind: str) -> bool:
+    """Take one token only if one is free now (for optional requests such as hedges)."""
+    b = _bucket(kind)
+    return b.try_acquire() if b is not None else True
+
+
+def configure(*, reads_per_s: Optional[float] = None, writes_per_s: Optional[float] = None,
+              read_burst: Optional[float] = None, write_burst: Optional[float] = None) -> None:
+    """Set the process-wide budgets programmatically (e.g. batch mode splitting a budget across workers)."""
+    with _buckets_lock:
+        if reads_per_s is not None:
+            _buckets["reads"] = TokenBucket("reads", reads_per_s, read_burst) if reads_per_s > 0 else _UNLIMITED
+        if writes_per_s is not None:
+            _buckets["writes"] = TokenBucket("writes", writes_per_s, write_burst) if writes_per_s > 0 else _UNLIMITED
+
+
+class RateLimitedStore(Store):
+    """Store wrapper that takes a read or write token before every request."""
+
+    def __init__(self, inner: Store):
+        self.inner = inner
+        self.backend = inner.backend
+
+    @staticmethod
+    def _take(kind: str) -> None:
+        take(kind)
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        self._take("reads")
+        return self.inner.select(table, columns, filters=filters, order=order, limit=limit)
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        self._take("reads")
+        return self.inner.select_page(table, columns, filters=filters, order=order, limit=limit, count=count)
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable = (),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key: Sequence[str] = DEFAULT_KEYSET,
+    ) -> Iterator[Dict]:
+        if pages_via_select_page(self.inner):
+            return Store.stream(self, table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+        # one server-side cursor = one token
+        self._take("reads")
+        return self.inner.stream(table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        self._take("reads")
+        return self.inner.latest_per_template(template_ids, since=since, until=until)
+
+    def table_columns(self, table):
+        self._take("reads")
+        return self.inner.table_columns(table)
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        self._take("writes")
+        return self.inner.upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+    def update(self, table, values, *, filters):
+        self._take("writes")
+        return self.inner.update(table, values, filters=filters)
+
+    def delete(self, table, *, filters):
+        self._take("writes")
+        return self.inner.delete(table, filters=filters)
+
+    def close(self) -> None:
+        self.inner.close()
+
+    @property
+    def unrecovered_errors(self) -> int:
+        return getattr(self.inner, "unrecovered_errors", 0)
+
+
+def limiting_enabled() -> bool:
+    return _bucket("reads") is not None or _bucket("writes") is not None
+
+
+def wrap(store: Optional[Store]) -> Optional[Store]:
+    """Wrap `store` in a RateLimitedStore if any budget is configured."""
+    if store is None or isinstance(store, RateLimitedStore) or not limiting_enabled():
+        return store
+    return RateLimitedStore(store)
+
+
+def metrics() -> Dict[str, Any]:
+    with _buckets_lock:
+        buckets = {k: b for k, b in _buckets.items() if b is not _UNLIMITED}
+    return {kind: b.metrics() for kind, b in buckets.items()}
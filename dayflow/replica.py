@@ -0,0 +1,272 @@
+# dayflow/replica.py
+"""
+Read/write split: planning reads on a read replica, writes on the primary.
+
+SplitStore takes a primary Store and a replica Store. Writes always go to the
+primary. Reads go to the replica unless one of the staleness guards says the
+replica might not have what the run needs:
+
+  - read-your-writes: the store remembers which local_dates it has written per
+    table during this run (carry-forward upserts, deletes, ...). A read whose
+    local_date filters could match one of those dates - or a read on a table the
+    run touched in ways it can't pin to dates - goes to the primary. History
+    scans (local_date <> today, < today) stay on the replica.
+  - the run's own day: start_run(store, run_date) marks the day a run plans.
+    Its reads of scheduled_tasks that could match that day (deleted-today,
+    unscheduled and open rows, the notes schedule_day keeps) and its
+    task_templates reads go to the primary from the start, before the run has
+    written anything: a revise must see the edit the user just made in the UI,
+    whatever the replica's lag.
+  - replication lag: the replica's lag is probed (at most every
+    DAYFLOW_REPLICA_LAG_CHECK_S) and reads fall back to the primary while it
+    exceeds DAYFLOW_REPLICA_MAX_LAG_S. If the lag can't be measured (the
+    replica_lag_seconds() function from supabase/replica-lag.sql isn't
+    installed), every read stays on the primary.
+
+Config (env, all optional):
+  DAYFLOW_REPLICA_URL            PostgREST URL of the read replica (postgrest backend)
+  DAYFLOW_REPLICA_DATABASE_URL   connection string of the replica (postgres backend)
+  DAYFLOW_REPLICA_MAX_LAG_S      max acceptable lag in seconds (default 2)
+  DAYFLOW_REPLICA_LAG_CHECK_S    how often to re-probe lag (default 10)
+"""
+import os
+import time
+import logging
+import threading
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+
+from dayflow.store import Store, DEFAULT_KEYSET, PostgresStore, as_store
+
+ALL_DATES = None   # marker: the run wrote rows on a table without pinning them to dates
+RUN_DAY_TABLES = ("scheduled_tasks",)   # read from the primary where they can match a run's day
+LIVE_TABLES = ("task_templates",)       # read from the primary during a run: what the user edits
+
+_lock = threading.Lock()
+_counters = {"reads_replica": 0, "reads_primary_written": 0, "reads_primary_run_day": 0,
+             "reads_primary_lag": 0, "writes": 0}
+_last_lag: Dict[str, Any] = {"seconds": None, "at": None}
+
+
+def _bump(name: str) -> None:
+    with _lock:
+        _counters[name] += 1
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _dates_in_filters(filters: Iterable) -> Optional[set]:
+    """local_date values an update/delete is pinned to, or None if it isn't pinned."""
+    for op, col, val in filters or ():
+        if col != "local_date":
+            continue
+        if op == "eq":
+            return {str(val)}
+        if op == "in":
+            return {str(v) for v in val}
+    return None
+
+
+def _date_matches(d: str, filters: Iterable) -> bool:
+    """Could a row with local_date == d satisfy every local_date filter in `filters`?"""
+    for op, col, val in filters or ():
+        if col != "local_date":
+            continue
+        if op == "eq" and d != str(val):
+            return False
+        if op == "neq" and d == str(val):
+            return False
+        if op == "in" and d not in {str(v) for v in val}:
+            return False
+        # ISO dates compare correctly as strings
+        if op == "lt" and not d < str(val):
+            return False
+        if op == "lte" and not d <= str(val):
+            return False
+        if op == "gt" and not d > str(val):
+            return False
+        if op == "gte" and not d >= str(val):
+            return False
+    return True
+
+
+class SplitStore(Store):
+    """Reads on the replica when it's safe, everything else on the primary."""
+
+    def __init__(self, primary: Store, replica: Store, *, max_lag: Optional[float] = None,
+                 lag_check_every: Optional[float] = None):
+        self.primary = primary
+        self.replica = replica
+        self.inner = primary           # for wrappers that introspect the backend
+        self.backend = primary.backend
+        self.max_lag = _env_float("DAYFLOW_REPLICA_MAX_LAG_S", 2.0) if max_lag is None else max_lag
+        self.lag_check_every = _env_float("DAYFLOW_REPLICA_LAG_CHECK_S", 10.0) if lag_check_every is None else lag_check_every
+        self._lock = threading.Lock()
+        self._written: Dict[str, Optional[set]] = {}   # table -> dates written (ALL_DATES = unknown)
+        self._run_dates: set = set()                   # days runs on this store plan (see start_run)
+        self._lag_ok: Optional[bool] = None
+        self._lag_checked_at = 0.0
+
+    def start_run(self, run_date: date) -> None:
+        """A run plans `run_date`: its reads of that day go to the primary from now on."""
+        with self._lock:
+            self._run_dates.add(run_date.isoformat())
+
+    # -----------------------
+    # Routing
+    # -----------------------
+    def _note_write(self, table: str, dates: Optional[set]) -> None:
+        _bump("writes")
+        with self._lock:
+            if table in self._written and self._written[table] is ALL_DATES:
+                return
+            if dates is ALL_DATES:
+                self._written[table] = ALL_DATES
+            else:
+                self._written.setdefault(table, set()).update(dates)
+
+    def _replica_fresh(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._lag_ok is not None and now - self._lag_checked_at < self.lag_check_every:
+                return self._lag_ok
+        try:
+            lag = self.replica.replication_lag()
+        except Exception as e:
+            logging.warning("replica: lag probe failed (%s); reading from primary", e)
+            lag = None
+        ok = lag is not None and lag <= self.max_lag
+        with self._lock:
+            self._lag_ok, self._lag_checked_at = ok, now
+        with _lock:
+            _last_lag["seconds"], _last_lag["at"] = lag, time.time()
+        if not ok:
+            logging.info("replica: lag=%s (max %.1fs) - routing reads to primary", lag, self.max_lag)
+        return ok
+
+    def _reader(self, table: str, filters: Iterable = ()) -> Store:
+        with self._lock:
+            touched = table in self._written
+            written = self._written.get(table)
+            run_dates = set(self._run_dates)
+        if run_dates and (table in LIVE_TABLES or (
+                table in RUN_DAY_TABLES and any(_date_matches(d, filters) for d in run_dates))):
+            _bump("reads_primary_run_day")
+            return self.primary
+        if touched and (written is ALL_DATES or any(_date_matches(d, filters) for d in written)):
+            _bump("reads_primary_written")
+            return self.primary
+        if not self._replica_fresh():
+            _bump("reads_primary_lag")
+            return self.primary
+        _bump("reads_replica")
+        return self.replica
+
+    # -----------------------
+    # Reads
+    # -----------------------
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        filters = list(filters or ())
+        return self._reader(table, filters).select(table, columns, filters=filters, order=order, limit=limit)
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        filters = list(filters or ())
+        return self._reader(table, filters).select_page(
+            table, columns, filters=filters, order=order, limit=limit, count=count
+        )
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable = (),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key: Sequence[str] = DEFAULT_KEYSET,
+    ) -> Iterator[Dict]:
+        # Wrappers page through select_page() (routed per page); a direct call streams
+        # entirely from the endpoint chosen up front.
+        filters = list(filters or ())
+        target = self._reader(table, filters)
+        return target.stream(table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        bounds = [("gte", "local_date", since)] if since else []
+        bounds += [("lt", "local_date", until)] if until else []
+        return self._reader("scheduled_tasks", bounds).latest_per_template(template_ids, since=since, until=until)
+
+    def table_columns(self, table):
+        return self.primary.table_columns(table)
+
+    def replication_lag(self):
+        return self.primary.replication_lag()
+
+    # -----------------------
+    # Writes (primary only)
+    # -----------------------
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        out = self.primary.upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+        dates = {str(r.get("local_date")) for r in rows or () if r.get("local_date")}
+        pinned = rows and all(r.get("local_date") for r in rows)
+        self._note_write(table, dates if pinned else ALL_DATES)
+        return out
+
+    def update(self, table, values, *, filters):
+        filters = list(filters or ())
+        out = self.primary.update(table, values, filters=filters)
+        self._note_write(table, _dates_in_filters(filters))
+        return out
+
+    def delete(self, table, *, filters):
+        filters = list(filters or ())
+        out = self.primary.delete(table, filters=filters)
+        self._note_write(table, _dates_in_filters(filters))
+        return out
+
+    def close(self) -> None:
+        self.replica.close()
+        self.primary.close()
+
+
+def build_replica(backend: str, *, client: Any = None) -> Optional[Store]:
+    """The replica Store for `backend`, or None if no replica is configured."""
+    if backend == "sqlite":
+        return None
+    if backend == "postgres":
+        dsn = os.getenv("DAYFLOW_REPLICA_DATABASE_URL")
+        return PostgresStore(dsn) if dsn else None
+    if client is not None:
+        return as_store(client)
+    url = os.getenv("DAYFLOW_REPLICA_URL")
+    if not url:
+        return None
+    from supabase import create_client  # type: ignore
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
+    return as_store(create_client(url, key))
+
+
+def split(primary: Optional[Store], replica: Optional[Store]) -> Optional[Store]:
+    """SplitStore(primary, replica) if there is a replica, else the primary unchanged."""
+    if primary is None or replica is None:
+        return primary
+    return SplitStore(primary, replica)
+
+
+def start_run(store: Optional[Store], run_date: date) -> None:
+    """Route the run's reads of `run_date` to the primary, if `store` splits reads (see SplitStore)."""
+    while store is not None:
+        if isinstance(store, SplitStore):
+            store.start_run(run_date)
+            return
+        store = getattr(store, "inner", None)
+
+
+def metrics() -> Dict[str, Any]:
+    with _lock:
+        return dict(_counters, last_lag_s=_last_lag["seconds"], last_lag_checked_at=_last_lag["at"])
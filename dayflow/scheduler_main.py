@@ -3,14 +3,46 @@ import os
 import sys
 import logging
 import argparse
+from dataclasses import dataclass
 from datetime import datetime, date, time, timedelta
 from zoneinfo import ZoneInfo
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Dict, Iterable, Mapping, Union
 from pathlib import Path
 
+if __name__ == "__main__":
+    # A warm local daemon (python -m dayflow.daemon) already has everything below
+    # imported and a client open; hand the run to it when it's listening.
+    from dayflow import daemon as _daemon
+    _rc = _daemon.try_run(sys.argv[1:])
+    if _rc is not None:
+        sys.exit(_rc)
+
 import pandas as pd  # used to build tasks_df for schedule_day
 
-def carry_forward_incomplete_one_offs(run_date: date, supabase) -> int:
+from dayflow.store import Store, as_store, build_store
+from dayflow import columns as column_registry
+from dayflow.writer import upsert_rows
+from dayflow import transport
+from dayflow import ratelimit
+from dayflow import replica as read_replica
+from dayflow import partitions
+from dayflow import prefetch
+from dayflow import precompute
+from dayflow.progress import Progress
+
+UserScope = Union[str, Iterable[str], None]
+
+
+def _normalize_user_ids(user_id: UserScope) -> Optional[list]:
+    """None → unscoped (legacy, every tenant); a str → [id]; an iterable → sorted unique ids."""
+    if user_id is None:
+        return None
+    if isinstance(user_id, str):
+        return [user_id]
+    return sorted({u for u in user_id if u})
+
+
+def carry_forward_incomplete_one_offs(run_date: date, supabase: Optional[Any], user_id: UserScope = None) -> int:
     """
     Carry forward unfinished floating tasks from the last day the scheduler ran:
       - One-offs (repeat='none') → always carry forward
@@ -21,38 +53,48 @@ def carry_forward_incomplete_one_offs(run_date: date, supabase) -> int:
     
     NOTE: This function finds the most recent date < today that has scheduled tasks,
     rather than always using yesterday. This handles cases where the scheduler missed days.
+
+    `supabase` is a dayflow Store (a raw Supabase client is wrapped automatically).
+    `user_id` scopes every query to one user (or, in batch mode, runs once per id in an
+    iterable), so the cost of a run doesn't grow with the number of tenants. None keeps
+    the old unscoped behaviour.
     """
-    if supabase is None:
+    store = as_store(supabase)
+    if store is None:
         print("[carry_forward] Skipped (no Supabase client).")
         return 0
 
+    users = _normalize_user_ids(user_id)
+    if users is not None and len(users) != 1:
+        # "Last run" is per user, so batch mode is one scoped pass per user
+        return sum(carry_forward_incomplete_one_offs(run_date, store, u) for u in users)
+    scope = [("eq", "user_id", users[0])] if users else []
+
     today = run_date.isoformat()
 
     # 1) Find the most recent date before today that has scheduled tasks
     # This handles cases where the scheduler didn't run for several days
-    last_run_resp = supabase.table("scheduled_tasks").select("local_date")\
-        .lt("local_date", today)\
-        .order("local_date", desc=True)\
-        .limit(1)\
-        .execute()
+    # (searched in bounded windows so only recent partitions are scanned)
+    last_run_date = partitions.last_date_before(store, run_date, scope)
     
-    if not last_run_resp.data:
+    if not last_run_date:
         print("[carry_forward] No previous scheduled tasks found.")
         return 0
     
-    last_run_date = last_run_resp.data[0]["local_date"]
     print(f"[carry_forward] Last scheduler run was on {last_run_date} (today is {today})")
 
     # 2) Get unfinished floating tasks from that last run date
-    y_resp = supabase.table("scheduled_tasks").select(
-        "user_id, title, template_id, duration_minutes, priority, is_appointment, is_routine, is_fixed, timezone"
-    ).eq("local_date", last_run_date)\
-     .eq("is_deleted", False)\
-     .eq("is_completed", False)\
-     .eq("is_appointment", False)\
-     .eq("is_routine", False)\
-     .execute()
-    y_rows = y_resp.data or []
+    y_rows = store.select(
+        "scheduled_tasks",
+        "user_id, title, template_id, duration_minutes, priority, is_appointment, is_routine, is_fixed, timezone",
+        filters=scope + [
+            ("eq", "local_date", last_run_date),
+            ("eq", "is_deleted", False),
+            ("eq", "is_completed", False),
+            ("eq", "is_appointment", False),
+            ("eq", "is_routine", False),
+        ],
+    )
     if not y_rows:
         print(f"[carry_forward] No unfinished floating tasks on {last_run_date}.")
         return 0
@@ -63,19 +105,22 @@ def carry_forward_incomplete_one_offs(run_date: date, supabase) -> int:
         print("[carry_forward] No template-linked rows to carry forward.")
         return 0
 
-    t_resp = supabase.table("task_templates").select(
-        "id, is_deleted, repeat_unit, repeat, repeat_interval, repeat_days, priority, date"
-    ).in_("id", template_ids).execute()
-    t_rows = t_resp.data or []
+    t_rows = store.select(
+        "task_templates",
+        "id, is_deleted, repeat_unit, repeat, repeat_interval, repeat_days, priority, date",
+        filters=scope + [("in", "id", template_ids)],
+    )
     t_by_id = {t["id"]: t for t in t_rows}
 
     # 3) Build a set of today's already-present template_ids to avoid dupes for repeats
     # Also fetch which ones have times to avoid overwriting scheduled tasks
-    today_resp = supabase.table("scheduled_tasks").select("template_id, start_time, is_deleted")\
-        .eq("local_date", today).execute()
-    todays_templates = {r["template_id"] for r in (today_resp.data or []) if r.get("template_id")}
-    todays_scheduled = {r["template_id"] for r in (today_resp.data or []) if r.get("template_id") and r.get("start_time")}
-    todays_deleted = {r["template_id"] for r in (today_resp.data or []) if r.get("template_id") and r.get("is_deleted")}
+    today_rows = store.select(
+        "scheduled_tasks", "template_id, start_time, is_deleted",
+        filters=scope + [("eq", "local_date", today)],
+    )
+    todays_templates = {r["template_id"] for r in today_rows if r.get("template_id")}
+    todays_scheduled = {r["template_id"] for r in today_rows if r.get("template_id") and r.get("start_time")}
+    todays_deleted = {r["template_id"] for r in today_rows if r.get("template_id") and r.get("is_deleted")}
     
     if todays_deleted:
         print(f"[carry_forward] Found {len(todays_deleted)} deleted/skipped task(s) today - will not carry forward.")
@@ -143,17 +188,13 @@ def carry_forward_incomplete_one_offs(run_date: date, supabase) -> int:
         return 0
 
     # Use upsert to avoid duplicate key errors if task already exists
-    ins_resp = (
-        supabase.table("scheduled_tasks")
-        .upsert(to_insert, on_conflict="user_id,local_date,template_id")
-        .execute()
-    )
-    count = len(ins_resp.data or [])
+    upserted = upsert_rows(store, "scheduled_tasks", to_insert, on_conflict="user_id,local_date,template_id")
+    count = len(upserted)
     print(f"[carry_forward] Upserted {count} carried-forward tasks for {today}.")
     return count
 
 
-def carry_forward_missed_days(run_date: date, supabase) -> int:
+def carry_forward_missed_days(run_date: date, supabase: Optional[Any], user_id: UserScope = None) -> int:
     """
     For days when the scheduler didn't run, instantiate tasks that should have appeared.
     
@@ -163,25 +204,29 @@ def carry_forward_missed_days(run_date: date, supabase) -> int:
     - Monthly tasks (if that day of month matches)
     
     These tasks are carried forward to today as incomplete floating tasks.
+
+    `supabase` is a dayflow Store (a raw Supabase client is wrapped automatically).
+    `user_id` scopes every query the same way as carry_forward_incomplete_one_offs().
     """
-    if supabase is None:
+    store = as_store(supabase)
+    if store is None:
         print("[carry_forward_missed] Skipped (no Supabase client).")
         return 0
+
+    users = _normalize_user_ids(user_id)
+    if users is not None and len(users) != 1:
+        return sum(carry_forward_missed_days(run_date, store, u) for u in users)
+    scope = [("eq", "user_id", users[0])] if users else []
     
     today = run_date.isoformat()
     
     # 1) Find the last day the scheduler ran
-    last_run_resp = supabase.table("scheduled_tasks").select("local_date")\
-        .lt("local_date", today)\
-        .order("local_date", desc=True)\
-        .limit(1)\
-        .execute()
+    last_run_date_str = partitions.last_date_before(store, run_date, scope)
     
-    if not last_run_resp.data:
+    if not last_run_date_str:
         print("[carry_forward_missed] No previous scheduled tasks found.")
         return 0
     
-    last_run_date_str = last_run_resp.data[0]["local_date"]
     last_run_date = datetime.fromisoformat(last_run_date_str).date()
     
     # Calculate missed days
@@ -193,21 +238,23 @@ def carry_forward_missed_days(run_date: date, supabase) -> int:
     print(f"[carry_forward_missed] Scheduler missed {days_missed} day(s) between {last_run_date_str} and {today}")
     
     # 2) Get all active templates
-    t_resp = supabase.table("task_templates").select(
+    templates = store.select(
+        "task_templates",
         "id, user_id, title, repeat_unit, repeat, repeat_interval, repeat_days, day_of_month, "
-        "duration_minutes, priority, is_appointment, is_routine, is_fixed, timezone, is_deleted, date"
-    ).eq("is_deleted", False).execute()
-    
-    templates = t_resp.data or []
+        "duration_minutes, priority, is_appointment, is_routine, is_fixed, timezone, is_deleted, date",
+        filters=scope + [("eq", "is_deleted", False)],
+    )
     if not templates:
         print("[carry_forward_missed] No active templates found.")
         return 0
     
     # 3) Check what's already scheduled for today
-    today_resp = supabase.table("scheduled_tasks").select("template_id, is_deleted")\
-        .eq("local_date", today).execute()
-    todays_templates = {r["template_id"] for r in (today_resp.data or []) if r.get("template_id")}
-    todays_deleted = {r["template_id"] for r in (today_resp.data or []) if r.get("template_id") and r.get("is_deleted")}
+    today_rows = store.select(
+        "scheduled_tasks", "template_id, is_deleted",
+        filters=scope + [("eq", "local_date", today)],
+    )
+    todays_templates = {r["template_id"] for r in today_rows if r.get("template_id")}
+    todays_deleted = {r["template_id"] for r in today_rows if r.get("template_id") and r.get("is_deleted")}
     
     # NEW: Fetch all completed tasks from the missed days to avoid re-instantiating them
     # Build list of missed day dates
@@ -215,16 +262,15 @@ def carry_forward_missed_days(run_date: date, supabase) -> int:
         (last_run_date + timedelta(days=offset)).isoformat()
         for offset in range(1, days_missed + 1)
     ]
-    completed_resp = supabase.table("scheduled_tasks")\
-        .select("template_id, local_date")\
-        .in_("local_date", missed_dates)\
-        .eq("is_completed", True)\
-        .execute()
+    completed_rows = store.select(
+        "scheduled_tasks", "template_id, local_date",
+        filters=scope + [("in", "local_date", missed_dates), ("eq", "is_completed", True)],
+    )
     
     # Create a set of (template_id, date) tuples for tasks that were completed on missed days
     completed_on_missed_days = {
         (r["template_id"], r["local_date"]) 
-        for r in (completed_resp.data or [])
+        for r in completed_rows
     }
     
     # FIX: Also fetch templates that have been "stopped" by the user
@@ -233,23 +279,15 @@ def carry_forward_missed_days(run_date: date, supabase) -> int:
     template_ids = [t["id"] for t in templates]
     stopped_templates = set()
     if template_ids:
-        # Get the most recent instance for each template to check if it was deleted
-        recent_instances_resp = supabase.table("scheduled_tasks")\
-            .select("template_id, local_date, is_deleted, is_completed")\
-            .in_("template_id", template_ids)\
-            .order("local_date", desc=True)\
-            .execute()
-        
-        # Build a dict of template_id -> most recent instance state
-        # Track templates where the most recent instance was deleted (user stopped the task)
-        seen_templates = set()
-        for r in (recent_instances_resp.data or []):
+        # Get the most recent instance for each template to check if it was deleted.
+        # The database returns exactly one row per template (DISTINCT ON), so the
+        # transfer is O(templates) rather than O(history); local_date windows keep
+        # it to recent partitions.
+        for r in partitions.latest_per_template(store, template_ids, run_date):
             tid = r.get("template_id")
-            if tid and tid not in seen_templates:
-                seen_templates.add(tid)
-                # If the most recent instance was deleted and not completed, user stopped the task
-                if r.get("is_deleted") and not r.get("is_completed"):
-                    stopped_templates.add(tid)
+            # If the most recent instance was deleted and not completed, user stopped the task
+            if tid and r.get("is_deleted") and not r.get("is_completed"):
+                stopped_templates.add(tid)
         
         if stopped_templates:
             print(f"[carry_forward_missed] Found {len(stopped_templates)} stopped template(s) - will not re-instantiate")
@@ -354,12 +392,8 @@ def carry_forward_missed_days(run_date: date, supabase) -> int:
         return 0
     
     # 5) Upsert the tasks
-    ins_resp = (
-        supabase.table("scheduled_tasks")
-        .upsert(to_insert, on_conflict="user_id,local_date,template_id")
-        .execute()
-    )
-    count = len(ins_resp.data or [])
+    upserted = upsert_rows(store, "scheduled_tasks", to_insert, on_conflict="user_id,local_date,template_id")
+    count = len(upserted)
     print(f"[carry_forward_missed] Upserted {count} tasks from missed days.")
     return count
 
@@ -499,7 +533,7 @@ _load_env_files_manual()
 
 
 
-from dayflow.planner import preprocess_recurring_tasks, schedule_day
+from dayflow.planner import preprocess_recurring_tasks, prefetch_planning_reads, schedule_day, run_timezone
 
 LONDON = ZoneInfo("Europe/London")
 
@@ -554,7 +588,9 @@ def _assert_required_env() -> None:
 # -----------------------
 # CLI
 # -----------------------
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: Optional[list] = None, env: Optional[Mapping[str, str]] = None) -> argparse.Namespace:
+    """CLI flags; defaults come from `env` (os.environ unless given, e.g. by dayflow.daemon)."""
+    env = os.environ if env is None else env
     p = argparse.ArgumentParser(
         prog="dayflow-scheduler",
         description="Generate today's schedule from task templates."
@@ -567,17 +603,17 @@ def parse_args() -> argparse.Namespace:
     p.add_argument(
         "--timezone",
         help="IANA timezone for computing 'today' (default: Europe/London).",
-        default=os.getenv("TZ", "Europe/London"),
+        default=env.get("TZ", "Europe/London"),
     )
     p.add_argument(
         "--user",
         help="Limit scheduling to a single user_id (default: all users if supported).",
-        default=os.getenv("TEST_USER_ID"),
+        default=env.get("TEST_USER_ID"),
     )
     p.add_argument(
         "--whitelist",
         help="Comma-separated template IDs to include (others ignored).",
-        default=os.getenv("TEMPLATE_WHITELIST"),
+        default=env.get("TEMPLATE_WHITELIST"),
     )
     p.add_argument(
         "--dry-run",
@@ -592,25 +628,126 @@ def parse_args() -> argparse.Namespace:
         default=False,
     )
 
+    p.add_argument(
+        "--backend",
+        help="Data-access backend: postgrest (default), postgres (direct SQL, for batch jobs) "
+             "or sqlite (local file, see dayflow/sqlite_store.py).",
+        choices=["postgrest", "postgres", "sqlite"],
+        default=env.get("DAYFLOW_STORE_BACKEND", "postgrest"),
+    )
+
+    p.add_argument(
+        "--all-users",
+        help="Plan every active user's day on a pool of worker processes (see dayflow/batch.py).",
+        action="store_true",
+        default=False,
+    )
+    p.add_argument(
+        "--concurrency",
+        help="--all-users worker processes (default DAYFLOW_BATCH_WORKERS or CPU count, max 8).",
+        type=int,
+        default=None,
+    )
+    p.add_argument(
+        "--user-timeout",
+        help="--all-users per-user time limit in seconds (default DAYFLOW_BATCH_USER_TIMEOUT_S or 120).",
+        type=float,
+        default=None,
+    )
+
+    p.add_argument(
+        "--precompute",
+        help="Plan the day and stage it instead of writing it; the next run for the day commits it "
+             "(run after local midnight, see dayflow/precompute.py). Not subject to the 07:00 gate.",
+        action="store_true",
+        default=False,
+    )
+
     p.add_argument(
         "--force",
         help="Bypass the 07:00 run gate (or set ALLOW_BEFORE_7=1).",
         action="store_true",
-        default=str(os.getenv("ALLOW_BEFORE_7", "0")).lower() in ("1", "true", "yes", "on"),
+        default=str(env.get("ALLOW_BEFORE_7", "0")).lower() in ("1", "true", "yes", "on"),
     )
-    return p.parse_args()
+    return p.parse_args(argv)
 
 
 # -----------------------
-# Main
+# Run API
 # -----------------------
-def main() -> int:
-    _assert_required_env()  # 🔎 Fail fast if SUPABASE_URL / SERVICE_ROLE_KEY are not set
+@dataclass(frozen=True)
+class RunOptions:
+    """Per-run switches for run_for_user (the CLI's --whitelist, --dry-run and --force)."""
+    whitelist: Optional[set] = None         # template ids to write; None = all
+    dry_run: bool = False
+    force: bool = False                     # if run_date is today, start the day now rather than 08:00
+    precompute: bool = False                # stage the plan for a later run to commit (dayflow/precompute.py)
+
+
+def open_store(
+    client: Optional[Any] = None,
+    *,
+    backend: str = "postgrest",
+    replica: Optional[Any] = None,
+    template_cache: Optional[Any] = None,
+) -> Optional[Store]:
+    """
+    The Store a run talks to: the backend (PostgREST over `client`, or direct Postgres /
+    local SQLite), planning reads on a read replica when configured and fresh enough,
+    then the transport (which also takes the rate-limit tokens) and template-cache
+    wrappers. Raises if a postgres or sqlite backend cannot start; None if there is
+    no client and no direct backend.
+    """
+    store: Optional[Store] = None
+    if backend in ("postgres", "sqlite"):
+        store = build_store(backend)
+        logging.info("Using %s backend.", "direct Postgres" if backend == "postgres" else "local SQLite")
+    elif client is not None:
+        store = build_store("postgrest", client=client)
+    # Planning reads on a read replica when configured and fresh enough; writes stay on primary
+    if store is not None:
+        try:
+            store = read_replica.split(store, read_replica.build_replica(backend, client=replica))
+        except Exception as e:
+            logging.warning("Read replica unavailable (%s); using primary for reads.", e)
+    # Deadlines, read retries, optional hedging and a circuit breaker (DAYFLOW_TRANSPORT=0 to disable)
+    store = transport.wrap(store)
+    # Shared read/write request budgets (DAYFLOW_RATE_*); callers wait rather than fail.
+    # The transport takes a token per attempt itself, so only wrap when it is off
+    if not isinstance(store, transport.ResilientStore):
+        store = ratelimit.wrap(store)
+    # Outermost: a template cache hit never reaches the limiter or the network
+    if template_cache is not None:
+        store = template_cache.wrap(store)
+    return store
+
 
+# -----------------------
+# Main
+# -----------------------
+def main(
+    argv: Optional[list] = None,
+    supabase: Optional[Any] = None,
+    replica: Optional[Any] = None,
+    template_cache: Optional[Any] = None,
+    env: Optional[Mapping[str, str]] = None,
+) -> int:
+    """
+    CLI entry point. `argv` defaults to sys.argv[1:], and `env` (the flag defaults:
+    TZ, TEST_USER_ID, ...) to os.environ.
+    Pass `supabase` to reuse a long-lived client (e.g. from railway_server's ClientPool)
+    instead of creating a fresh one for this run, and `replica` for a read-replica client
+    (otherwise DAYFLOW_REPLICA_URL / DAYFLOW_REPLICA_DATABASE_URL are used if set).
+    A long-lived process can pass a dayflow.template_cache.TemplateCache to serve the
+    user's templates from memory.
+    """
     # --- CLI / Logging ---
-    args = parse_args()
+    args = parse_args(argv, env)
 
-    tz_name = args.timezone or os.getenv("TZ", "Europe/London")
+    if args.backend != "sqlite":  # a local SQLite run needs no Supabase credentials
+        _assert_required_env()  # 🔎 Fail fast if SUPABASE_URL / SERVICE_ROLE_KEY are not set
+
+    tz_name = args.timezone or "Europe/London"
     tz = ZoneInfo(tz_name)
 
     logging.basicConfig(
@@ -626,7 +763,7 @@ def main() -> int:
 
 
     # --- 07:00 gate (overridable) ---
-    if not args.force and not should_run_now(datetime.now(LONDON)):
+    if not args.force and not args.precompute and not should_run_now(datetime.now(LONDON)):
         print("[scheduler] Run-gate: before 07:00 Europe/London — exiting. Use --force to bypass.")
         return 0
 
@@ -636,12 +773,14 @@ def main() -> int:
     except Exception:
         create_client = None  # type: ignore
 
-    sb: Optional[Any] = None
+    sb: Optional[Any] = supabase
     url = os.getenv("SUPABASE_URL")
     # Prefer SUPABASE_SERVICE_ROLE_KEY; fall back to legacy SUPABASE_SERVICE_KEY if present
     key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
 
-    if url and key and create_client:
+    if sb is not None:
+        logging.info("Using injected Supabase client.")
+    elif url and key and create_client:
         try:
             sb = create_client(url, key)
             logging.info("Supabase client created.")
@@ -651,6 +790,13 @@ def main() -> int:
     else:
         logging.info("Supabase URL/key not set (or SDK missing) — running without DB writes.")
 
+    # --- Data-access backend (planner + carry-forward only see the Store) ---
+    try:
+        store = open_store(sb, backend=args.backend, replica=replica, template_cache=template_cache)
+    except Exception as e:
+        logging.exception("%s backend init failed: %s", args.backend, e)
+        return 1
+
     # --- Resolve run date ---
     if args.date:
         if args.date.lower() == "today":
@@ -668,6 +814,112 @@ def main() -> int:
         whitelist_ids = set(x.strip() for x in args.whitelist.split(",") if x.strip())
         logging.info("Whitelist active (%d ids).", len(whitelist_ids))
 
+    options = RunOptions(whitelist=whitelist_ids, dry_run=effective_dry_run, force=args.force, precompute=args.precompute)
+    if args.all_users:
+        return _run_all_users(store, run_date, tz_name, options, args)
+    return run_for_user(args.user, run_date, tz, options, store)
+
+
+def _run_all_users(store: Optional[Store], run_date: date, tz_name: str, options: RunOptions, args) -> int:
+    """--all-users: enumerate active users and fan them out over worker processes."""
+    from dayflow import batch
+
+    if store is None:
+        logging.error("--all-users needs a database (set SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY or --backend).")
+        return 1
+    t0 = datetime.now().timestamp()
+    users = batch.active_user_ids(store)
+    logging.info("--all-users: %d active user(s).", len(users))
+    results = batch.run_all(
+        users, run_date, tz_name, options,
+        backend=args.backend, workers=args.concurrency, user_timeout=args.user_timeout,
+    )
+    summary = batch.print_summary(results, datetime.now().timestamp() - t0)
+    return 0 if summary["ok"] == summary["users"] else 1
+
+
+def _day_start(run_date: date, tz: ZoneInfo, force: bool, now: Optional[datetime] = None) -> datetime:
+    """Where run_for_user starts the day: 08:00 local, or now for a forced run on the day after 08:00."""
+    now = now or datetime.now(tz)
+    default_start = datetime.combine(run_date, time(8, 0), tzinfo=tz)
+    if force and now.date() == run_date and now > default_start:
+        return now
+    return default_start
+
+
+# Reads of run_for_user's steps 1b-3c (also issued ahead by its prefetch step)
+def _deleted_today_rows(store: Store, user_id: Optional[str], run_date: date) -> list:
+    filters = [("eq", "local_date", run_date.isoformat()), ("eq", "is_deleted", True)]
+    # If you're running single-user in dev, also filter by user:
+    if user_id:
+        filters.append(("eq", "user_id", user_id))
+    return store.select("scheduled_tasks", "template_id, title", filters=filters)
+
+
+def _deleted_template_rows(store: Store, user_id: Optional[str]) -> list:
+    filters = [("eq", "is_deleted", True)]
+    # Filter by user to avoid removing tasks from other users with deleted templates
+    if user_id:
+        filters.append(("eq", "user_id", user_id))
+    return store.select("task_templates", "id", filters=filters)
+
+
+def _unscheduled_today_rows(store: Store, user_id: str, run_date: date) -> list:
+    return column_registry.fetch(
+        store, "main_unscheduled",
+        filters=[
+            ("eq", "user_id", user_id),
+            ("eq", "local_date", run_date.isoformat()),
+            ("is", "start_time", None),
+            ("eq", "is_deleted", False),
+            ("eq", "is_completed", False),
+        ],
+    )
+
+
+def _open_today_rows(store: Store, user_id: Optional[str], run_date: date) -> list:
+    return store.select(
+        "scheduled_tasks", "id, template_id, title",
+        filters=[
+            ("eq", "user_id", user_id),
+            ("eq", "local_date", run_date.isoformat()),
+            ("eq", "is_completed", False),
+            ("eq", "is_deleted", False),
+        ],
+    )
+
+
+def run_for_user(
+    user_id: Optional[str],
+    run_date: date,
+    tz: Any = None,
+    options: Optional[RunOptions] = None,
+    client: Optional[Any] = None,
+    stats: Optional[dict] = None,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> int:
+    """
+    Plan and write one user's day. Everything the run needs is an argument: it reads
+    no CLI flags and sets no environment variables, so a server can call it for many
+    users at once from worker threads.
+
+    `tz` is the user's timezone (ZoneInfo or IANA name; default TZ / Europe/London),
+    used for the day bounds and every local time the planner builds. `client` is a
+    dayflow Store (see open_store) or a raw Supabase client. Returns 0 on success,
+    non-zero if the run was abandoned before writing. If `stats` is given it is filled
+    with the run's counts (instances, placed). If `progress` is given it is called with
+    one timed event dict per stage as the run goes (see dayflow/progress.py).
+    """
+    options = options or RunOptions()
+    report = Progress(progress)
+    tz = run_timezone(tz)
+    store = as_store(client)
+    # The store may have served earlier runs (batch workers): this run starts with a
+    # fresh deadline and error count, so one user's failed read can't abort the next
+    transport.start_run(store)
+    # Reads of the day being planned (and the templates) see the primary, not a lagging replica
+    read_replica.start_run(store, run_date)
+
     # --- Orchestration ---
     # NOTE: carry_forward runs FIRST so that step 3b can pick up the carried-forward
     # tasks and include them in schedule_day(). schedule_day() will delete old tasks
@@ -677,32 +929,69 @@ def main() -> int:
     # 0) Carry forward incomplete floating tasks from previous day(s) FIRST
     #    This creates tasks with NULL start_time in the DB, which step 3b will pick up
     #    and pass to schedule_day for proper scheduling.
-    if sb is not None:
-        carry_count = carry_forward_incomplete_one_offs(run_date=run_date, supabase=sb)
+    if store is not None:
+        carry_count = carry_forward_incomplete_one_offs(run_date=run_date, supabase=store, user_id=user_id)
         if carry_count:
             logging.info("Carried forward %d incomplete floating task(s).", carry_count)
         # Also carry forward tasks that should have been instantiated on missed days
-        missed_count = carry_forward_missed_days(run_date=run_date, supabase=sb)
+        missed_count = carry_forward_missed_days(run_date=run_date, supabase=store, user_id=user_id)
         if missed_count:
             logging.info("Carried forward %d task(s) from missed days.", missed_count)
+        report("carry_forward", carried=carry_count, missed=missed_count)
+
+    # 0a) Overnight plans (dayflow/precompute.py). A --precompute run snapshots its inputs
+    #     and records its writes instead of applying them; a normal run first tries to
+    #     commit the plan staged for this day, and plans in full if it no longer holds.
+    staging = None
+    if options.precompute:
+        if store is None or not user_id:
+            logging.error("--precompute needs a database and a user.")
+            return 1
+        inputs = precompute.snapshot(store, user_id, run_date)
+        store = staging = precompute.StagingStore(store)
+    elif store is not None and user_id and not options.dry_run and precompute.enabled():
+        committed = precompute.commit(
+            store, user_id, run_date,
+            day_start=_day_start(run_date, tz, options.force), tz_name=tz.key, whitelist=options.whitelist,
+        )
+        if committed is not None:
+            logging.info("Committed the precomputed plan for %s: %d write(s), %s item(s) placed.",
+                         run_date, committed["writes"], committed["placed"])
+            if stats is not None:
+                stats.update(instances=None, placed=committed["placed"])
+            report("committed", **committed)
+            report("done", rc=0, placed=committed["placed"])
+            return 0
+
+    # 0b) The reads of steps 1-3 don't depend on each other: issue them together now
+    #     that carry-forward has written, and join before any CPU work (dayflow/prefetch.py)
+    if store is not None and prefetch.enabled():
+        store = prefetch.PrefetchStore(store)
+        store.submit(prefetch_planning_reads, user_id, run_date, tz)
+        store.submit(_deleted_today_rows, user_id, run_date)
+        store.submit(_deleted_template_rows, user_id)
+        if user_id:
+            store.submit(_unscheduled_today_rows, user_id, run_date)
+            if not options.dry_run:
+                store.submit(_open_today_rows, user_id, run_date)
+        store.join()
+        store.shutdown()
+        logging.info("Prefetched %d read(s) concurrently.", store.misses)
+        report("prefetch", reads=store.misses)
 
     # 1) Expand templates into instances for run_date
-    instances = preprocess_recurring_tasks(run_date=run_date, supabase=sb, user_id=args.user)
+    instances = preprocess_recurring_tasks(run_date=run_date, supabase=store, user_id=user_id, tz=tz)
     count_instances = len(instances) if hasattr(instances, "__len__") else None
     logging.info("Preprocessed %s instance(s).", count_instances if count_instances is not None else "unknown")
 
     # 1b) NEW: if the user deleted a task today, do NOT re-instantiate it on revise
-    if sb is not None:
+    if store is not None:
         today_str = run_date.isoformat()
-        q = sb.table("scheduled_tasks").select("template_id, title").eq("local_date", today_str).eq("is_deleted", True)
-        # If you're running single-user in dev, also filter by user:
-        if args.user:
-            q = q.eq("user_id", args.user)
-        resp = q.execute()
-        deleted_today_ids = {r["template_id"] for r in (resp.data or []) if r.get("template_id")}
+        deleted_rows = _deleted_today_rows(store, user_id, run_date)
+        deleted_today_ids = {r["template_id"] for r in deleted_rows if r.get("template_id")}
         if deleted_today_ids:
             # Log which tasks are being filtered out
-            deleted_titles = [r.get("title", "Untitled") for r in (resp.data or []) if r.get("template_id") in deleted_today_ids]
+            deleted_titles = [r.get("title", "Untitled") for r in deleted_rows if r.get("template_id") in deleted_today_ids]
             logging.info("Found %d deleted/skipped task(s) today: %s", len(deleted_today_ids), ", ".join(deleted_titles[:5]))
             before = len(instances) if hasattr(instances, "__len__") else 0
             instances = [it for it in (instances or []) if it.get("template_id") not in deleted_today_ids]
@@ -710,13 +999,8 @@ def main() -> int:
             logging.info("Deleted-today blocklist active: %d template(s) removed (from %d → %d).",
                         len(deleted_today_ids), before, after)
     # 1c) **NEW**: Exclude any instances whose template is soft-deleted (DB truth)
-    if sb is not None:
-        del_q = sb.table("task_templates").select("id").eq("is_deleted", True)
-        # Filter by user to avoid removing tasks from other users with deleted templates
-        if args.user:
-            del_q = del_q.eq("user_id", args.user)
-        del_resp = del_q.execute()
-        deleted_template_ids = {r["id"] for r in (del_resp.data or [])}
+    if store is not None:
+        deleted_template_ids = {r["id"] for r in _deleted_template_rows(store, user_id)}
         if deleted_template_ids:
             before = len(instances) if hasattr(instances, "__len__") else 0
             # handle either key being present in instances
@@ -726,23 +1010,20 @@ def main() -> int:
             after = len(instances)
             logging.info("Template-deleted filter: %d template(s) removed (from %d → %d).",
                         len(deleted_template_ids), before, after)
+    report("instances", instances=count_instances, kept=len(instances) if hasattr(instances, "__len__") else None)
 
     # 2) Day bounds (08:00–23:00 local by default, or current time if force mode and already past 08:00)
-    now_time = datetime.now(LONDON)
-    default_start = datetime.combine(run_date, time(8, 0), tzinfo=LONDON)
+    now_time = datetime.now(tz)
+    day_start = _day_start(run_date, tz, options.force, now_time)
     
-    if args.force and now_time.date() == run_date:
+    if options.force and now_time.date() == run_date:
         # Force mode: start from whichever is later - current time or 08:00
-        if now_time > default_start:
-            day_start = now_time
+        if day_start == now_time:
             logging.info("Force mode: starting schedule from current time %s", day_start.strftime("%H:%M"))
         else:
-            day_start = default_start
             logging.info("Force mode: starting schedule from default start time 08:00 (current time %s is earlier)", now_time.strftime("%H:%M"))
-    else:
-        day_start = default_start
     
-    day_end = datetime.combine(run_date, time(23, 0), tzinfo=LONDON)
+    day_end = datetime.combine(run_date, time(23, 0), tzinfo=tz)
 
     # 3) Build DataFrame for the scheduler
     tasks_df = pd.DataFrame(instances or [])
@@ -764,18 +1045,10 @@ def main() -> int:
     
     # 3b) Fetch existing scheduled tasks for today that lack time slots (e.g., carried forward)
     # and add them to tasks_df so they can be scheduled
-    if sb is not None and args.user:
+    if store is not None and user_id:
         try:
             today_str = run_date.isoformat()
-            existing_resp = sb.table("scheduled_tasks").select("*") \
-                .eq("user_id", args.user) \
-                .eq("local_date", today_str) \
-                .is_("start_time", "null") \
-                .eq("is_deleted", False) \
-                .eq("is_completed", False) \
-                .execute()
-            
-            existing_unscheduled = existing_resp.data or []
+            existing_unscheduled = _unscheduled_today_rows(store, user_id, run_date)
             if existing_unscheduled:
                 logging.info("Found %d existing unscheduled task(s) for %s - adding to scheduler", 
                            len(existing_unscheduled), today_str)
@@ -802,32 +1075,24 @@ def main() -> int:
             logging.warning("Failed to fetch existing unscheduled tasks: %s", e)
 
     # 3c) Check for deferred tasks that should not be scheduled today
-    if not effective_dry_run:
+    if not options.dry_run:
         try:
             # Fetch all scheduled tasks for today (including ones with time slots)
-            all_today_resp = sb.table("scheduled_tasks") \
-                .select("id, template_id, title") \
-                .eq("user_id", args.user) \
-                .eq("local_date", today_str) \
-                .eq("is_completed", False) \
-                .eq("is_deleted", False) \
-                .execute()
-            
-            all_today_tasks = all_today_resp.data or []
+            all_today_tasks = _open_today_rows(store, user_id, run_date)
             if all_today_tasks:
                 # Get unique template IDs
                 template_ids = {task["template_id"] for task in all_today_tasks if task.get("template_id")}
                 
                 if template_ids:
                     # Fetch templates to check defer dates
-                    templates_resp = sb.table("task_templates") \
-                        .select("id, title, date, repeat_unit") \
-                        .in_("id", list(template_ids)) \
-                        .execute()
+                    deferred_rows = store.select(
+                        "task_templates", "id, title, date, repeat_unit",
+                        filters=[("in", "id", list(template_ids))],
+                    )
                     
                     # Build map of template_id -> defer_date for one-off tasks
                     deferred_templates = {}
-                    for tmpl in (templates_resp.data or []):
+                    for tmpl in deferred_rows:
                         if tmpl.get("repeat_unit") == "none" and tmpl.get("date"):
                             try:
                                 defer_date = datetime.fromisoformat(tmpl["date"]).date()
@@ -848,24 +1113,52 @@ def main() -> int:
                                 logging.info("Removing deferred task '%s' from today's schedule (deferred until %s)", 
                                            title, defer_date)
                             
-                            sb.table("scheduled_tasks").delete().in_("id", tasks_to_delete).execute()
+                            store.delete(
+                                "scheduled_tasks",
+                                filters=[("eq", "local_date", today_str), ("in", "id", tasks_to_delete)],
+                            )
                             logging.info("Removed %d deferred task(s) from today's schedule", len(tasks_to_delete))
         except Exception as e:
             logging.warning("Failed to check/remove deferred tasks: %s", e)
 
+    # Don't write a schedule computed from reads that failed after retries/deadlines
+    # (the planner logs and carries on past most read errors).
+    if getattr(store, "unrecovered_errors", 0):
+        logging.error(
+            "Aborting before write: %d data-access call(s) failed after retries (see transport warnings).",
+            store.unrecovered_errors,
+        )
+        report("done", rc=1, placed=None, error=f"{store.unrecovered_errors} data-access call(s) failed")
+        return 1
+
     # 4) Run the scheduler (this function should be the only writer to scheduled_tasks)
     schedule = schedule_day(
         tasks_df=tasks_df,
         day_start=day_start,
         day_end=day_end,
-        supabase=sb,
-        user_id=args.user,
-        whitelist_template_ids=whitelist_ids,
-        dry_run=effective_dry_run,
+        supabase=store,
+        user_id=user_id,
+        whitelist_template_ids=options.whitelist,
+        dry_run=options.dry_run,
+        tz=tz,
+        progress=report,
     )
 
     count_scheduled = len(schedule) if hasattr(schedule, "__len__") else None
     logging.info("Scheduled %s item(s).", count_scheduled if count_scheduled is not None else "unknown")
+    if staging is not None:
+        if not precompute.stage(
+            staging.inner, user_id, run_date,
+            inputs=inputs, writes=staging.writes, day_start=day_start, tz_name=tz.key, placed=count_scheduled,
+        ):
+            report("done", rc=1, placed=None, error="could not stage the plan")
+            return 1
+        logging.info("Staged the plan for %s: %d write(s), commits on the next run for the day.",
+                     run_date, len(staging.writes))
+        report("staged", writes=len(staging.writes), placed=count_scheduled)
+    if stats is not None:
+        stats.update(instances=count_instances, placed=count_scheduled)
+    report("done", rc=0, placed=count_scheduled)
 
     return 0
 
@@ -0,0 +1,258 @@
+# dayflow/serialize.py
+"""
+Frame -> JSON-ready rows at schedule_day's write boundary.
+
+schedule_day used to build its upsert payload one row at a time: iterrows(),
+pd.to_datetime + isoformat per timestamp, a title fallback, a priority clamp,
+then two passes of column filtering and a pd.isna() check on every key of
+every row. Here each field is computed for the whole schedule at once, on the
+frame's columns as numpy arrays:
+
+  - timestamps are UTC datetime64 already, so they are formatted with one
+    np.datetime_as_string call; only values with sub-second parts fall back
+    to Timestamp.isoformat()
+  - template ids, titles, flags and priorities are masks and np.where chains
+  - missing values become None once per column, the table's columns are
+    projected once, and dicts are only built at the very end
+
+numpy rather than pandas Series ops because a day is tens of rows: the output
+has to be cheap at that size too, not only at backfill sizes.
+
+The output is the same as the per-row code (tests/test_serialize.py runs
+both), including int() on priorities and durations - "2.5" is not an int, so
+it gets the default - and Python's truthiness rules: NaN is truthy, so `origin_template_id or template_id` picks a NaN
+origin (and the row then has no template id), and bool(NaN) is True.
+"""
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+FLAG_COLUMNS = ("is_appointment", "is_routine", "is_fixed")
+
+
+class Rows:
+    """Equal-length column arrays: a write payload before it becomes dicts."""
+
+    __slots__ = ("columns", "_n")
+
+    def __init__(self, columns: Mapping[str, Any], n: int):
+        self.columns = dict(columns)
+        self._n = n
+
+    @classmethod
+    def from_dicts(cls, rows: Iterable[Dict]) -> "Rows":
+        rows = list(rows)
+        keys: Dict[str, None] = {}
+        for r in rows:
+            keys.update(dict.fromkeys(r))
+        return cls({k: _objects([r.get(k) for r in rows]) for k in keys}, len(rows))
+
+    def __len__(self) -> int:
+        return self._n
+
+    def column(self, name: str) -> List:
+        return _none_for_na(self.columns[name]).tolist()
+
+    def records(
+        self,
+        columns: Optional[Iterable[str]] = None,
+        *,
+        exclude: Iterable[str] = (),
+        omit_none: Iterable[str] = (),
+    ) -> List[Dict]:
+        """
+        One dict per row, projected to `columns` (minus `exclude`), missing values as
+        None. Keys in `omit_none` are left out of a row when None rather than sent as
+        null (so an upsert doesn't overwrite them).
+        """
+        allowed = None if columns is None else set(columns)
+        dropped = set(exclude)
+        keys = [k for k in self.columns if k not in dropped and (allowed is None or k in allowed)]
+        values = [_none_for_na(self.columns[k]).tolist() for k in keys]
+        rows = [dict(zip(keys, vals)) for vals in zip(*values)] if keys else [{} for _ in range(self._n)]
+        for key in omit_none:
+            if key in keys:
+                for r in rows:
+                    if r[key] is None:
+                        del r[key]
+        return rows
+
+
+def _objects(values: Any) -> np.ndarray:
+    out = np.empty(len(values), dtype=object)
+    out[:] = values
+    return out
+
+
+def _none_for_na(arr: np.ndarray) -> np.ndarray:
+    if arr.dtype != object:
+        return arr
+    na = pd.isna(arr)
+    if na.any():
+        arr = arr.copy()
+        arr[na] = None
+    return arr
+
+
+def _column(df: pd.DataFrame, name: str) -> np.ndarray:
+    """The column as an object array; all None (like row.get) when absent."""
+    if name in df.columns:
+        return df[name].to_numpy(dtype=object)
+    return _objects([None] * len(df))
+
+
+def _truthy(arr: np.ndarray) -> np.ndarray:
+    """bool(value) per element: None, "", 0 and False are falsy, NaN is truthy."""
+    return arr.astype(bool)
+
+
+def _first_truthy(df: pd.DataFrame, names: Iterable[str]) -> np.ndarray:
+    """`row.get(a) or row.get(b) or ...` (None where every one is falsy)."""
+    out = _objects([None] * len(df))
+    for name in reversed(tuple(names)):
+        col = _column(df, name)
+        out = np.where(_truthy(col), col, out)
+    return out
+
+
+def _as_str(arr: np.ndarray) -> np.ndarray:
+    """str(value), None for None/NaN."""
+    out = _objects([None if v is None else str(v) for v in arr])
+    out[pd.isna(arr)] = None
+    return out
+
+
+def utc_iso(s: pd.Series) -> np.ndarray:
+    """Timestamps (any tz, naive = UTC, or strings) -> UTC ISO-8601 strings; None for NaT."""
+    if isinstance(s.dtype, pd.DatetimeTZDtype):
+        s = s.dt.tz_convert("UTC").dt.tz_localize(None)
+    elif not pd.api.types.is_datetime64_dtype(s.dtype):
+        s = pd.to_datetime(s, utc=True, errors="coerce", format="mixed").dt.tz_localize(None)
+    values = s.to_numpy(dtype="datetime64[ns]")
+    nat = np.isnat(values)
+    out = _objects(np.char.add(np.datetime_as_string(values, unit="s"), "+00:00"))
+    whole = values.astype("datetime64[s]").astype("datetime64[ns]")
+    sub_second = ~nat & (values != whole)
+    if sub_second.any():
+        out[sub_second] = [pd.Timestamp(v, tz="UTC").isoformat() for v in values[sub_second]]
+    out[nat] = None
+    return out
+
+
+def row_template_ids(df: pd.DataFrame) -> np.ndarray:
+    """origin_template_id -> template_id -> id, as str; None if missing or NaN."""
+    return _as_str(_first_truthy(df, ("origin_template_id", "template_id", "id")))
+
+
+def titles(df: pd.DataFrame) -> np.ndarray:
+    """title, then task (NaN/empty count as blank), else "Template <id>"."""
+    fallback = _first_truthy(df, ("origin_template_id", "template_id", "id"))
+    out = _objects([f"Template {v or 'unknown'}" for v in fallback])
+    for name in ("task", "title"):
+        col = _column(df, name)
+        blank = pd.isna(col) | np.array([isinstance(v, str) and v.strip() == "" for v in col], dtype=bool)
+        out = np.where(blank, out, _objects([str(v) for v in col]))
+    return out
+
+
+def _str_int(v: str) -> float:
+    try:
+        return float(int(v))
+    except ValueError:
+        return np.nan
+
+
+def _ints(arr: np.ndarray) -> np.ndarray:
+    """int(value) per element as floats, NaN where int() would raise.
+
+    Numbers are truncated; a string only converts if it is an integer literal
+    ("2" but not "2.5"), as with int().
+    """
+    out = pd.to_numeric(arr, errors="coerce").astype(float)
+    strings = np.array([isinstance(v, str) for v in arr], dtype=bool)
+    if strings.any():
+        out = out.copy()
+        out[strings] = [_str_int(v) for v in arr[strings]]
+    return np.trunc(out)
+
+
+def priorities(arr: np.ndarray) -> np.ndarray:
+    """planner._normalize_priority over a column: int(), default 3, clamped to 1..5."""
+    p = _ints(arr)
+    return np.clip(np.where(np.isnan(p), 3, p), 1, 5).astype(int).astype(object)
+
+
+def durations(arr: np.ndarray) -> np.ndarray:
+    """int(minutes), None where missing or int() fails."""
+    d = _ints(arr)
+    nan = np.isnan(d)
+    out = np.where(nan, 0, d).astype(int).astype(object)
+    out[nan] = None
+    return out
+
+
+def _preserved_notes(tids: np.ndarray, notes: Dict[str, str]) -> np.ndarray:
+    """Existing description per template id, minus stale "no slot"/window explanations."""
+    out = _objects([notes.get(t) for t in tids])
+    for i, desc in enumerate(out):
+        if desc and ("No available time slot" in desc or "window" in desc.lower()):
+            out[i] = None
+    return out
+
+
+def schedule_rows(
+    df: pd.DataFrame,
+    *,
+    user_id: str,
+    local_date: str,
+    timezone: str,
+    notes: Optional[Dict[str, str]] = None,
+    whitelist: Any = None,
+) -> Tuple[Rows, Rows]:
+    """
+    Split a computed schedule into (rows to upsert on (user_id, local_date,
+    template_id), existing rows to update by id), both in the scheduled_tasks
+    write shape. Existing rows are the ones with an id and no template id of
+    their own (or one equal to the id).
+    """
+    n = len(df)
+    tids = row_template_ids(df)
+    row_ids = _column(df, "id")
+    has_tid = ~pd.isna(tids)
+    existing = _truthy(row_ids) & ~pd.isna(row_ids)
+    existing &= ~has_tid | (tids == _as_str(row_ids))
+
+    keep = ~existing & has_tid
+    if whitelist and isinstance(whitelist, (set, list, tuple)):
+        allowed = set(whitelist)
+        keep &= np.array([t in allowed for t in tids], dtype=bool)
+    start = utc_iso(df["start_time"]) if "start_time" in df.columns else _objects([None] * n)
+    end = utc_iso(df["end_time"]) if "end_time" in df.columns else _objects([None] * n)
+    keep &= ~pd.isna(start)
+
+    new = df[keep]
+    k = len(new)
+    upserts = Rows({
+        "user_id": _objects([user_id] * k),
+        "local_date": _objects([local_date] * k),
+        "template_id": tids[keep],
+        "title": titles(new),
+        "start_time": start[keep],
+        "end_time": end[keep],
+        "duration_minutes": durations(_column(new, "duration_minutes")),
+        "timezone": _objects([timezone] * k),
+        **{flag: _truthy(_column(new, flag)) for flag in FLAG_COLUMNS},
+        "priority": priorities(_column(new, "priority")),
+        "description": _preserved_notes(tids[keep], notes or {}),
+    }, k)
+
+    old = df[existing]
+    updates = Rows({
+        "id": _as_str(row_ids[existing]),
+        "start_time": start[existing],
+        "end_time": end[existing],
+        "duration_minutes": durations(_column(old, "duration_minutes")),
+        "priority": priorities(_column(old, "priority")),
+    }, len(old))
+    return upserts, updates
@@ -0,0 +1,509 @@
+# dayflow/sqlite_store.py
+"""
+Embedded SQLite backend for single-user / self-hosted runs.
+
+A laptop install (run-scheduler.ps1, start-local-scheduler.ps1) doesn't need a
+network round trip per query: SqliteStore keeps task_templates, scheduled_tasks and
+scheduled_tasks_archive (and plans staged by --precompute) in one local file and
+implements the same Store semantics the planner relies on:
+  - filters (eq/neq/lt/lte/gt/gte/in/is + keyset after/before), order with Postgres
+    NULL placement, limits, exact counts for stream()
+  - upsert on (user_id, local_date, template_id) or id with RETURNING, ids and
+    created_at defaulted like the Postgres schema
+  - rows come back JSON-shaped (booleans as bool, json columns decoded)
+  - the same indexes as supabase/planner-indexes.sql, WAL journal
+
+The file starts with the key and indexed columns only. Other columns are added,
+typed from their values, the first time a pull or a planner write carries them.
+schedule_day trims its writes to table_columns(), so for scheduled_tasks that
+reports the columns the planner writes even before the file has them; a new
+user's first run creates them. Selecting a column the file doesn't have
+returns NULL for it.
+
+Sync with Supabase is one-shot and explicit:
+
+    python -m dayflow.sqlite_store pull --user <user_id>          # Supabase -> local
+    python -m dayflow.scheduler_main --backend sqlite --user <user_id> --force
+    python -m dayflow.sqlite_store push --user <user_id> [--date YYYY-MM-DD]
+
+pull replaces the user's local rows with the remote ones (scheduled rows from
+--since, default the oldest remote local_date). push makes the remote day(s) match the
+local schedule. It upserts the local rows on the scheduler's conflict target and
+deletes the remote incomplete, not-deleted rows the local run removed. Templates
+are only pulled, because the scheduler never edits them.
+
+Config (env, all optional):
+  DAYFLOW_SQLITE_PATH         database file (default ~/.dayflow/dayflow.sqlite3)
+  DAYFLOW_SQLITE_BUSY_MS      wait for a locked database this long (default 5000)
+"""
+import os
+import sys
+import json
+import uuid
+import logging
+import sqlite3
+import argparse
+import threading
+from datetime import date, datetime, time
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dayflow.store import Store, Filter, _check_filters, _date_bounds
+
+BOOL, INT, REAL, TEXT, JSON = "BOOLEAN", "INTEGER", "REAL", "TEXT", "JSON"
+
+# Only the keys and indexed columns are fixed; everything else arrives with the
+# pulled rows or the planner's writes, so the file ends up with the remote's columns
+# (a column declared here that Supabase doesn't have would read back as NULL where
+# PostgREST omits it).
+_TASK_COLUMNS = [
+    ("id", TEXT), ("user_id", TEXT), ("template_id", TEXT), ("local_date", TEXT),
+    ("start_time", TEXT), ("is_completed", BOOL), ("is_deleted", BOOL), ("created_at", TEXT),
+]
+
+SCHEMA: Dict[str, List[Tuple[str, str]]] = {
+    "task_templates": [("id", TEXT), ("user_id", TEXT), ("is_deleted", BOOL), ("created_at", TEXT)],
+    "scheduled_tasks": _TASK_COLUMNS,
+    "scheduled_tasks_archive": _TASK_COLUMNS + [("archived_at", TEXT)],
+    # Plans staged by --precompute (dayflow/precompute.py, supabase/staged-schedules.sql)
+    "staged_schedules": [("user_id", TEXT), ("local_date", TEXT), ("status", TEXT),
+                         ("inputs", JSON), ("writes", JSON), ("computed_at", TEXT)],
+}
+
+# What schedule_day writes to scheduled_tasks beyond the fixed columns above
+# (reported by table_columns so the planner's column trim keeps them)
+_PLANNER_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "scheduled_tasks": ("title", "end_time", "duration_minutes", "is_appointment", "is_routine",
+                        "is_fixed", "timezone", "priority", "description"),
+}
+
+_NOW_SQL = "(strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))"
+_DEFAULTS = {"is_completed": "0", "is_deleted": "0", "created_at": _NOW_SQL, "archived_at": _NOW_SQL,
+             "computed_at": _NOW_SQL}
+
+# Mirrors supabase/planner-indexes.sql and latest-instance-per-template.sql
+_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_sched_user_day_template ON scheduled_tasks (user_id, local_date, template_id)",
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_date_id ON scheduled_tasks (user_id, local_date, id)",
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_template_latest ON scheduled_tasks (template_id, local_date DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_date_deleted ON scheduled_tasks (user_id, local_date) WHERE is_deleted = 1",
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_date_unscheduled ON scheduled_tasks (user_id, local_date) WHERE start_time IS NULL",
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_archive_user_date_id ON scheduled_tasks_archive (user_id, local_date, id)",
+    "CREATE INDEX IF NOT EXISTS idx_task_templates_user ON task_templates (user_id, is_deleted)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_staged_schedules_user_day ON staged_schedules (user_id, local_date)",
+]
+
+_PRIMARY_KEY = {"task_templates": "id", "scheduled_tasks": "id"}   # the archive may hold an id twice
+
+
+def _q(ident: str) -> str:
+    return '"' + str(ident).replace('"', '""') + '"'
+
+
+def _adapt(value: Any) -> Any:
+    """Python/JSON value -> what SQLite stores (ISO text for dates, JSON text for objects)."""
+    if isinstance(value, bool) or value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def _infer_type(values: Iterable[Any]) -> str:
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return BOOL
+        if isinstance(v, int):
+            return INT
+        if isinstance(v, (float, Decimal)):
+            return REAL
+        if isinstance(v, (dict, list, tuple)):
+            return JSON
+        return TEXT
+    return TEXT
+
+
+class SqliteStore(Store):
+    """Store over a local SQLite file (one connection per thread, WAL)."""
+
+    backend = "sqlite"
+
+    def __init__(self, path: Optional[str] = None):
+        path = path or os.getenv("DAYFLOW_SQLITE_PATH") or str(Path.home() / ".dayflow" / "dayflow.sqlite3")
+        self._uri = path == ":memory:"
+        if self._uri:
+            # one shared in-memory database for every thread of this store
+            path = f"file:dayflow-{uuid.uuid4().hex}?mode=memory&cache=shared"
+        else:
+            Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+            path = str(Path(path).expanduser())
+        self.path = path
+        self.busy_ms = int(os.getenv("DAYFLOW_SQLITE_BUSY_MS", "5000"))
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._types: Dict[str, Dict[str, str]] = {}
+        self._create_schema()
+
+    # -----------------------
+    # Connections / schema
+    # -----------------------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, uri=self._uri, timeout=self.busy_ms / 1000, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA busy_timeout = {self.busy_ms}")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _create_schema(self) -> None:
+        conn = self._conn()
+        if not self._uri:
+            conn.execute("PRAGMA journal_mode = WAL")
+        with conn:
+            for table, cols in SCHEMA.items():
+                defs = []
+                for name, typ in cols:
+                    d = f"{_q(name)} {typ}"
+                    if name == _PRIMARY_KEY.get(table):
+                        d += " PRIMARY KEY"
+                    if name in _DEFAULTS:
+                        d += f" DEFAULT {_DEFAULTS[name]}"
+                    defs.append(d)
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {_q(table)} ({', '.join(defs)})")
+            for ddl in _INDEXES:
+                conn.execute(ddl)
+        for table in SCHEMA:
+            self._load_types(table)
+
+    def _load_types(self, table: str) -> Dict[str, str]:
+        rows = self._conn().execute(f"PRAGMA table_info({_q(table)})").fetchall()
+        types = {r["name"]: (r["type"] or TEXT).upper() for r in rows}
+        with self._lock:
+            self._types[table] = types
+        return types
+
+    def _columns(self, table: str) -> Dict[str, str]:
+        if table not in SCHEMA:
+            raise ValueError(f"SqliteStore: unknown table '{table}'")
+        with self._lock:
+            types = self._types.get(table)
+        return types if types is not None else self._load_types(table)
+
+    def _ensure_columns(self, table: str, rows: List[Dict]) -> None:
+        """ALTER TABLE ADD COLUMN for keys the file doesn't have yet (typed from the values)."""
+        known = self._columns(table)
+        missing = sorted({k for r in rows for k in r} - set(known))
+        if not missing:
+            return
+        conn = self._conn()
+        with conn:
+            for col in missing:
+                typ = _infer_type(r.get(col) for r in rows)
+                try:
+                    conn.execute(f"ALTER TABLE {_q(table)} ADD COLUMN {_q(col)} {typ}")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):   # another thread added it first
+                        raise
+                logging.info("sqlite: added column %s.%s (%s)", table, col, typ)
+        self._load_types(table)
+
+    def _row_out(self, table: str, row: sqlite3.Row) -> Dict:
+        types = self._columns(table)
+        out = {}
+        for k in row.keys():
+            v = row[k]
+            typ = types.get(k)
+            if v is not None and typ == BOOL:
+                v = bool(v)
+            elif v is not None and typ == JSON and isinstance(v, str):
+                try:
+                    v = json.loads(v)
+                except ValueError:
+                    pass
+            out[k] = v
+        return out
+
+    # -----------------------
+    # SQL building
+    # -----------------------
+    def _columns_sql(self, table: str, columns: str) -> str:
+        cols = [c.strip() for c in (columns or "*").split(",") if c.strip()]
+        if not cols or cols == ["*"]:
+            return "*"
+        known = self._columns(table)
+        return ", ".join(_q(c) if c in known else f"NULL AS {_q(c)}" for c in cols)
+
+    @staticmethod
+    def _where_sql(filters: Iterable[Filter]) -> Tuple[str, List[Any]]:
+        parts, params = [], []
+        ops = {"eq": "=", "neq": "<>", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+        for op, col, val in _check_filters(filters):
+            if op in ("after", "before"):
+                parts.append(
+                    f"({', '.join(_q(c) for c in col)}) {'>' if op == 'after' else '<'} "
+                    f"({', '.join('?' for _ in val)})"
+                )
+                params.extend(_adapt(v) for v in val)
+            elif op == "in":
+                vals = list(val)
+                if not vals:
+                    parts.append("0")
+                    continue
+                parts.append(f"{_q(col)} IN ({', '.join('?' for _ in vals)})")
+                params.extend(_adapt(v) for v in vals)
+            elif op == "is":
+                parts.append(f"{_q(col)} IS " + ("NULL" if val is None else ("TRUE" if val else "FALSE")))
+            else:
+                parts.append(f"{_q(col)} {ops[op]} ?")
+                params.append(_adapt(val))
+        return (" WHERE " + " AND ".join(parts)) if parts else "", params
+
+    def _select_sql(self, table, columns, filters, order, limit) -> Tuple[str, List[Any]]:
+        where, params = self._where_sql(filters)
+        query = f"SELECT {self._columns_sql(table, columns)} FROM {_q(table)}{where}"
+        if order:
+            # Postgres places NULLs last ascending and first descending
+            query += " ORDER BY " + ", ".join(
+                f"{_q(col)} {'DESC NULLS FIRST' if desc else 'ASC NULLS LAST'}" for col, desc in order
+            )
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        return query, params
+
+    # -----------------------
+    # Reads
+    # -----------------------
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        query, params = self._select_sql(table, columns, filters, order, limit)
+        return [self._row_out(table, r) for r in self._conn().execute(query, params)]
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        filters = list(filters or ())
+        rows = self.select(table, columns, filters=filters, order=order, limit=limit)
+        total = None
+        if count:
+            where, params = self._where_sql(filters)
+            total = self._conn().execute(f"SELECT COUNT(*) FROM {_q(table)}{where}", params).fetchone()[0]
+        return rows, total
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        ids = list(template_ids or ())
+        if not ids:
+            return []
+        where, params = self._where_sql([("in", "template_id", ids)] + _date_bounds(since, until))
+        query = (
+            "SELECT template_id, local_date, is_deleted, is_completed FROM ("
+            " SELECT template_id, local_date, is_deleted, is_completed,"
+            " ROW_NUMBER() OVER (PARTITION BY template_id ORDER BY local_date DESC, id DESC) AS rn"
+            f" FROM scheduled_tasks{where}) WHERE rn = 1"
+        )
+        return [self._row_out("scheduled_tasks", r) for r in self._conn().execute(query, params)]
+
+    def table_columns(self, table):
+        return set(self._load_types(table)) | set(_PLANNER_COLUMNS.get(table, ()))
+
+    def replication_lag(self):
+        return 0.0
+
+    # -----------------------
+    # Writes
+    # -----------------------
+    def _with_defaults(self, table: str, row: Dict) -> Dict:
+        if _PRIMARY_KEY.get(table) == "id" and not row.get("id"):
+            row = dict(row, id=str(uuid.uuid4()))
+        return row
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        if not rows:
+            return []
+        self._ensure_columns(table, rows)
+        conflict_cols = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        target = ", ".join(_q(c) for c in conflict_cols)
+        out: List[Dict] = []
+        conn = self._conn()
+        with conn:
+            for r in rows:
+                # like Postgres, columns the caller didn't send keep their value on conflict
+                updates = [c for c in r if c not in conflict_cols]
+                r = self._with_defaults(table, r)
+                cols = list(r)
+                if ignore_duplicates or not updates:
+                    action = "DO NOTHING"
+                else:
+                    action = "DO UPDATE SET " + ", ".join(f"{_q(c)} = excluded.{_q(c)}" for c in updates)
+                query = (
+                    f"INSERT INTO {_q(table)} ({', '.join(_q(c) for c in cols)}) "
+                    f"VALUES ({', '.join('?' for _ in cols)}) ON CONFLICT ({target}) {action} RETURNING *"
+                )
+                out.extend(self._row_out(table, x) for x in conn.execute(query, [_adapt(r[c]) for c in cols]))
+        return out
+
+    def insert(self, table: str, rows: List[Dict], *, replace: bool = False) -> int:
+        """Plain bulk insert (used by pull); replace=True overwrites rows with the same primary key."""
+        if not rows:
+            return 0
+        self._ensure_columns(table, rows)
+        conn = self._conn()
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        with conn:
+            for r in rows:
+                r = self._with_defaults(table, r)
+                cols = list(r)
+                conn.execute(
+                    f"{verb} INTO {_q(table)} ({', '.join(_q(c) for c in cols)}) VALUES ({', '.join('?' for _ in cols)})",
+                    [_adapt(r[c]) for c in cols],
+                )
+        return len(rows)
+
+    def update(self, table, values, *, filters):
+        if not values:
+            return []
+        self._ensure_columns(table, [values])
+        where, params = self._where_sql(filters)
+        sets = ", ".join(f"{_q(k)} = ?" for k in values)
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                f"UPDATE {_q(table)} SET {sets}{where} RETURNING *",
+                [_adapt(v) for v in values.values()] + params,
+            )
+            return [self._row_out(table, r) for r in cur.fetchall()]
+
+    def delete(self, table, *, filters):
+        filters = list(filters or ())
+        if not filters:
+            raise ValueError("SqliteStore.delete refuses to run without filters")
+        where, params = self._where_sql(filters)
+        conn = self._conn()
+        with conn:
+            return conn.execute(f"DELETE FROM {_q(table)}{where}", params).rowcount
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for c in conns:
+            try:
+                c.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+# -----------------------
+# One-shot sync with Supabase
+# -----------------------
+def pull(remote: Store, local: SqliteStore, user_id: str, *, since: Optional[date] = None) -> Dict[str, int]:
+    """Replace `user_id`'s local rows with the remote ones (scheduled rows from `since`)."""
+    from dayflow import partitions
+
+    since_s = (since or partitions.history_start(remote)).isoformat()
+    counts: Dict[str, int] = {}
+    for table in ("task_templates", "scheduled_tasks", "scheduled_tasks_archive"):
+        scope = [("eq", "user_id", user_id)]
+        if table == "task_templates":
+            rows = list(remote.stream(table, "*", filters=scope, key=("id",)))
+        else:
+            scope.append(("gte", "local_date", since_s))
+            rows = list(remote.stream(table, "*", filters=scope))
+        local.delete(table, filters=scope)
+        counts[table] = local.insert(table, rows, replace=table in _PRIMARY_KEY)
+    return counts
+
+
+def push(local: SqliteStore, remote: Store, user_id: str, dates: Iterable[date]) -> Dict[str, int]:
+    """
+    Make the remote scheduled_tasks for `user_id` on `dates` match the local ones:
+    upsert local rows on (user_id, local_date, template_id), update template-less rows
+    by id, and delete the remote incomplete rows the local run removed.
+    """
+    from dayflow import columns as column_registry
+    from dayflow.writer import upsert_rows
+
+    remote_cols = column_registry.table_columns(remote, "scheduled_tasks")
+    counts = {"upserted": 0, "updated": 0, "deleted": 0}
+    for d in dates:
+        day = d.isoformat()
+        scope = [("eq", "user_id", user_id), ("eq", "local_date", day)]
+        local_rows = local.select("scheduled_tasks", "*", filters=scope)
+        local_ids = {r["id"] for r in local_rows}
+        stale = [
+            r["id"] for r in remote.select(
+                "scheduled_tasks", "id",
+                filters=scope + [("eq", "is_completed", False), ("eq", "is_deleted", False)],
+            )
+            if r["id"] not in local_ids
+        ]
+        if stale:
+            counts["deleted"] += remote.delete("scheduled_tasks", filters=[("eq", "local_date", day), ("in", "id", stale)])
+
+        def _remote_shape(r: Dict, drop: Tuple[str, ...]) -> Dict:
+            return {k: v for k, v in r.items() if k not in drop and (not remote_cols or k in remote_cols)}
+
+        templated = [_remote_shape(r, ("id", "created_at")) for r in local_rows if r.get("template_id")]
+        counts["upserted"] += len(upsert_rows(remote, "scheduled_tasks", templated, on_conflict="user_id,local_date,template_id"))
+        for r in local_rows:
+            if not r.get("template_id"):
+                counts["updated"] += len(remote.update(
+                    "scheduled_tasks", _remote_shape(r, ("id", "user_id", "local_date", "created_at")),
+                    filters=[("eq", "local_date", day), ("eq", "id", r["id"])],
+                ))
+    return counts
+
+
+def main(argv: Optional[list] = None) -> int:
+    from datetime import timedelta
+    from dayflow.store import build_store
+
+    p = argparse.ArgumentParser(description="One-shot sync between Supabase and the local SQLite store")
+    p.add_argument("direction", choices=["pull", "push"])
+    p.add_argument("--user", default=os.getenv("TEST_USER_ID"), help="user_id to sync")
+    p.add_argument("--path", default=None, help="SQLite file (default DAYFLOW_SQLITE_PATH)")
+    p.add_argument("--since", default=None, help="pull: first local_date to copy (default: all history)")
+    p.add_argument("--date", action="append", default=None,
+                   help="push: local_date to push (repeatable; default today)")
+    p.add_argument("--days", type=int, default=1, help="push: push this many days starting at --date (default 1)")
+    p.add_argument("--backend", choices=["postgrest", "postgres"], default="postgrest", help="remote backend")
+    args = p.parse_args(argv)
+    if not args.user:
+        p.error("--user (or TEST_USER_ID) is required")
+
+    logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "WARNING"), logging.WARNING))
+    if args.backend == "postgres":
+        remote = build_store("postgres")
+    else:
+        from supabase import create_client  # type: ignore
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
+        remote = build_store("postgrest", client=create_client(os.getenv("SUPABASE_URL"), key))
+    local = SqliteStore(args.path)
+    try:
+        if args.direction == "pull":
+            since = datetime.strptime(args.since, "%Y-%m-%d").date() if args.since else None
+            counts = pull(remote, local, args.user, since=since)
+        else:
+            starts = [datetime.strptime(d, "%Y-%m-%d").date() for d in args.date] if args.date else [date.today()]
+            days = sorted({s + timedelta(days=i) for s in starts for i in range(max(1, args.days))})
+            counts = push(local, remote, args.user, days)
+    finally:
+        local.close()
+        remote.close()
+    print(f"{args.direction}: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
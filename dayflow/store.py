@@ -0,0 +1,699 @@
+# dayflow/store.py
+"""
+Data-access layer for the scheduler.
+
+The planner and carry-forward code only talk to a Store. A Store exposes a
+handful of table operations (select / upsert / update / delete) described with
+plain filter tuples, and each backend turns those into its own wire format:
+
+  - PostgrestStore: the existing path, via the supabase-py client (web / Railway)
+  - PostgresStore:  direct SQL over a psycopg connection pool, with server-side
+                    cursors for large reads and COPY / executemany for bulk writes
+                    (batch jobs, backfills)
+  - SqliteStore:    a local SQLite file (dayflow/sqlite_store.py) for single-user /
+                    self-hosted runs, synced with Supabase on demand
+
+Filters are (op, column, value) tuples, e.g.
+    [("eq", "user_id", uid), ("lt", "local_date", "2025-12-01"), ("is", "start_time", None)]
+Supported ops: eq, neq, lt, lte, gt, gte, in, is, plus the keyset ops used by
+stream(): ("after" | "before", (col_a, col_b), (val_a, val_b)), i.e. a row-value
+comparison (col_a, col_b) > / < (val_a, val_b).
+
+Order is a list of (column, desc) tuples, e.g. [("local_date", True)].
+
+Large reads should use stream(), which pages by keyset (local_date, id) with a
+bounded page size, yields rows lazily, and raises TruncatedReadError if it
+delivers fewer rows than the server counted (e.g. PostgREST max-rows caps).
+
+Rows always come back JSON-shaped (dates/timestamps as ISO strings, uuids as str),
+whatever the backend, so callers behave the same on either path.
+"""
+import os
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+Filter = Tuple[str, Any, Any]
+Order = Sequence[Tuple[str, bool]]
+
+FILTER_OPS = {"eq", "neq", "lt", "lte", "gt", "gte", "in", "is", "after", "before"}
+
+DEFAULT_KEYSET = ("local_date", "id")
+
+
+class TruncatedReadError(RuntimeError):
+    """A streamed read delivered fewer rows than the server said match."""
+
+
+def _stream_page_size() -> int:
+    try:
+        return max(1, int(os.getenv("DAYFLOW_STREAM_PAGE_SIZE", "1000")))
+    except ValueError:
+        return 1000
+
+
+def _with_key_columns(columns: str, key: Sequence[str]) -> str:
+    cols = [c.strip() for c in (columns or "*").split(",") if c.strip()]
+    if not cols or "*" in cols:
+        return "*"
+    return ", ".join(cols + [k for k in key if k not in cols])
+
+
+class Store:
+    """Backend-neutral access to task_templates / scheduled_tasks / scheduled_tasks_archive."""
+
+    backend = "base"
+
+    def select(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable[Filter] = (),
+        order: Optional[Order] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        raise NotImplementedError
+
+    def upsert(
+        self,
+        table: str,
+        rows: List[Dict],
+        *,
+        on_conflict: str,
+        ignore_duplicates: bool = False,
+    ) -> List[Dict]:
+        raise NotImplementedError
+
+    def update(self, table: str, values: Dict, *, filters: Iterable[Filter]) -> List[Dict]:
+        raise NotImplementedError
+
+    def delete(self, table: str, *, filters: Iterable[Filter]) -> int:
+        raise NotImplementedError
+
+    def select_page(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable[Filter] = (),
+        order: Optional[Order] = None,
+        limit: Optional[int] = None,
+        count: bool = False,
+    ) -> Tuple[List[Dict], Optional[int]]:
+        """Like select(), plus the server-side total (ignoring limit) when count=True."""
+        rows = self.select(table, columns, filters=filters, order=order, limit=limit)
+        return rows, None
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable[Filter] = (),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key: Sequence[str] = DEFAULT_KEYSET,
+    ) -> Iterator[Dict]:
+        """
+        Yield every matching row, ordered by `key` (default local_date, id), one bounded
+        page at a time. The first page also asks for the exact total; if the pages run
+        out before that many rows arrive, TruncatedReadError is raised instead of
+        silently returning a partial history.
+        """
+        page_size = page_size or _stream_page_size()
+        base_filters = _check_filters(filters)
+        columns = _with_key_columns(columns, key)
+        order = [(k, desc) for k in key]
+        cursor: Optional[Tuple] = None
+        expected: Optional[int] = None
+        seen = 0
+        while True:
+            page_filters = list(base_filters)
+            if cursor is not None:
+                page_filters.append(("before" if desc else "after", tuple(key), cursor))
+            rows, total = self.select_page(
+                table, columns, filters=page_filters, order=order, limit=page_size, count=cursor is None
+            )
+            if cursor is None:
+                expected = total
+            for row in rows:
+                yield row
+            seen += len(rows)
+            if not rows:
+                break
+            if expected is not None and seen >= expected:
+                break
+            if expected is None and len(rows) < page_size:
+                break
+            cursor = tuple(rows[-1].get(k) for k in key)
+
+        if expected is not None and seen < expected:
+            raise TruncatedReadError(
+                f"stream({table}): got {seen} row(s) but the server counted {expected}"
+            )
+        logging.debug("stream(%s): %d row(s) in pages of %d", table, seen, page_size)
+
+    def latest_per_template(
+        self, template_ids: Sequence[str], *, since: Optional[str] = None, until: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Most recent scheduled_tasks row per template (template_id, local_date, is_deleted,
+        is_completed) - exactly one row per template that has any instance with
+        since <= local_date < until (either bound optional).
+        Generic fallback: stream newest-first and keep the first row seen per template.
+        """
+        ids = list(template_ids or ())
+        if not ids:
+            return []
+        latest: Dict[str, Dict] = {}
+        for row in self.stream(
+            "scheduled_tasks", "template_id, local_date, is_deleted, is_completed",
+            filters=[("in", "template_id", ids)] + _date_bounds(since, until), desc=True,
+        ):
+            tid = row.get("template_id")
+            if tid and tid not in latest:
+                latest[tid] = row
+        return list(latest.values())
+
+    def table_columns(self, table: str) -> set:
+        """Best-effort column discovery (empty set if the table has no rows / is unreachable)."""
+        rows = self.select(table, "*", limit=1)
+        return set(rows[0].keys()) if rows else set()
+
+    def replication_lag(self) -> Optional[float]:
+        """Seconds this endpoint trails the primary (0 on the primary itself); None if unknown."""
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+def _date_bounds(since: Optional[str], until: Optional[str]) -> List[Filter]:
+    out: List[Filter] = []
+    if since:
+        out.append(("gte", "local_date", str(since)))
+    if until:
+        out.append(("lt", "local_date", str(until)))
+    return out
+
+
+def pages_via_select_page(store: Store) -> bool:
+    """
+    True if the innermost backend streams with the generic keyset loop (one
+    select_page() per page). Wrappers use this to run stream() through their own
+    select_page() so every page gets their per-call policy.
+    """
+    while getattr(store, "inner", None) is not None:
+        store = store.inner
+    return type(store).stream is Store.stream
+
+
+def _check_filters(filters: Iterable[Filter]) -> List[Filter]:
+    out = list(filters or ())
+    for op, col, _ in out:
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter op '{op}' on column '{col}'")
+    return out
+
+
+# ---------------------------------------------------------------------------
+# PostgREST (supabase-py)
+# ---------------------------------------------------------------------------
+def _rpc_missing(exc: BaseException) -> bool:
+    """PostgREST's "function not found" (PGRST202, HTTP 404): the SQL hasn't been applied."""
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return getattr(exc, "code", None) == "PGRST202" or str(status) == "404" or "PGRST202" in str(exc)
+
+
+class PostgrestStore(Store):
+    """The existing path: PostgREST through a supabase-py client."""
+
+    backend = "postgrest"
+
+    def __init__(self, client: Any):
+        self.client = client
+        self._has_latest_rpc = True
+        self._has_lag_rpc = True
+
+    @staticmethod
+    def _apply_filters(q, filters: Iterable[Filter]):
+        for op, col, val in _check_filters(filters):
+            if op in ("after", "before"):
+                # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y)
+                cmp = "gt" if op == "after" else "lt"
+                (a, b), (x, y) = col, val
+                q = q.or_(f"{a}.{cmp}.{x},and({a}.eq.{x},{b}.{cmp}.{y})")
+            elif op == "in":
+                q = q.in_(col, list(val))
+            elif op == "is":
+                q = q.is_(col, "null" if val is None else str(val).lower())
+            else:
+                q = getattr(q, op)(col, val)
+        return q
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        return self.select_page(table, columns, filters=filters, order=order, limit=limit)[0]
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        q = self.client.table(table).select(columns, count="exact") if count else self.client.table(table).select(columns)
+        q = self._apply_filters(q, filters)
+        for col, desc in (order or ()):
+            q = q.order(col, desc=desc)
+        if limit is not None:
+            q = q.limit(limit)
+        resp = q.execute()
+        return resp.data or [], (getattr(resp, "count", None) if count else None)
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        """
+        One row per template via the latest_instance_per_template() RPC
+        (supabase/latest-instance-per-template.sql; the since/until bounds need the
+        version in supabase/partition-scheduled-tasks.sql). Falls back to the streaming
+        scan if the function has not been installed yet; any other error is raised.
+        """
+        ids = list(template_ids or ())
+        if not ids:
+            return []
+        if self._has_latest_rpc:
+            params: Dict[str, Any] = {"p_template_ids": ids}
+            if since:
+                params["p_since"] = str(since)
+            if until:
+                params["p_until"] = str(until)
+            try:
+                resp = self.client.rpc("latest_instance_per_template", params).execute()
+                return resp.data or []
+            except Exception as e:
+                if not _rpc_missing(e):
+                    raise
+                self._has_latest_rpc = False
+                logging.warning(
+                    "latest_instance_per_template RPC unavailable (%s); falling back to a streamed scan. "
+                    "Apply supabase/latest-instance-per-template.sql to fix.", e
+                )
+        return super().latest_per_template(ids, since=since, until=until)
+
+    def replication_lag(self):
+        """Via replica_lag_seconds() (supabase/replica-lag.sql); None if it isn't installed."""
+        if not self._has_lag_rpc:
+            return None
+        try:
+            data = self.client.rpc("replica_lag_seconds", {}).execute().data
+        except Exception as e:
+            if not _rpc_missing(e):
+                raise
+            self._has_lag_rpc = False
+            logging.warning("replica_lag_seconds RPC unavailable (%s); apply supabase/replica-lag.sql", e)
+            return None
+        if isinstance(data, list):
+            data = data[0] if data else None
+        if isinstance(data, dict):
+            data = next(iter(data.values()), None)
+        return float(data) if data is not None else None
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        if not rows:
+            return []
+        resp = self.client.table(table).upsert(
+            rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates
+        ).execute()
+        return resp.data or []
+
+    def update(self, table, values, *, filters):
+        q = self._apply_filters(self.client.table(table).update(values), filters)
+        return q.execute().data or []
+
+    def delete(self, table, *, filters):
+        q = self._apply_filters(self.client.table(table).delete(), filters)
+        return len(q.execute().data or [])
+
+
+# ---------------------------------------------------------------------------
+# Direct Postgres (psycopg 3)
+# ---------------------------------------------------------------------------
+def _jsonable(value: Any) -> Any:
+    """Shape DB values the way PostgREST would return them in JSON."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+def _jsonable_row(row: Dict) -> Dict:
+    return {k: _jsonable(v) for k, v in row.items()}
+
+
+# 0 when caught up (or on a primary, where the replay functions return NULL)
+_REPLICA_LAG_SQL = (
+    "SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)"
+)
+
+
+class PostgresStore(Store):
+    """
+    Direct SQL backend for batch jobs. Needs `psycopg` (v3) and `psycopg_pool`:
+        pip install "psycopg[binary]" psycopg_pool
+
+    Config (env, all optional):
+      DAYFLOW_DATABASE_URL / DATABASE_URL  connection string (service role / postgres user)
+      DAYFLOW_PG_POOL_MIN / _MAX           pool bounds (default 1 / 5)
+      DAYFLOW_PG_ITERSIZE                  rows per server-side cursor fetch (default 2000)
+      DAYFLOW_COPY_THRESHOLD               upserts at/above this size go through COPY (default 500)
+    """
+
+    backend = "postgres"
+
+    def __init__(self, dsn: Optional[str] = None, *, min_size: Optional[int] = None, max_size: Optional[int] = None):
+        try:
+            from psycopg_pool import ConnectionPool  # type: ignore
+        except Exception as e:
+            raise RuntimeError(
+                "PostgresStore needs psycopg 3 and psycopg_pool (pip install 'psycopg[binary]' psycopg_pool)"
+            ) from e
+
+        self.dsn = dsn or os.getenv("DAYFLOW_DATABASE_URL") or os.getenv("DATABASE_URL")
+        if not self.dsn:
+            raise RuntimeError("PostgresStore: set DAYFLOW_DATABASE_URL (or DATABASE_URL)")
+        self.itersize = int(os.getenv("DAYFLOW_PG_ITERSIZE", "2000"))
+        self.copy_threshold = int(os.getenv("DAYFLOW_COPY_THRESHOLD", "500"))
+        self.pool = ConnectionPool(
+            self.dsn,
+            min_size=min_size or int(os.getenv("DAYFLOW_PG_POOL_MIN", "1")),
+            max_size=max_size or int(os.getenv("DAYFLOW_PG_POOL_MAX", "5")),
+            open=True,
+        )
+        self._cursor_seq = 0
+        self._seq_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a pooled connection, e.g. for archive_then_delete_scheduled_tasks_by_ids(conn, ...).
+        """
+        with self.pool.connection() as conn:
+            yield conn
+
+    # -----------------------
+    # SQL building
+    # -----------------------
+    @staticmethod
+    def _columns_sql(columns: str):
+        from psycopg import sql  # type: ignore
+
+        cols = [c.strip() for c in (columns or "*").split(",") if c.strip()]
+        if not cols or cols == ["*"]:
+            return sql.SQL("*")
+        return sql.SQL(", ").join(sql.Identifier(c) for c in cols)
+
+    @staticmethod
+    def _where_sql(filters: Iterable[Filter]):
+        from psycopg import sql  # type: ignore
+
+        parts, params = [], []
+        ops = {"eq": "=", "neq": "<>", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+        for op, col, val in _check_filters(filters):
+            if op in ("after", "before"):
+                parts.append(sql.SQL("({}) " + (">" if op == "after" else "<") + " ({})").format(
+                    sql.SQL(", ").join(sql.Identifier(c) for c in col),
+                    sql.SQL(", ").join(sql.Placeholder() for _ in val),
+                ))
+                params.extend(val)
+                continue
+            ident = sql.Identifier(col)
+            if op == "in":
+                # Expanded placeholders (not = ANY(%s)): psycopg sends str lists as text[],
+                # which would not compare against uuid/date columns.
+                vals = list(val)
+                if not vals:
+                    parts.append(sql.SQL("FALSE"))
+                    continue
+                parts.append(sql.SQL("{} IN ({})").format(ident, sql.SQL(", ").join(sql.Placeholder() for _ in vals)))
+                params.extend(vals)
+            elif op == "is":
+                if val is None:
+                    parts.append(sql.SQL("{} IS NULL").format(ident))
+                else:
+                    parts.append(sql.SQL("{} IS " + ("TRUE" if val else "FALSE")).format(ident))
+            else:
+                parts.append(sql.SQL("{} " + ops[op] + " %s").format(ident))
+                params.append(val)
+        if not parts:
+            return sql.SQL(""), params
+        return sql.SQL(" WHERE ") + sql.SQL(" AND ").join(parts), params
+
+    def _select_sql(self, table, columns, filters, order, limit):
+        from psycopg import sql  # type: ignore
+
+        where, params = self._where_sql(filters)
+        query = sql.SQL("SELECT {} FROM {}").format(
+            self._columns_sql(columns), sql.Identifier("public", table)
+        ) + where
+        if order:
+            query += sql.SQL(" ORDER BY ") + sql.SQL(", ").join(
+                sql.SQL("{} " + ("DESC" if desc else "ASC")).format(sql.Identifier(col))
+                for col, desc in order
+            )
+        if limit is not None:
+            query += sql.SQL(" LIMIT %s")
+            params.append(int(limit))
+        return query, params
+
+    def _next_cursor_name(self) -> str:
+        with self._seq_lock:
+            self._cursor_seq += 1
+            return f"dayflow_cur_{self._cursor_seq}"
+
+    # -----------------------
+    # Reads
+    # -----------------------
+    def iter_select(self, table, columns="*", *, filters=(), order=None, limit=None) -> Iterator[Dict]:
+        """Stream rows through a server-side (named) cursor, `itersize` rows per round trip."""
+        from psycopg.rows import dict_row  # type: ignore
+
+        query, params = self._select_sql(table, columns, filters, order, limit)
+        with self.pool.connection() as conn:
+            with conn.transaction():
+                with conn.cursor(name=self._next_cursor_name(), row_factory=dict_row) as cur:
+                    cur.itersize = self.itersize
+                    cur.execute(query, params)
+                    for row in cur:
+                        yield _jsonable_row(row)
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        from psycopg.rows import dict_row  # type: ignore
+
+        if limit is not None and limit <= self.itersize:
+            # Small, bounded read: a plain client-side cursor is one round trip
+            query, params = self._select_sql(table, columns, filters, order, limit)
+            with self.pool.connection() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
+                    cur.execute(query, params)
+                    return [_jsonable_row(r) for r in cur.fetchall()]
+        return list(self.iter_select(table, columns, filters=filters, order=order, limit=limit))
+
+    def stream(self, table, columns="*", *, filters=(), desc=False, page_size=None, key=DEFAULT_KEYSET):
+        """
+        A server-side cursor already pages without row caps; fetch `page_size` rows per
+        round trip in keyset order so memory stays bounded.
+        """
+        columns = _with_key_columns(columns, key)
+        order = [(k, desc) for k in key]
+        query, params = self._select_sql(table, columns, filters, order, None)
+        from psycopg.rows import dict_row  # type: ignore
+
+        with self.pool.connection() as conn:
+            with conn.transaction():
+                with conn.cursor(name=self._next_cursor_name(), row_factory=dict_row) as cur:
+                    cur.itersize = page_size or _stream_page_size()
+                    cur.execute(query, params)
+                    for row in cur:
+                        yield _jsonable_row(row)
+
+    def _latest_sql(self, ids, since=None, until=None):
+        from psycopg import sql  # type: ignore
+
+        where, params = self._where_sql([("in", "template_id", ids)] + _date_bounds(since, until))
+        query = sql.SQL(
+            "SELECT DISTINCT ON (template_id) template_id, local_date, is_deleted, is_completed "
+            "FROM public.scheduled_tasks"
+        ) + where + sql.SQL(" ORDER BY template_id, local_date DESC, id DESC")
+        return query, params
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        from psycopg.rows import dict_row  # type: ignore
+
+        ids = list(template_ids or ())
+        if not ids:
+            return []
+        query, params = self._latest_sql(ids, since, until)
+        with self.pool.connection() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(query, params)
+                return [_jsonable_row(r) for r in cur.fetchall()]
+
+    def replication_lag(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_REPLICA_LAG_SQL)
+                row = cur.fetchone()
+                return float(row[0]) if row and row[0] is not None else 0.0
+
+    def table_columns(self, table):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = 'public' AND table_name = %s",
+                    (table,),
+                )
+                return {r[0] for r in cur.fetchall()}
+
+    # -----------------------
+    # Writes
+    # -----------------------
+    @staticmethod
+    def _adapt(value: Any) -> Any:
+        if isinstance(value, dict):
+            from psycopg.types.json import Jsonb  # type: ignore
+            return Jsonb(value)
+        return value
+
+    def _upsert_sql(self, target, source, cols, conflict_cols, ignore_duplicates):
+        from psycopg import sql  # type: ignore
+
+        col_idents = sql.SQL(", ").join(sql.Identifier(c) for c in cols)
+        if ignore_duplicates:
+            action = sql.SQL("DO NOTHING")
+        else:
+            updates = [c for c in cols if c not in conflict_cols]
+            if updates:
+                action = sql.SQL("DO UPDATE SET ") + sql.SQL(", ").join(
+                    sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(c), sql.Identifier(c)) for c in updates
+                )
+            else:
+                action = sql.SQL("DO NOTHING")
+        return sql.SQL("INSERT INTO {} ({}) {} ON CONFLICT ({}) {} RETURNING *").format(
+            target,
+            col_idents,
+            source,
+            sql.SQL(", ").join(sql.Identifier(c) for c in conflict_cols),
+            action,
+        )
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        from psycopg import sql  # type: ignore
+        from psycopg.rows import dict_row  # type: ignore
+
+        if not rows:
+            return []
+        cols: List[str] = []
+        for r in rows:
+            for k in r.keys():
+                if k not in cols:
+                    cols.append(k)
+        conflict_cols = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        target = sql.Identifier("public", table)
+
+        with self.pool.connection() as conn:
+            with conn.transaction():
+                with conn.cursor(row_factory=dict_row) as cur:
+                    if len(rows) >= self.copy_threshold:
+                        # Bulk path: COPY into an untyped-constraint staging table, then one INSERT..SELECT
+                        stage = sql.Identifier(f"_dayflow_stage_{table}")
+                        col_idents = sql.SQL(", ").join(sql.Identifier(c) for c in cols)
+                        cur.execute(
+                            sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+                                stage, col_idents, target
+                            )
+                        )
+                        with cur.copy(sql.SQL("COPY {} ({}) FROM STDIN").format(stage, col_idents)) as copy:
+                            for r in rows:
+                                copy.write_row([self._adapt(r.get(c)) for c in cols])
+                        source = sql.SQL("SELECT {} FROM {}").format(col_idents, stage)
+                        cur.execute(self._upsert_sql(target, source, cols, conflict_cols, ignore_duplicates))
+                        return [_jsonable_row(r) for r in cur.fetchall()]
+
+                    # Small batch: executemany with RETURNING
+                    source = sql.SQL("VALUES ({})").format(sql.SQL(", ").join(sql.Placeholder() for _ in cols))
+                    query = self._upsert_sql(target, source, cols, conflict_cols, ignore_duplicates)
+                    cur.executemany(
+                        query,
+                        [[self._adapt(r.get(c)) for c in cols] for r in rows],
+                        returning=True,
+                    )
+                    out: List[Dict] = []
+                    while True:
+                        out.extend(_jsonable_row(r) for r in cur.fetchall())
+                        if not cur.nextset():
+                            break
+                    return out
+
+    def update(self, table, values, *, filters):
+        from psycopg import sql  # type: ignore
+        from psycopg.rows import dict_row  # type: ignore
+
+        if not values:
+            return []
+        where, params = self._where_sql(filters)
+        sets = sql.SQL(", ").join(sql.SQL("{} = %s").format(sql.Identifier(k)) for k in values)
+        query = sql.SQL("UPDATE {} SET {}").format(sql.Identifier("public", table), sets) + where
+        query += sql.SQL(" RETURNING *")
+        with self.pool.connection() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(query, [self._adapt(v) for v in values.values()] + params)
+                return [_jsonable_row(r) for r in cur.fetchall()]
+
+    def delete(self, table, *, filters):
+        from psycopg import sql  # type: ignore
+
+        filters = list(filters)
+        if not filters:
+            raise ValueError("PostgresStore.delete refuses to run without filters")
+        where, params = self._where_sql(filters)
+        query = sql.SQL("DELETE FROM {}").format(sql.Identifier("public", table)) + where
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                return cur.rowcount
+
+    def close(self):
+        self.pool.close()
+
+
+# ---------------------------------------------------------------------------
+# Factory
+# ---------------------------------------------------------------------------
+def as_store(obj: Any) -> Optional[Store]:
+    """Accept a Store or a raw supabase client (wrapped in PostgrestStore); None stays None."""
+    if obj is None or isinstance(obj, Store):
+        return obj
+    return PostgrestStore(obj)
+
+
+def build_store(backend: Optional[str] = None, *, client: Any = None) -> Optional[Store]:
+    """
+    Pick the backend for a run: DAYFLOW_STORE_BACKEND=postgrest (default) | postgres | sqlite.
+    `client` is the supabase client used by the PostgREST backend.
+    """
+    backend = (backend or os.getenv("DAYFLOW_STORE_BACKEND") or "postgrest").strip().lower()
+    if backend == "postgres":
+        return PostgresStore()
+    if backend == "sqlite":
+        from dayflow.sqlite_store import SqliteStore
+        return SqliteStore()
+    if backend != "postgrest":
+        raise ValueError(f"Unknown store backend '{backend}' (expected postgrest, postgres or sqlite)")
+    return as_store(client)
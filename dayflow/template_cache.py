@@ -0,0 +1,635 @@
+# dayflow/template_cache.py
+"""
+Per-user task_templates cache for the long-lived server, kept fresh by a change feed.
+
+Every run used to refetch all of the user's templates (planner._fetch_templates_df)
+even though they rarely change between two revises a minute apart. TemplateCache
+keeps each active user's templates in memory and is wrapped around the run's Store
+(outermost, so a hit skips the transport, rate limiter and network entirely):
+
+  - select("task_templates", ..., user_id = U AND is_deleted = false) with no
+    order/limit is served from the cache when the requested columns are a subset
+    of the cached ones; anything else passes through
+  - a change feed patches cached entries in place: inserts/updates replace the row
+    by id, soft deletes (is_deleted = true) and hard deletes remove it
+  - writes to task_templates made through the wrapped store drop the user's entry
+  - entries are evicted least-recently-used first, past DAYFLOW_TEMPLATE_CACHE_USERS
+    users or DAYFLOW_TEMPLATE_CACHE_MB of rows (shallow sizeof of each row and its values)
+
+Feeds (DAYFLOW_TEMPLATE_FEED):
+  poll      the default stand-in: every DAYFLOW_TEMPLATE_FEED_POLL_S, read rows with
+            updated_at > watermark (re-reading an overlap window, since updated_at is
+            the writer's transaction time rather than its commit time)
+  realtime  Supabase Realtime postgres_changes on public.task_templates; a reconnect
+            drops every entry, since events sent while disconnected are lost
+  off       no feed: entries are only trusted for DAYFLOW_TEMPLATE_CACHE_MAX_STALE_S
+Both feeds need supabase/template-change-feed.sql.
+
+Staleness of a hit is how long ago the entry was last known to be current: the
+later of its fetch and the feed's last confirmed sync. A run never plans from
+templates older than itself: the wrapper made for a run (wrap(), at run start)
+only serves an entry fetched, or confirmed by the feed, after that moment. A
+QuickAdd insert followed at once by a revise is therefore always seen. Cached
+entries from earlier runs hit when the realtime feed is subscribed; with the
+poll feed the first read of a run refetches, and the run's later template reads
+hit. A hit staler than
+DAYFLOW_TEMPLATE_CACHE_MAX_STALE_S (feed down, poll failing) is refetched instead,
+as is an entry older than DAYFLOW_TEMPLATE_CACHE_MAX_AGE_S (a backstop for hard
+deletes the poll feed cannot see). Hit rate and staleness are on /metrics.
+
+Config (env, all optional):
+  DAYFLOW_TEMPLATE_CACHE               0 to disable (default 1)
+  DAYFLOW_TEMPLATE_CACHE_USERS         max cached users (default 1000)
+  DAYFLOW_TEMPLATE_CACHE_MB            memory budget in MB (default 64)
+  DAYFLOW_TEMPLATE_CACHE_MAX_STALE_S   refetch rather than serve staler hits (default 60)
+  DAYFLOW_TEMPLATE_CACHE_MAX_AGE_S     refetch entries older than this (default 3600)
+  DAYFLOW_TEMPLATE_FEED                poll | realtime | off (default poll)
+  DAYFLOW_TEMPLATE_FEED_POLL_S         poll interval (default 5)
+  DAYFLOW_TEMPLATE_FEED_OVERLAP_S      overlap re-read by each poll (default 10)
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from dayflow.store import Store, DEFAULT_KEYSET, as_store
+
+TABLE = "task_templates"
+_FEED_COLUMNS = ("id", "user_id", "is_deleted", "updated_at")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_columns(columns: str) -> Optional[frozenset]:
+    """Column set of a select list; None for "*"."""
+    cols = [c.strip() for c in (columns or "*").split(",") if c.strip()]
+    if not cols or "*" in cols:
+        return None
+    return frozenset(cols)
+
+
+def _active_user(filters: Iterable) -> Optional[str]:
+    """U if `filters` is exactly user_id = U AND is_deleted = false (in any order)."""
+    filters = list(filters or ())
+    if len(filters) != 2:
+        return None
+    by_col = {col: (op, val) for op, col, val in filters if isinstance(col, str)}
+    user = by_col.get("user_id")
+    if user is None or user[0] != "eq" or by_col.get("is_deleted") != ("eq", False):
+        return None
+    return str(user[1])
+
+
+def _filter_user(filters: Iterable) -> Optional[str]:
+    for op, col, val in filters or ():
+        if op == "eq" and col == "user_id":
+            return str(val)
+    return None
+
+
+def _row_bytes(row: Dict) -> int:
+    return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+class _Entry:
+    __slots__ = ("rows", "columns", "fetched_at", "nbytes")
+
+    def __init__(self, rows: List[Dict], columns: Optional[frozenset], fetched_at: float):
+        self.columns = columns
+        self.fetched_at = fetched_at
+        self.rows: Dict[str, Dict] = {}
+        self.nbytes = 0
+        for r in rows:
+            self.put(r)
+
+    def project(self, row: Dict) -> Dict:
+        if self.columns is None:
+            return dict(row)
+        return {k: v for k, v in row.items() if k in self.columns}
+
+    def put(self, row: Dict) -> None:
+        key = str(row.get("id"))
+        old = self.rows.get(key)
+        if old is not None:
+            self.nbytes -= _row_bytes(old)
+            row = dict(old, **self.project(row))
+        else:
+            row = self.project(row)
+        self.rows[key] = row
+        self.nbytes += _row_bytes(row)
+
+    def remove(self, template_id: Any) -> bool:
+        old = self.rows.pop(str(template_id), None)
+        if old is None:
+            return False
+        self.nbytes -= _row_bytes(old)
+        return True
+
+
+class TemplateCache:
+    """LRU of user_id -> active templates, patched by a feed (see module docstring)."""
+
+    def __init__(
+        self,
+        feed: Optional["PollingFeed"] = None,
+        *,
+        max_users: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_stale: Optional[float] = None,
+        max_age: Optional[float] = None,
+    ):
+        self.feed = feed
+        self.max_users = max_users or _env_int("DAYFLOW_TEMPLATE_CACHE_USERS", 1000)
+        self.max_bytes = max_bytes or int(_env_float("DAYFLOW_TEMPLATE_CACHE_MB", 64) * 1024 * 1024)
+        self.max_stale = max_stale or _env_float("DAYFLOW_TEMPLATE_CACHE_MAX_STALE_S", 60.0)
+        self.max_age = max_age or _env_float("DAYFLOW_TEMPLATE_CACHE_MAX_AGE_S", 3600.0)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        # user_id -> [in-flight fills, changes seen meanwhile]; replayed onto the fetched rows
+        self._filling: Dict[str, list] = {}
+        self._stats = {
+            "hits": 0, "misses": 0, "stale_refetches": 0, "expired_refetches": 0, "behind_refetches": 0,
+            "passthrough": 0,
+            "evicted_lru": 0, "evicted_budget": 0, "invalidations": 0, "patches": 0,
+        }
+        self._staleness = deque(maxlen=500)
+        self._feed_started = False
+
+    # --- store integration ---
+    def wrap(self, store: Optional[Store]) -> Optional[Store]:
+        """Serve this store's active-template reads from the cache, no older than now (one run)."""
+        if store is None or isinstance(store, TemplateCachedStore):
+            return store
+        self.start_feed()
+        return TemplateCachedStore(store, self, not_before=time.time())
+
+    def start_feed(self) -> None:
+        with self._lock:
+            if self._feed_started or self.feed is None:
+                return
+            self._feed_started = True
+        try:
+            self.feed.start(self)
+        except Exception as e:
+            logging.warning("template cache: %s feed failed to start (%s); entries expire after %.0fs",
+                            self.feed.kind, e, self.max_stale)
+
+    def _fresh_as_of(self, entry: _Entry) -> float:
+        synced = self.feed.synced_at() if self.feed is not None else None
+        return max(entry.fetched_at, synced or 0.0)
+
+    def get(self, inner: Store, user_id: str, columns: str, not_before: float = 0.0) -> List[Dict]:
+        """
+        The user's active templates with `columns`: from the cache, else fetched and cached.
+        A hit must have been current at or after `not_before` (epoch seconds).
+        """
+        wanted = _parse_columns(columns)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and (entry.columns is None or (wanted is not None and wanted <= entry.columns)):
+                fresh_as_of = self._fresh_as_of(entry)
+                staleness = now - fresh_as_of
+                if now - entry.fetched_at > self.max_age:
+                    self._stats["expired_refetches"] += 1
+                elif fresh_as_of < not_before:
+                    self._stats["behind_refetches"] += 1
+                elif staleness > self.max_stale:
+                    self._stats["stale_refetches"] += 1
+                else:
+                    self._entries.move_to_end(user_id)
+                    self._stats["hits"] += 1
+                    self._staleness.append(staleness)
+                    if wanted is None:
+                        return [dict(r) for r in entry.rows.values()]
+                    return [{k: v for k, v in r.items() if k in wanted} for r in entry.rows.values()]
+            self._stats["misses"] += 1
+            # Different stages read different columns: fetch what every reader so far wanted
+            # (and id, the row key) so they stop refetching over each other
+            fetch = None
+            if wanted is not None:
+                fetch = wanted | {"id"} | (entry.columns if entry is not None and entry.columns is not None else set())
+            pending = self._filling.setdefault(user_id, [0, []])
+            pending[0] += 1
+        select = columns if fetch is None else ", ".join(
+            [c.strip() for c in columns.split(",") if c.strip()] + sorted(fetch - wanted)
+        )
+        try:
+            rows = inner.select(TABLE, select, filters=[("eq", "user_id", user_id), ("eq", "is_deleted", False)])
+        except BaseException:
+            self._end_fill(user_id, None)
+            raise
+        self._end_fill(user_id, _Entry(rows, fetch, now))
+        if fetch is not None and fetch != wanted:
+            return [{k: v for k, v in r.items() if k in wanted} for r in rows]
+        return rows
+
+    def _end_fill(self, user_id: str, entry: Optional[_Entry]) -> None:
+        with self._lock:
+            pending = self._filling.get(user_id)
+            changes = pending[1] if pending else []
+            if pending:
+                pending[0] -= 1
+                if pending[0] <= 0:
+                    del self._filling[user_id]
+            if entry is None:
+                return
+            for change in changes:
+                if change is None:  # invalidated while the fetch was in flight
+                    return
+                self._patch(entry, *change)
+            self._store(user_id, entry)
+
+    def _store(self, user_id: str, entry: _Entry) -> None:
+        old = self._entries.pop(user_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._entries[user_id] = entry
+        self._bytes += entry.nbytes
+        while self._entries and len(self._entries) > self.max_users:
+            self._evict("evicted_lru")
+        while self._entries and self._bytes > self.max_bytes:
+            self._evict("evicted_budget")
+
+    def _evict(self, reason: str) -> None:
+        _, entry = self._entries.popitem(last=False)
+        self._bytes -= entry.nbytes
+        self._stats[reason] += 1
+
+    # --- feed side ---
+    def users(self) -> List[str]:
+        with self._lock:
+            return list(self._entries) + [u for u in self._filling if u not in self._entries]
+
+    def columns(self) -> Optional[frozenset]:
+        """Union of the cached column sets (None if any entry holds every column)."""
+        with self._lock:
+            out = set(_FEED_COLUMNS)
+            for entry in self._entries.values():
+                if entry.columns is None:
+                    return None
+                out |= entry.columns
+            return frozenset(out)
+
+    def apply(self, row: Dict, *, deleted: bool = False) -> None:
+        """Apply one changed task_templates row (or, with deleted=True, a removal)."""
+        user_id = row.get("user_id")
+        gone = deleted or row.get("is_deleted") is True
+        with self._lock:
+            if user_id is None:
+                # hard delete without the old row's user_id (no REPLICA IDENTITY FULL)
+                for entry in self._entries.values():
+                    before = entry.nbytes
+                    if entry.remove(row.get("id")):
+                        self._bytes -= before - entry.nbytes
+                        self._stats["patches"] += 1
+                for pending in self._filling.values():
+                    pending[1].append((row, gone))
+                return
+            user_id = str(user_id)
+            pending = self._filling.get(user_id)
+            if pending is not None:
+                pending[1].append((row, gone))
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+                self._patch(entry, row, gone)
+                self._bytes += entry.nbytes
+                self._stats["patches"] += 1
+        if entry is not None:
+            self._trim()
+
+    @staticmethod
+    def _patch(entry: _Entry, row: Dict, gone: bool) -> None:
+        if gone:
+            entry.remove(row.get("id"))
+        else:
+            entry.put(row)
+
+    def _trim(self) -> None:
+        with self._lock:
+            while self._entries and self._bytes > self.max_bytes:
+                self._evict("evicted_budget")
+
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        """Drop one user's entry (or every entry), including fetches still in flight."""
+        with self._lock:
+            users = [str(user_id)] if user_id is not None else list(self._entries) + list(self._filling)
+            for uid in users:
+                entry = self._entries.pop(uid, None)
+                if entry is not None:
+                    self._bytes -= entry.nbytes
+                    self._stats["invalidations"] += 1
+                if uid in self._filling:
+                    self._filling[uid][1].append(None)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            lookups = s["hits"] + s["misses"]
+            recent = sorted(self._staleness)
+            s.update(
+                entries=len(self._entries),
+                bytes=self._bytes,
+                budget_bytes=self.max_bytes,
+                hit_rate=round(s["hits"] / lookups, 4) if lookups else None,
+                staleness_s={
+                    "last": round(self._staleness[-1], 3) if self._staleness else None,
+                    "p95": round(recent[int(0.95 * (len(recent) - 1))], 3) if recent else None,
+                    "max": round(recent[-1], 3) if recent else None,
+                },
+            )
+        s["feed"] = self.feed.metrics() if self.feed is not None else None
+        return s
+
+
+class TemplateCachedStore(Store):
+    """Store wrapper that answers active-template reads from a TemplateCache."""
+
+    def __init__(self, inner: Store, cache: TemplateCache, not_before: float = 0.0):
+        self.inner = inner
+        self.cache = cache
+        self.backend = inner.backend
+        self.not_before = not_before
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        user_id = _active_user(filters) if table == TABLE and not order and limit is None else None
+        if user_id is None:
+            if table == TABLE:
+                with self.cache._lock:
+                    self.cache._stats["passthrough"] += 1
+            return self.inner.select(table, columns, filters=filters, order=order, limit=limit)
+        return self.cache.get(self.inner, user_id, columns, self.not_before)
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        return self.inner.select_page(table, columns, filters=filters, order=order, limit=limit, count=count)
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable = (),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key: Sequence[str] = DEFAULT_KEYSET,
+    ):
+        return self.inner.stream(table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        return self.inner.latest_per_template(template_ids, since=since, until=until)
+
+    def table_columns(self, table):
+        return self.inner.table_columns(table)
+
+    def replication_lag(self):
+        return self.inner.replication_lag()
+
+    def _written(self, table: str, users: Iterable[Optional[str]]) -> None:
+        if table != TABLE:
+            return
+        users = set(users)
+        if not users or None in users:
+            self.cache.invalidate()
+        else:
+            for u in users:
+                self.cache.invalidate(u)
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        try:
+            return self.inner.upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+        finally:
+            self._written(table, (r.get("user_id") for r in rows or ()))
+
+    def update(self, table, values, *, filters):
+        try:
+            return self.inner.update(table, values, filters=filters)
+        finally:
+            self._written(table, [_filter_user(filters)])
+
+    def delete(self, table, *, filters):
+        try:
+            return self.inner.delete(table, filters=filters)
+        finally:
+            self._written(table, [_filter_user(filters)])
+
+    def close(self) -> None:
+        self.inner.close()
+
+    @property
+    def unrecovered_errors(self) -> int:
+        return getattr(self.inner, "unrecovered_errors", 0)
+
+
+# ---------------------------------------------------------------------------
+# Feeds
+# ---------------------------------------------------------------------------
+class PollingFeed:
+    """Polls task_templates for rows with updated_at past the watermark."""
+
+    kind = "poll"
+
+    def __init__(self, source: Callable[[], Any], *, interval: Optional[float] = None,
+                 overlap: Optional[float] = None, page_size: int = 500):
+        self.source = source
+        self.interval = interval or _env_float("DAYFLOW_TEMPLATE_FEED_POLL_S", 5.0)
+        self.overlap = timedelta(seconds=overlap if overlap is not None else _env_float("DAYFLOW_TEMPLATE_FEED_OVERLAP_S", 10.0))
+        self.page_size = page_size
+        self.cache: Optional[TemplateCache] = None
+        self._watermark: Optional[datetime] = None
+        self._synced_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"polls": 0, "errors": 0, "changes": 0, "last_poll_ms": None, "last_error": None}
+
+    def start(self, cache: TemplateCache) -> None:
+        self.cache = cache
+        self._watermark = datetime.now(timezone.utc)
+        self._synced_at = time.time()
+        self._thread = threading.Thread(target=self._loop, name="dayflow-template-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def synced_at(self) -> Optional[float]:
+        return self._synced_at
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self._stats["errors"] += 1
+                self._stats["last_error"] = str(e)[:200]
+                logging.warning("template cache: poll failed: %s", e)
+
+    def poll(self) -> int:
+        """One pass: apply every change since the watermark. Returns the number of rows applied."""
+        started = time.time()
+        t0 = time.perf_counter()
+        if not self.cache.users():
+            # nothing cached: nothing to patch, and no backlog to re-read once something is
+            self._watermark = max(self._watermark, datetime.now(timezone.utc) - self.overlap)
+            self._synced_at = started
+            return 0
+        store = as_store(self.source())
+        cols = self.cache.columns()
+        columns = "*" if cols is None else ", ".join(sorted(cols))
+        since = self._watermark - self.overlap
+        seen = set()
+        applied = 0
+        while True:
+            rows = store.select(
+                TABLE, columns,
+                filters=[("gte", "updated_at", since.isoformat())],
+                order=[("updated_at", False), ("id", False)],
+                limit=self.page_size,
+            )
+            fresh = [r for r in rows if (r.get("id"), r.get("updated_at")) not in seen]
+            for r in fresh:
+                seen.add((r.get("id"), r.get("updated_at")))
+                self.cache.apply(r)
+                ts = _parse_ts(r.get("updated_at"))
+                if ts is not None and ts > self._watermark:
+                    self._watermark = ts
+            applied += len(fresh)
+            if len(rows) < self.page_size or not fresh:
+                break
+            since = _parse_ts(rows[-1].get("updated_at")) or since
+        self._synced_at = started
+        self._stats["polls"] += 1
+        self._stats["changes"] += applied
+        self._stats["last_poll_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return applied
+
+    def metrics(self) -> Dict[str, Any]:
+        return dict(
+            self._stats,
+            kind=self.kind,
+            watermark=self._watermark.isoformat() if self._watermark else None,
+            synced_ago_s=round(time.time() - self._synced_at, 3) if self._synced_at else None,
+        )
+
+
+class RealtimeFeed:
+    """Supabase Realtime postgres_changes on task_templates, on its own event-loop thread."""
+
+    kind = "realtime"
+
+    def __init__(self, url: Optional[str] = None, key: Optional[str] = None):
+        self.url = url or os.getenv("SUPABASE_URL")
+        self.key = key or os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
+        self.cache: Optional[TemplateCache] = None
+        self._subscribed = False
+        self._ever_subscribed = False
+        self._down_at: Optional[float] = None
+        self._stats = {"changes": 0, "reconnects": 0, "errors": 0, "last_lag_s": None, "last_error": None}
+
+    def start(self, cache: TemplateCache) -> None:
+        if not self.url or not self.key:
+            raise RuntimeError("SUPABASE_URL / service key not set")
+        from realtime import AsyncRealtimeClient  # noqa: F401  (fail here, not in the thread)
+        self.cache = cache
+        self._down_at = time.time()
+        threading.Thread(target=lambda: asyncio.run(self._run()), name="dayflow-template-feed", daemon=True).start()
+
+    async def _run(self) -> None:
+        from realtime import AsyncRealtimeClient
+        ws_url = self.url.rstrip("/").replace("http", "ws", 1) + "/realtime/v1"
+        client = AsyncRealtimeClient(ws_url, self.key, params={"apikey": self.key})
+        try:
+            await client.connect()
+            channel = client.channel("dayflow-task-templates")
+            channel.on_postgres_changes("*", callback=self._on_change, table=TABLE, schema="public")
+            await channel.subscribe(self._on_status)
+            while True:
+                await asyncio.sleep(3600)
+        except Exception as e:
+            self._stats["errors"] += 1
+            self._stats["last_error"] = str(e)[:200]
+            self._set_down()
+            logging.warning("template cache: realtime feed stopped: %s", e)
+
+    def _set_down(self) -> None:
+        if self._subscribed:
+            self._down_at = time.time()
+        self._subscribed = False
+
+    def _on_status(self, status: Any, err: Optional[Exception] = None) -> None:
+        status = getattr(status, "value", status)
+        if status == "SUBSCRIBED":
+            if self._ever_subscribed:
+                # events sent while we were away are gone: start over
+                self._stats["reconnects"] += 1
+                self.cache.invalidate()
+            self._ever_subscribed = True
+            self._subscribed = True
+        else:
+            if err is not None:
+                self._stats["errors"] += 1
+                self._stats["last_error"] = str(err)[:200]
+            self._set_down()
+
+    def _on_change(self, payload: Dict) -> None:
+        data = payload.get("data", payload)
+        kind = str(getattr(data.get("type"), "value", data.get("type")))
+        if kind == "DELETE":
+            self.cache.apply(data.get("old_record") or {}, deleted=True)
+        else:
+            self.cache.apply(data.get("record") or {})
+        self._stats["changes"] += 1
+        ts = _parse_ts(data.get("commit_timestamp"))
+        if ts is not None:
+            self._stats["last_lag_s"] = round((datetime.now(timezone.utc) - ts).total_seconds(), 3)
+
+    def synced_at(self) -> Optional[float]:
+        return time.time() if self._subscribed else self._down_at
+
+    def metrics(self) -> Dict[str, Any]:
+        return dict(self._stats, kind=self.kind, subscribed=self._subscribed)
+
+
+def build(source: Callable[[], Any]) -> Optional[TemplateCache]:
+    """
+    The server's cache from env, or None if DAYFLOW_TEMPLATE_CACHE=0. `source`
+    returns a client/Store for the poll feed (e.g. the server's ClientPool.get).
+    """
+    if str(os.getenv("DAYFLOW_TEMPLATE_CACHE", "1")).lower() in ("0", "false", "no", "off"):
+        return None
+    kind = str(os.getenv("DAYFLOW_TEMPLATE_FEED", "poll")).lower()
+    if kind == "realtime":
+        feed = RealtimeFeed()
+    elif kind in ("off", "none", "0"):
+        feed = None
+    else:
+        feed = PollingFeed(source)
+    return TemplateCache(feed)
@@ -0,0 +1,526 @@
+# dayflow/transport.py
+"""
+Resilient transport around a dayflow Store.
+
+Supabase calls had no deadline: one slow PostgREST response could hang a revise
+until the Next.js route's 60 s maxDuration killed it. ResilientStore wraps any
+Store and adds, per call:
+
+  - a deadline (separate read / write timeouts, capped by an optional whole-run
+    budget), raising DeadlineExceeded instead of hanging
+  - jittered exponential-backoff retries for reads (idempotent) on transient
+    errors only - timeouts, connection errors, 408/429/5xx; a 4xx or a bad
+    column is raised straight away
+  - optional hedged reads: if a read is still running after that call's
+    observed p95, a duplicate is fired and the first success wins
+  - a circuit breaker per backend: after N consecutive transient failures calls
+    fail fast with CircuitOpenError for a cool-down, then one probe is let through
+  - a latency histogram per call (method:table), shared across runs, on /metrics
+  - a rate-limit token (dayflow.ratelimit) per attempt, so retries count against
+    the budget; a hedge is only fired if a read token is free right away
+
+A read that misses its deadline is abandoned, but its thread keeps running until
+the backend answers (or the client's own timeout fires). Abandoned calls are
+tracked per backend: once DAYFLOW_TRANSPORT_MAX_ABANDONED of them are still
+running, new calls to that backend fail fast with PoolSaturated instead of
+queueing behind dead work, so a hung backend can't take every thread of the
+shared pool from other runs.
+
+Writes get the breaker but are never retried or hedged here. A write that
+overruns its deadline is not abandoned: a pool thread can't be cancelled, so the
+write could still commit after the run had reported it failed. Instead the call
+waits for the write's own outcome (bounded by the client's timeout,
+DAYFLOW_HTTP_TIMEOUT_S) and counts it in `slow_writes`.
+Failures are never swallowed: once retries are exhausted the error is raised,
+and `unrecovered_errors` lets the runner refuse to write a schedule built from
+partial reads. A store may outlive one run (a batch worker runs many users on
+it): run_for_user calls start_run(store) first, which resets the error count
+and starts the run deadline afresh.
+
+Config (env, all optional):
+  DAYFLOW_TRANSPORT            0 to disable the wrapper (default 1)
+  DAYFLOW_READ_TIMEOUT_S       per-read deadline (default 10)
+  DAYFLOW_WRITE_TIMEOUT_S      writes slower than this are logged as slow (default 30)
+  DAYFLOW_RUN_DEADLINE_S       budget for all calls of one run, 0 = none (default 0)
+  DAYFLOW_READ_RETRIES         extra attempts for reads (default 2)
+  DAYFLOW_RETRY_BASE_MS        first backoff step (default 100, capped at 2000)
+  DAYFLOW_HEDGE_READS          1 to enable hedged reads (default 0)
+  DAYFLOW_HEDGE_MIN_SAMPLES    samples needed before hedging a call (default 20)
+  DAYFLOW_BREAKER_THRESHOLD    consecutive transient failures to open (default 5)
+  DAYFLOW_BREAKER_COOLDOWN_S   seconds the breaker stays open (default 30)
+  DAYFLOW_TRANSPORT_THREADS    size of the shared I/O pool (default 32)
+  DAYFLOW_TRANSPORT_MAX_ABANDONED  timed-out calls still running before a backend
+                               fails fast (default: half the pool)
+"""
+import os
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from dayflow import ratelimit
+from dayflow.store import Store, DEFAULT_KEYSET, pages_via_select_page
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is "slower"
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_TRANSIENT_CLASSES = {
+    "TransportError", "TimeoutException", "NetworkError",  # httpx
+    "OperationalError", "InterfaceError", "PoolTimeout",   # psycopg / psycopg_pool
+}
+_TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    """A call (or the run's overall budget) ran out of time."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The backend's circuit breaker is open; the call was not attempted."""
+
+
+class PoolSaturated(DeadlineExceeded):
+    """Too many of the backend's timed-out calls are still running; the call was not attempted."""
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None or raw == "":
+        return default
+    return str(raw).lower() in ("1", "true", "yes", "on")
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Timeouts, dropped connections and 408/429/5xx are worth retrying; nothing else is."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    if {c.__name__ for c in type(exc).__mro__} & _TRANSIENT_CLASSES:
+        return True
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    code = getattr(exc, "code", None)
+    for v in (status, code):
+        try:
+            if int(v) in _TRANSIENT_STATUS:
+                return True
+        except (TypeError, ValueError):
+            pass
+    return False
+
+
+def transport_enabled() -> bool:
+    return _env_flag("DAYFLOW_TRANSPORT", True)
+
+
+class LatencyHistogram:
+    """Bucketed latency per call name, plus a recent window for percentile estimates."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._window = window
+        self._ops: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, op: str, seconds: float, ok: bool = True) -> None:
+        ms = seconds * 1000
+        with self._lock:
+            s = self._ops.get(op)
+            if s is None:
+                s = self._ops[op] = {
+                    "count": 0, "errors": 0, "sum_ms": 0.0,
+                    "buckets": [0] * (len(BUCKETS_MS) + 1), "recent": deque(maxlen=self._window),
+                }
+            s["count"] += 1
+            s["errors"] += 0 if ok else 1
+            s["sum_ms"] += ms
+            s["buckets"][bisect_left(BUCKETS_MS, ms)] += 1
+            if ok:
+                s["recent"].append(ms)
+
+    def percentile(self, op: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """q-th percentile (0..1) of recent successful calls, in seconds; None if too few."""
+        with self._lock:
+            s = self._ops.get(op)
+            if not s or len(s["recent"]) < max(1, min_samples):
+                return None
+            lat = sorted(s["recent"])
+        return lat[min(len(lat) - 1, int(q * len(lat)))] / 1000
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{b}ms" for b in BUCKETS_MS] + ["slower"]
+        with self._lock:
+            out = {}
+            for op, s in self._ops.items():
+                lat = sorted(s["recent"])
+                pick = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))], 1) if lat else None
+                out[op] = {
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "mean_ms": round(s["sum_ms"] / s["count"], 1) if s["count"] else None,
+                    "p50_ms": pick(0.50),
+                    "p95_ms": pick(0.95),
+                    "p99_ms": pick(0.99),
+                    "buckets": dict(zip(labels, s["buckets"])),
+                }
+            return out
+
+
+class CircuitBreaker:
+    """Closed → open after `threshold` consecutive transient failures → half-open after `cooldown`."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.trips = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True   # half-open: exactly one probe call
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                if self._opened_at is None or self._probing:
+                    self.trips += 1
+                    logging.warning("transport: circuit breaker OPEN after %d failure(s)", self._failures)
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self) -> None:
+        """A half-open probe ended without a verdict (non-transient error): let the next one try."""
+        with self._lock:
+            self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return "open"
+            return "half_open"
+
+
+class _BackendState:
+    """Histogram, breaker and counters shared by every ResilientStore on one backend."""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.breaker = CircuitBreaker(
+            int(_env_float("DAYFLOW_BREAKER_THRESHOLD", 5)),
+            _env_float("DAYFLOW_BREAKER_COOLDOWN_S", 30.0),
+        )
+        self.lock = threading.Lock()
+        self.counters = {"retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0, "rejected_open": 0,
+                         "slow_writes": 0, "hedges_throttled": 0, "abandoned": 0, "rejected_saturated": 0}
+        self.abandoned_running = 0
+
+    def bump(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += n
+
+    def abandon(self, futures: Iterable) -> None:
+        """Count `futures` as abandoned until each one finishes."""
+        for f in futures:
+            with self.lock:
+                self.abandoned_running += 1
+                self.counters["abandoned"] += 1
+            f.add_done_callback(self._finished)
+
+    def _finished(self, _future) -> None:
+        with self.lock:
+            self.abandoned_running -= 1
+
+    def saturated(self) -> bool:
+        limit = _env_float("DAYFLOW_TRANSPORT_MAX_ABANDONED", 0) or _pool_size() // 2
+        with self.lock:
+            return self.abandoned_running >= max(1, limit)
+
+
+_states: Dict[str, _BackendState] = {}
+_states_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _state_for(backend: str) -> _BackendState:
+    with _states_lock:
+        st = _states.get(backend)
+        if st is None:
+            st = _states[backend] = _BackendState()
+        return st
+
+
+def _pool_size() -> int:
+    return max(1, int(_env_float("DAYFLOW_TRANSPORT_THREADS", 32)))
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _states_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_pool_size(), thread_name_prefix="dayflow-io")
+        return _executor
+
+
+class ResilientStore(Store):
+    """Store wrapper adding deadlines, read retries, hedged reads and a circuit breaker."""
+
+    def __init__(
+        self,
+        inner: Store,
+        *,
+        read_timeout: Optional[float] = None,
+        write_timeout: Optional[float] = None,
+        run_deadline: Optional[float] = None,
+        read_retries: Optional[int] = None,
+        hedge_reads: Optional[bool] = None,
+    ):
+        self.inner = inner
+        self.backend = inner.backend
+        self.read_timeout = read_timeout or _env_float("DAYFLOW_READ_TIMEOUT_S", 10.0)
+        self.write_timeout = write_timeout or _env_float("DAYFLOW_WRITE_TIMEOUT_S", 30.0)
+        self._budget = _env_float("DAYFLOW_RUN_DEADLINE_S", 0.0) if run_deadline is None else run_deadline
+        self._run_deadline: Optional[float] = None
+        self.read_retries = int(_env_float("DAYFLOW_READ_RETRIES", 2)) if read_retries is None else read_retries
+        self.hedge_reads = _env_flag("DAYFLOW_HEDGE_READS", False) if hedge_reads is None else hedge_reads
+        self.hedge_min_samples = int(_env_float("DAYFLOW_HEDGE_MIN_SAMPLES", 20))
+        self.retry_base = _env_float("DAYFLOW_RETRY_BASE_MS", 100.0) / 1000
+        self.retry_cap = 2.0
+        self.state = _state_for(self.backend)
+        self._lock = threading.Lock()
+        self.unrecovered_errors = 0
+        self.start_run()
+
+    def start_run(self) -> None:
+        """Begin a new run on this store: a fresh run deadline and no unrecovered errors."""
+        with self._lock:
+            self.unrecovered_errors = 0
+            budget = self._budget
+            self._run_deadline = time.monotonic() + budget if budget and budget > 0 else None
+
+    # -----------------------
+    # Core call path
+    # -----------------------
+    def _remaining(self, timeout: float) -> float:
+        if self._run_deadline is None:
+            return timeout
+        return min(timeout, self._run_deadline - time.monotonic())
+
+    def _attempt(self, op: str, fn: Callable[[], Any], timeout: float, hedge: bool, settle: bool = False) -> Any:
+        if self.state.saturated():
+            self.state.bump("rejected_saturated")
+            raise PoolSaturated(f"{op}: too many timed-out calls to {self.backend!r} still running")
+        start = time.monotonic()
+        end = start + timeout
+        primary = _pool().submit(fn)
+        pending = {primary}
+        hedge_at = None
+        if hedge:
+            p95 = self.state.histogram.percentile(op, 0.95, self.hedge_min_samples)
+            if p95 is not None and p95 < timeout:
+                hedge_at = start + p95
+        last_exc: Optional[BaseException] = None
+        while pending:
+            now = time.monotonic()
+            if now >= end:
+                break
+            until = end if hedge_at is None else min(end, hedge_at)
+            done, pending = wait(pending, timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+            for f in done:
+                exc = f.exception()
+                if exc is None:
+                    self.state.histogram.record(op, time.monotonic() - start)
+                    if f is not primary:
+                        self.state.bump("hedge_wins")
+                    return f.result()
+                last_exc = exc
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None   # hedge at most once
+                if pending and not self.state.saturated() and ratelimit.try_take("reads"):
+                    self.state.bump("hedges")
+                    pending.add(_pool().submit(fn))
+                elif pending:
+                    self.state.bump("hedges_throttled")
+        if settle and pending:
+            # A write past its deadline keeps running; wait for it rather than report a
+            # failure it may still turn into a commit
+            self.state.bump("slow_writes")
+            logging.warning("transport: %s still running after %.1fs; waiting for its outcome", op, timeout)
+            f = next(iter(wait(pending).done))
+            ok = f.exception() is None
+            self.state.histogram.record(op, time.monotonic() - start, ok=ok)
+            return f.result()
+        self.state.histogram.record(op, time.monotonic() - start, ok=False)
+        if last_exc is not None and not pending:
+            raise last_exc
+        self.state.abandon(pending)
+        self.state.bump("deadline_exceeded")
+        raise DeadlineExceeded(f"{op}: no response within {timeout:.1f}s")
+
+    def _call(self, op: str, fn: Callable[[], Any], *, read: bool) -> Any:
+        breaker = self.state.breaker
+        attempts = 1 + (max(0, self.read_retries) if read else 0)
+        base_timeout = self.read_timeout if read else self.write_timeout
+        for attempt in range(attempts):
+            if not breaker.allow():
+                self.state.bump("rejected_open")
+                self._unrecovered()
+                raise CircuitOpenError(f"{op}: circuit open for backend {self.backend!r}")
+            # Waiting for a token uses up the run budget, not this attempt's deadline
+            ratelimit.take("reads" if read else "writes")
+            timeout = self._remaining(base_timeout)
+            if timeout <= 0:
+                breaker.release()
+                self.state.bump("deadline_exceeded")
+                self._unrecovered()
+                raise DeadlineExceeded(f"{op}: run deadline exhausted")
+            try:
+                result = self._attempt(op, fn, timeout, hedge=read and self.hedge_reads, settle=not read)
+            except Exception as e:
+                if not is_transient(e):
+                    breaker.release()
+                    raise
+                breaker.failure()
+                if attempt + 1 >= attempts:
+                    self._unrecovered()
+                    raise
+                delay = random.uniform(0, min(self.retry_cap, self.retry_base * (2 ** attempt)))
+                if self._remaining(delay + 0.001) < delay:
+                    self._unrecovered()
+                    raise
+                self.state.bump("retries")
+                logging.warning("transport: %s failed (%s); retry %d/%d in %.0f ms",
+                                op, e, attempt + 1, attempts - 1, delay * 1000)
+                time.sleep(delay)
+                continue
+            breaker.success()
+            return result
+
+    def _unrecovered(self) -> None:
+        with self._lock:
+            self.unrecovered_errors += 1
+
+    # -----------------------
+    # Store API
+    # -----------------------
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        filters = list(filters or ())
+        return self._call(
+            f"select:{table}",
+            lambda: self.inner.select(table, columns, filters=filters, order=order, limit=limit),
+            read=True,
+        )
+
+    def select_page(self, table, columns="*", *, filters=(), order=None, limit=None, count=False):
+        filters = list(filters or ())
+        return self._call(
+            f"select_page:{table}",
+            lambda: self.inner.select_page(table, columns, filters=filters, order=order, limit=limit, count=count),
+            read=True,
+        )
+
+    def stream(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        filters: Iterable = (),
+        desc: bool = False,
+        page_size: Optional[int] = None,
+        key: Sequence[str] = DEFAULT_KEYSET,
+    ) -> Iterator[Dict]:
+        if pages_via_select_page(self.inner):
+            # Keyset pages go through select_page(), so each page gets deadline + retries
+            return Store.stream(self, table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+        # Backend-native streaming (server-side cursor): can't retry mid-cursor; one token
+        ratelimit.take("reads")
+        return self.inner.stream(table, columns, filters=filters, desc=desc, page_size=page_size, key=key)
+
+    def latest_per_template(self, template_ids, *, since=None, until=None):
+        ids = list(template_ids or ())
+        return self._call(
+            "latest_per_template",
+            lambda: self.inner.latest_per_template(ids, since=since, until=until),
+            read=True,
+        )
+
+    def table_columns(self, table):
+        return self._call(f"table_columns:{table}", lambda: self.inner.table_columns(table), read=True)
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        return self._call(
+            f"upsert:{table}",
+            lambda: self.inner.upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates),
+            read=False,
+        )
+
+    def update(self, table, values, *, filters):
+        filters = list(filters or ())
+        return self._call(f"update:{table}", lambda: self.inner.update(table, values, filters=filters), read=False)
+
+    def delete(self, table, *, filters):
+        filters = list(filters or ())
+        return self._call(f"delete:{table}", lambda: self.inner.delete(table, filters=filters), read=False)
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+def wrap(store: Optional[Store]) -> Optional[Store]:
+    """Wrap `store` in a ResilientStore unless disabled (DAYFLOW_TRANSPORT=0) or already wrapped."""
+    if store is None or isinstance(store, ResilientStore) or not transport_enabled():
+        return store
+    return ResilientStore(store)
+
+
+def start_run(store: Optional[Store]) -> None:
+    """Reset the ResilientStore under `store`'s wrappers (if any) for a new run."""
+    while store is not None:
+        if isinstance(store, ResilientStore):
+            store.start_run()
+            return
+        store = getattr(store, "inner", None)
+
+
+def metrics() -> Dict[str, Any]:
+    """Per-backend breaker state, retry/hedge/deadline counters and latency histograms."""
+    with _states_lock:
+        states = dict(_states)
+    out = {}
+    for backend, st in states.items():
+        with st.lock:
+            counters = dict(st.counters, abandoned_running=st.abandoned_running)
+        out[backend] = {
+            "breaker": st.breaker.state,
+            "breaker_trips": st.breaker.trips,
+            **counters,
+            "calls": st.histogram.snapshot(),
+        }
+    return out
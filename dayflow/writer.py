@@ -0,0 +1,207 @@
+# dayflow/writer.py
+"""
+Chunked, parallel upserts on top of a dayflow Store.
+
+Store.upsert() sends every row in one request: fine for a single user's day,
+but a backfill or nightly batch can exceed PostgREST's request-size limit and
+serializes the whole write into one slow call. ChunkedWriter splits the rows
+into size-bounded chunks and sends them concurrently with a bounded number of
+workers.
+
+Semantics are the same as one Store.upsert() with the same on_conflict target:
+  - rows sharing a conflict key are never split across chunks (so two chunks
+    can't race on the same row, and in-request duplicates behave as before)
+  - each chunk is one upsert, so a chunk is all-or-nothing; if any chunk fails
+    the others still finish and ChunkedWriteError reports what was written
+
+Config (env, all optional):
+  DAYFLOW_UPSERT_CHUNK_ROWS    max rows per request (default 500)
+  DAYFLOW_UPSERT_CHUNK_BYTES   max JSON bytes per request (default 1_000_000)
+  DAYFLOW_UPSERT_WORKERS       concurrent requests per upsert (default 4)
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_CONFLICT = "user_id,local_date,template_id"
+
+
+class ChunkedWriteError(RuntimeError):
+    """One or more chunks failed; `written` rows from the other chunks were committed."""
+
+    def __init__(self, message: str, *, written: List[Dict], errors: List[BaseException]):
+        super().__init__(message)
+        self.written = written
+        self.errors = errors
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _row_bytes(row: Dict) -> int:
+    return len(json.dumps(row, default=str, separators=(",", ":"))) + 1
+
+
+def chunk_rows(
+    rows: Sequence[Dict],
+    *,
+    on_conflict: str = DEFAULT_CONFLICT,
+    max_rows: int = 500,
+    max_bytes: int = 1_000_000,
+) -> List[List[Dict]]:
+    """
+    Split rows into chunks of at most max_rows / max_bytes (a single oversized
+    conflict group still gets its own chunk). Rows that share a conflict key stay
+    together and keep their relative order.
+    """
+    keys = [k.strip() for k in on_conflict.split(",") if k.strip()]
+    groups: Dict[Any, List[Dict]] = {}
+    for i, r in enumerate(rows):
+        key = tuple(str(r.get(k)) for k in keys) if keys else i
+        if keys and any(r.get(k) in (None, "", "None") for k in keys):
+            key = ("__row__", i)  # NULL keys never conflict; treat as unique
+        groups.setdefault(key, []).append(r)
+
+    chunks: List[List[Dict]] = []
+    cur: List[Dict] = []
+    cur_bytes = 0
+    for group in groups.values():
+        g_bytes = sum(_row_bytes(r) for r in group)
+        if cur and (len(cur) + len(group) > max_rows or cur_bytes + g_bytes > max_bytes):
+            chunks.append(cur)
+            cur, cur_bytes = [], 0
+        cur.extend(group)
+        cur_bytes += g_bytes
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+class ChunkedWriter:
+    """Size-bounded, concurrent upserts with per-chunk latency stats."""
+
+    def __init__(
+        self,
+        *,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        workers: Optional[int] = None,
+    ):
+        self.max_rows = max(1, max_rows or _env_int("DAYFLOW_UPSERT_CHUNK_ROWS", 500))
+        self.max_bytes = max(1024, max_bytes or _env_int("DAYFLOW_UPSERT_CHUNK_BYTES", 1_000_000))
+        self.workers = max(1, workers or _env_int("DAYFLOW_UPSERT_WORKERS", 4))
+        self._lock = threading.Lock()
+        self._chunks = 0
+        self._rows = 0
+        self._failed = 0
+        self._latencies: List[float] = []   # recent per-chunk seconds (bounded)
+
+    def _send(self, store: Any, table: str, chunk: List[Dict], on_conflict: str, ignore_duplicates: bool, idx: int, total: int):
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            out = store.upsert(table, chunk, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+            ok = True
+            return out
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self._chunks += 1
+                self._rows += len(chunk) if ok else 0
+                self._failed += 0 if ok else 1
+                self._latencies.append(elapsed)
+                del self._latencies[:-1000]
+            logging.info(
+                "upsert %s chunk %d/%d: %d row(s) in %.0f ms%s",
+                table, idx + 1, total, len(chunk), elapsed * 1000, "" if ok else " (FAILED)",
+            )
+
+    def upsert(
+        self,
+        store: Any,
+        table: str,
+        rows: Sequence[Dict],
+        *,
+        on_conflict: str = DEFAULT_CONFLICT,
+        ignore_duplicates: bool = False,
+    ) -> List[Dict]:
+        """Upsert `rows` through `store` in chunks; returns the rows the server returned."""
+        rows = list(rows or [])
+        if not rows:
+            return []
+        chunks = chunk_rows(rows, on_conflict=on_conflict, max_rows=self.max_rows, max_bytes=self.max_bytes)
+        total = len(chunks)
+        if total == 1:
+            return self._send(store, table, chunks[0], on_conflict, ignore_duplicates, 0, 1)
+
+        written: List[Dict] = []
+        errors: List[BaseException] = []
+        with ThreadPoolExecutor(max_workers=min(self.workers, total), thread_name_prefix="dayflow-upsert") as pool:
+            futures = [
+                pool.submit(self._send, store, table, c, on_conflict, ignore_duplicates, i, total)
+                for i, c in enumerate(chunks)
+            ]
+            for f in futures:
+                try:
+                    written.extend(f.result() or [])
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise ChunkedWriteError(
+                f"upsert {table}: {len(errors)}/{total} chunk(s) failed ({len(written)} row(s) written): {errors[0]}",
+                written=written, errors=errors,
+            )
+        return written
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latencies)
+            pick = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 1) if lat else None
+            return {
+                "chunk_rows": self.max_rows,
+                "chunk_bytes": self.max_bytes,
+                "workers": self.workers,
+                "chunks": self._chunks,
+                "rows": self._rows,
+                "failed_chunks": self._failed,
+                "chunk_ms_p50": pick(0.50),
+                "chunk_ms_p95": pick(0.95),
+                "chunk_ms_max": round(lat[-1] * 1000, 1) if lat else None,
+            }
+
+
+_default: Optional[ChunkedWriter] = None
+_default_lock = threading.Lock()
+
+
+def default_writer() -> ChunkedWriter:
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = ChunkedWriter()
+    return _default
+
+
+def upsert_rows(
+    store: Any,
+    table: str,
+    rows: Sequence[Dict],
+    *,
+    on_conflict: str = DEFAULT_CONFLICT,
+    ignore_duplicates: bool = False,
+) -> List[Dict]:
+    """Chunked upsert via the process-wide writer (configured from DAYFLOW_UPSERT_*)."""
+    return default_writer().upsert(store, table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+
+def metrics() -> Dict[str, Any]:
+    return default_writer().metrics()
@@ -0,0 +1,56 @@
+// lib/schedulerDaemon.ts
+import net from "net";
+
+/** Env vars the scheduler CLI takes its defaults from (dayflow/daemon.py FORWARDED_ENV). */
+const FORWARDED_ENV = ["TZ", "TEST_USER_ID", "TEMPLATE_WHITELIST", "DAYFLOW_STORE_BACKEND", "ALLOW_BEFORE_7"];
+
+export type DaemonRun = { rc: number; output: string; elapsedMs: number };
+
+/**
+ * Run `python -m dayflow.scheduler_main <args>` on the warm local daemon (python -m dayflow.daemon).
+ * Resolves null when no daemon is listening, so the caller can spawn the CLI instead.
+ * Rejects if the daemon accepted the run but didn't answer, which means the run may have happened.
+ */
+export function runViaDaemon(args: string[], timeoutMs: number): Promise<DaemonRun | null> {
+  if (["0", "false", "no", "off"].includes(String(process.env.DAYFLOW_DAEMON ?? "1").toLowerCase())) {
+    return Promise.resolve(null);
+  }
+  const addr = process.env.DAYFLOW_DAEMON_ADDR || "127.0.0.1:8765";
+  const env: Record<string, string> = {};
+  for (const k of FORWARDED_ENV) {
+    if (process.env[k] !== undefined) env[k] = process.env[k] as string;
+  }
+  const payload = JSON.stringify({ argv: args, env, cwd: process.env.SCHEDULER_WORKDIR }) + "\n";
+
+  return new Promise((resolve, reject) => {
+    const socket = addr.startsWith("unix:")
+      ? net.createConnection({ path: addr.slice("unix:".length) })
+      : net.createConnection({ host: addr.slice(0, addr.lastIndexOf(":")), port: Number(addr.slice(addr.lastIndexOf(":") + 1)) });
+    let connected = false;
+    let reply = "";
+    const connectTimer = setTimeout(() => socket.destroy(), 250);
+    const runTimer = setTimeout(() => socket.destroy(new Error(`scheduler daemon timed out after ${timeoutMs}ms`)), timeoutMs);
+
+    socket.on("connect", () => {
+      connected = true;
+      clearTimeout(connectTimer);
+      socket.write(payload);
+    });
+    socket.on("data", (d) => {
+      reply += d.toString();
+      if (reply.includes("\n")) socket.end();
+    });
+    socket.on("error", () => {});
+    socket.on("close", () => {
+      clearTimeout(connectTimer);
+      clearTimeout(runTimer);
+      if (!connected) return resolve(null);
+      try {
+        const data = JSON.parse(reply.split("\n")[0]);
+        resolve({ rc: Number(data.rc ?? 1), output: String(data.output ?? data.error ?? ""), elapsedMs: Number(data.elapsed_ms ?? 0) });
+      } catch {
+        reject(new Error("scheduler daemon closed the connection without answering"));
+      }
+    });
+  });
+}
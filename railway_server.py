@@ -4,26 +4,122 @@ Provides HTTP API to trigger scheduler runs.
 """
 import os
 import sys
-from flask import Flask, jsonify, request
+import json
+import threading
+from datetime import datetime
+from flask import Flask, Response, jsonify, request, stream_with_context
 from pathlib import Path
 
 # Add dayflow module to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from dayflow.scheduler_main import main as scheduler_main
+from dayflow.scheduler_main import RunOptions, open_store, run_for_user
+from dayflow.client_pool import ClientPool
+from dayflow import columns as column_registry
+from dayflow import writer
+from dayflow import transport
+from dayflow import ratelimit
+from dayflow import replica as read_replica
+from dayflow import template_cache as templates
+from dayflow import jobs
 
 app = Flask(__name__)
 
+# One long-lived Supabase client (pooled, keep-alive) for the whole process.
+# Pool size / keep-alive / HTTP2 / per-thread are configured via DAYFLOW_* env vars.
+client_pool = ClientPool()
+# Optional read replica (planning reads); same pooling, its own connections
+replica_pool = ClientPool(url=os.getenv('DAYFLOW_REPLICA_URL')) if os.getenv('DAYFLOW_REPLICA_URL') else None
+# Active users' templates stay in memory between runs, patched by a change feed
+template_cache = templates.build(client_pool.get)
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
     return jsonify({'status': 'ok', 'service': 'dayflow-scheduler'})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Job queue, connection pool, read payload, upsert chunk, transport (latency/retry/breaker), rate-limit queueing and template cache metrics."""
+    return jsonify({
+        'jobs': job_queue.metrics(),
+        'event_streams': {'open': _open_streams, 'max': SSE_MAX_STREAMS},
+        'client_pool': client_pool.metrics(),
+        'reads': column_registry.metrics(),
+        'writes': writer.metrics(),
+        'transport': transport.metrics(),
+        'rate_limit': ratelimit.metrics(),
+        'replica': dict(read_replica.metrics(), pool=replica_pool.metrics() if replica_pool else None),
+        'templates': template_cache.metrics() if template_cache else None,
+    })
+
+def _run_job(payload, emit):
+    """Job handler: one user's scheduler run (see dayflow/jobs.py); stage events go to the job's event log."""
+    run_date = payload['date']
+    # Everything the run needs is passed in (no TZ/TEST_USER_ID env, no argv),
+    # so concurrent workers don't step on each other. The server's long-lived
+    # client is reused instead of creating one per run.
+    store = open_store(
+        client_pool.get(),
+        replica=replica_pool.get() if replica_pool else None,
+        template_cache=template_cache,
+    )
+    day = datetime.strptime(run_date, '%Y-%m-%d').date()
+    print(f"Running scheduler for user {payload['user_id']} on {run_date}")
+    rc = run_for_user(payload['user_id'], day, payload.get('tz') or 'Europe/London', RunOptions(force=True), store,
+                      progress=emit)
+    if rc:
+        raise RuntimeError(f'Scheduler exited with status {rc} for {run_date} (see server logs)')
+    return {'message': f'Scheduler completed for {run_date}'}
+
+# Runs happen on the queue's workers, not in the request thread. Requests for the
+# same user and day share one in-flight run plus at most one queued follow-up, and
+# each user has at most one run in flight whatever the date (DAYFLOW_JOBS_* caps).
+job_queue = jobs.build(
+    _run_job,
+    key=lambda p: (p['user_id'], p['date']),
+    group=lambda p: p['user_id'],
+)
+
+def _elapsed_ms(start, end):
+    if not start or not end:
+        return None
+    return round((datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds() * 1000, 1)
+
+def _job_json(job):
+    return {
+        'ok': job['status'] != jobs.FAILED,
+        'job_id': job['id'],
+        'status': job['status'],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        # Time waiting for a worker and time running, reported apart
+        'wait_ms': _elapsed_ms(job['created_at'], job['started_at']),
+        'run_ms': _elapsed_ms(job['started_at'], job['finished_at']),
+    }
+
+def _too_busy(error, retry_after):
+    """Fast refusal under load: 429 with Retry-After (seconds) instead of a run that would time out."""
+    resp = jsonify({'ok': False, 'error': error, 'retry_after': retry_after})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp
+
 @app.route('/run-scheduler', methods=['POST'])
 def run_scheduler():
     """
-    Run the scheduler for a specific date and user.
-    Expects JSON: { "date": "YYYY-MM-DD", "user_id": "uuid" }
+    Queue a scheduler run for a specific date and user; poll GET /jobs/<job_id> for the outcome,
+    or follow GET /jobs/<job_id>/events for its progress.
+    A request for a (user, date) that already has a run queued gets that run's job.
+    With an Idempotency-Key header, a repeat of the key (same user, same body) within
+    DAYFLOW_IDEMPOTENCY_TTL_S gets the first request's job back, finished or not,
+    with its result, instead of a new run (200 once finished, 202 before).
+    Expects JSON: { "date": "YYYY-MM-DD", "user_id": "uuid", "tz": "Europe/London" (optional) }
+    Returns 202: { "ok": true, "job_id": "...", "status": "queued", "status_url": "/jobs/<job_id>",
+                   "events_url": "/jobs/<job_id>/events" }
     """
     try:
         data = request.get_json()
@@ -43,36 +139,120 @@ def run_scheduler():
                 'error': 'Missing Supabase credentials in environment'
             }), 500
         
-        # Build args for scheduler_main
-        args = ['--date', run_date, '--user', user_id, '--force']
-        
-        # Run scheduler
-        print(f"Running scheduler for user {user_id} on {run_date}")
-        
-        # Set timezone for the scheduler
-        os.environ['TZ'] = 'Europe/London'
-        os.environ['TEST_USER_ID'] = user_id
-        
-        # Mock sys.argv for scheduler_main
-        old_argv = sys.argv
-        sys.argv = ['scheduler_main.py'] + args
-        
         try:
-            scheduler_main()
+            datetime.strptime(run_date, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({
+                'ok': False,
+                'error': f'Invalid date {run_date!r} (expected YYYY-MM-DD)'
+            }), 400
+
+        idempotency_key = request.headers.get('Idempotency-Key')
+        try:
+            job = job_queue.submit(
+                {'user_id': user_id, 'date': run_date, 'tz': data.get('tz')},
+                idempotency_key=(user_id, idempotency_key) if idempotency_key else None,
+            )
+        except jobs.IdempotencyConflict as e:
             return jsonify({
-                'ok': True,
-                'message': f'Scheduler completed for {run_date}'
-            })
-        finally:
-            sys.argv = old_argv
+                'ok': False,
+                'error': str(e)
+            }), 422
+        except jobs.QueueFull as e:
+            print(f"Refusing scheduler run for user {user_id} on {run_date}: {e}")
+            return _too_busy(f'Scheduler queue is full: {e}', e.retry_after)
+
+        if job.get('replayed'):
+            # Retry of a request we already have: answer from the job record, no new run
+            return jsonify(dict(
+                _job_json(job),
+                replayed=True,
+                status_url=f"/jobs/{job['id']}",
+                events_url=f"/jobs/{job['id']}/events",
+            )), 200 if job['status'] in jobs.FINISHED else 202
+
+        print(f"Scheduler job {job['id']} ({job['status']}) covers user {user_id} on {run_date}")
+        return jsonify({
+            'ok': True,
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/jobs/{job['id']}",
+            'events_url': f"/jobs/{job['id']}/events",
+        }), 202
             
     except Exception as e:
-        print(f"Error running scheduler: {e}")
+        print(f"Error queueing scheduler run: {e}")
         return jsonify({
             'ok': False,
             'error': str(e)
         }), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status and result of a queued scheduler run."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'error': f'Unknown job {job_id}'}), 404
+    return jsonify(_job_json(job))
+
+# Seconds between keep-alive comments on an idle event stream (proxies drop silent connections)
+SSE_KEEPALIVE_S = float(os.environ.get('DAYFLOW_SSE_KEEPALIVE_S', 15))
+# Each open stream holds a server thread; beyond this many, callers are told to poll instead
+SSE_MAX_STREAMS = int(os.environ.get('DAYFLOW_SSE_MAX_STREAMS', 50))
+_streams_lock = threading.Lock()
+_open_streams = 0
+
+def _sse(event, data, event_id=None):
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-sent events for a queued scheduler run, as it happens.
+    Each `stage` event is one dict from dayflow/progress.py (stage, counts, ms, elapsed_ms)
+    with its sequence number as the event id; a reconnect with Last-Event-ID resumes after it.
+    The stream ends with one `end` event carrying the job's final status (as GET /jobs/<id>).
+    """
+    global _open_streams
+    if job_queue.get(job_id) is None:
+        return jsonify({'ok': False, 'error': f'Unknown job {job_id}'}), 404
+    with _streams_lock:
+        if _open_streams >= SSE_MAX_STREAMS:
+            return _too_busy(f'Too many open event streams (max {SSE_MAX_STREAMS}); poll /jobs/{job_id}', 5)
+        _open_streams += 1
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        after = 0
+
+    def stream():
+        seen = after
+        yield _sse('status', _job_json(job_queue.get(job_id)))
+        while True:
+            new, finished = job_queue.events(job_id, seen, timeout=SSE_KEEPALIVE_S)
+            for event in new:
+                seen = event['seq']
+                yield _sse('stage', event, event['seq'])
+            if finished and not new:
+                job = job_queue.get(job_id)
+                yield _sse('end', _job_json(job) if job else {'ok': False, 'job_id': job_id, 'error': 'Job record expired'})
+                return
+            if not new:
+                yield ': keep-alive\n\n'
+
+    def closed():
+        global _open_streams
+        with _streams_lock:
+            _open_streams -= 1
+
+    resp = Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    resp.call_on_close(closed)
+    return resp
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))
-    app.run(host='0.0.0.0', port=port)
+    app.run(host='0.0.0.0', port=port, threaded=True)
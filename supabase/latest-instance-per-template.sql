@@ -0,0 +1,31 @@
+-- Latest scheduled_tasks row per template, computed in the database.
+-- Used by carry_forward_missed_days() to find "stopped" templates (most recent
+-- instance deleted, not completed) without downloading every instance.
+-- Run this in your Supabase SQL Editor.
+
+-- Supports DISTINCT ON (template_id) ... ORDER BY local_date DESC as an index scan
+CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_template_latest
+  ON public.scheduled_tasks (template_id, local_date DESC, id DESC);
+
+CREATE OR REPLACE FUNCTION public.latest_instance_per_template(p_template_ids uuid[])
+RETURNS TABLE (
+  template_id  uuid,
+  local_date   date,
+  is_deleted   boolean,
+  is_completed boolean
+)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT DISTINCT ON (st.template_id)
+         st.template_id, st.local_date, st.is_deleted, st.is_completed
+  FROM public.scheduled_tasks st
+  WHERE st.template_id = ANY (p_template_ids)
+  ORDER BY st.template_id, st.local_date DESC, st.id DESC
+$$;
+
+-- The scheduler calls this with the service role key
+GRANT EXECUTE ON FUNCTION public.latest_instance_per_template(uuid[]) TO service_role;
+
+-- Verify:
+-- SELECT * FROM public.latest_instance_per_template(ARRAY(SELECT id FROM task_templates LIMIT 5));
@@ -0,0 +1,221 @@
+-- Month-partition scheduled_tasks and scheduled_tasks_archive by local_date.
+-- Replaces the manual trimming in ARCHIVING_SOLUTION.md as the way to keep daily runs
+-- fast: every planner query carries a local_date bound (dayflow/partitions.py), so
+-- Postgres prunes to the current month's partition or two however much history exists.
+-- Run this in your Supabase SQL Editor, in a quiet window (it copies every row).
+--
+-- What it does, per table:
+--   1. renames the existing table to <table>_unpartitioned (kept until you drop it)
+--   2. creates <table> PARTITION BY RANGE (local_date), same columns and defaults
+--   3. creates monthly partitions from the oldest month in the data (or
+--      DAYFLOW_HISTORY_START, 2024-01 by default) to three months ahead, plus a
+--      DEFAULT partition for anything outside that range
+--   4. copies the rows, re-creates keys, indexes, RLS policies and grants
+--
+-- Constraints of a partitioned table must include the partition key, so the primary
+-- key of scheduled_tasks becomes (id, local_date). uq_sched_user_day_template
+-- (user_id, local_date, template_id), the scheduler's upsert target, already does.
+-- Foreign keys that reference scheduled_tasks(id) have to be dropped first (see the
+-- check at the bottom). Re-create any triggers the old table had.
+--
+-- A row dated past the last partition (a far-deferred instance) lands in the DEFAULT
+-- partition. Postgres refuses to create a month while the default holds rows for it,
+-- so ensure_month_partitions detaches the default, creates the month, moves those rows
+-- into it and re-attaches the default, all in one transaction (writes wait on the lock).
+--
+-- Keep future partitions ahead of the calendar by running monthly, e.g. with pg_cron:
+--   SELECT cron.schedule('dayflow-partitions', '0 3 1 * *',
+--     $$SELECT public.ensure_month_partitions('scheduled_tasks', 3);
+--       SELECT public.ensure_month_partitions('scheduled_tasks_archive', 3)$$);
+
+BEGIN;
+
+-- ----------------------------------------
+-- Partition helper
+-- ----------------------------------------
+CREATE OR REPLACE FUNCTION public.ensure_month_partitions(
+  p_table text,
+  p_months_ahead int DEFAULT 3,
+  p_from date DEFAULT NULL
+)
+RETURNS int
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  m date := date_trunc('month', COALESCE(p_from, CURRENT_DATE))::date;
+  last_month date := (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::date;
+  next_m date;
+  part text;
+  def_part text := format('%s_default', p_table);
+  has_default boolean;
+  stray boolean;
+  created int := 0;
+BEGIN
+  -- Attached DEFAULT partition of p_table, if any
+  SELECT EXISTS (
+    SELECT 1 FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = format('public.%I', p_table)::regclass AND c.relname = def_part
+  ) INTO has_default;
+
+  WHILE m <= last_month LOOP
+    next_m := (m + interval '1 month')::date;
+    part := format('%s_%s', p_table, to_char(m, 'YYYY_MM'));
+    IF to_regclass(format('public.%I', part)) IS NULL THEN
+      stray := false;
+      IF has_default THEN
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM public.%I WHERE local_date >= %L AND local_date < %L)',
+                       def_part, m, next_m) INTO stray;
+      END IF;
+      IF stray THEN
+        EXECUTE format('ALTER TABLE public.%I DETACH PARTITION public.%I', p_table, def_part);
+      END IF;
+      EXECUTE format(
+        'CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+        part, p_table, m, next_m
+      );
+      IF stray THEN
+        EXECUTE format('INSERT INTO public.%I SELECT * FROM public.%I WHERE local_date >= %L AND local_date < %L',
+                       part, def_part, m, next_m);
+        EXECUTE format('DELETE FROM public.%I WHERE local_date >= %L AND local_date < %L', def_part, m, next_m);
+        EXECUTE format('ALTER TABLE public.%I ATTACH PARTITION public.%I DEFAULT', p_table, def_part);
+      END IF;
+      created := created + 1;
+    END IF;
+    m := next_m;
+  END LOOP;
+  RETURN created;
+END;
+$$;
+
+-- ----------------------------------------
+-- scheduled_tasks
+-- ----------------------------------------
+ALTER TABLE public.scheduled_tasks RENAME TO scheduled_tasks_unpartitioned;
+ALTER TABLE public.scheduled_tasks_unpartitioned
+  RENAME CONSTRAINT uq_sched_user_day_template TO uq_sched_user_day_template_unpartitioned;
+ALTER INDEX IF EXISTS public.scheduled_tasks_pkey RENAME TO scheduled_tasks_unpartitioned_pkey;
+ALTER INDEX IF EXISTS public.idx_scheduled_tasks_template_latest RENAME TO idx_scheduled_tasks_unpartitioned_template_latest;
+ALTER INDEX IF EXISTS public.idx_scheduled_tasks_user_date_id RENAME TO idx_scheduled_tasks_unpartitioned_user_date_id;
+ALTER INDEX IF EXISTS public.idx_scheduled_tasks_user_date_deleted RENAME TO idx_scheduled_tasks_unpartitioned_user_date_deleted;
+ALTER INDEX IF EXISTS public.idx_scheduled_tasks_user_date_unscheduled RENAME TO idx_scheduled_tasks_unpartitioned_user_date_unscheduled;
+
+CREATE TABLE public.scheduled_tasks
+  (LIKE public.scheduled_tasks_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING COMMENTS)
+  PARTITION BY RANGE (local_date);
+
+ALTER TABLE public.scheduled_tasks ADD CONSTRAINT scheduled_tasks_pkey PRIMARY KEY (id, local_date);
+ALTER TABLE public.scheduled_tasks
+  ADD CONSTRAINT uq_sched_user_day_template UNIQUE (user_id, local_date, template_id);
+
+SELECT public.ensure_month_partitions(
+  'scheduled_tasks', 3,
+  LEAST(DATE '2024-01-01', (SELECT min(local_date) FROM public.scheduled_tasks_unpartitioned))
+);
+CREATE TABLE public.scheduled_tasks_default PARTITION OF public.scheduled_tasks DEFAULT;
+
+-- Same indexes as latest-instance-per-template.sql and planner-indexes.sql, now per partition
+CREATE INDEX idx_scheduled_tasks_template_latest
+  ON public.scheduled_tasks (template_id, local_date DESC, id DESC);
+CREATE INDEX idx_scheduled_tasks_user_date_id
+  ON public.scheduled_tasks (user_id, local_date, id);
+CREATE INDEX idx_scheduled_tasks_user_date_deleted
+  ON public.scheduled_tasks (user_id, local_date) WHERE is_deleted = true;
+CREATE INDEX idx_scheduled_tasks_user_date_unscheduled
+  ON public.scheduled_tasks (user_id, local_date) WHERE start_time IS NULL;
+
+INSERT INTO public.scheduled_tasks SELECT * FROM public.scheduled_tasks_unpartitioned;
+
+ALTER TABLE public.scheduled_tasks ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "scheduled_tasks_select" ON public.scheduled_tasks FOR SELECT
+  USING (auth.uid() = user_id);
+CREATE POLICY "scheduled_tasks_insert" ON public.scheduled_tasks FOR INSERT
+  WITH CHECK (auth.uid() = user_id);
+CREATE POLICY "scheduled_tasks_update" ON public.scheduled_tasks FOR UPDATE
+  USING (auth.uid() = user_id) WITH CHECK (auth.uid() = user_id);
+CREATE POLICY "scheduled_tasks_delete" ON public.scheduled_tasks FOR DELETE
+  USING (auth.uid() = user_id);
+GRANT SELECT, INSERT, UPDATE, DELETE ON public.scheduled_tasks TO authenticated, service_role;
+
+-- ----------------------------------------
+-- scheduled_tasks_archive
+-- ----------------------------------------
+ALTER TABLE public.scheduled_tasks_archive RENAME TO scheduled_tasks_archive_unpartitioned;
+ALTER INDEX IF EXISTS public.scheduled_tasks_archive_pkey RENAME TO scheduled_tasks_archive_unpartitioned_pkey;
+ALTER INDEX IF EXISTS public.idx_scheduled_tasks_archive_user_date_id
+  RENAME TO idx_scheduled_tasks_archive_unpartitioned_user_date_id;
+
+CREATE TABLE public.scheduled_tasks_archive
+  (LIKE public.scheduled_tasks_archive_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING COMMENTS)
+  PARTITION BY RANGE (local_date);
+
+SELECT public.ensure_month_partitions(
+  'scheduled_tasks_archive', 3,
+  LEAST(DATE '2024-01-01', (SELECT min(local_date) FROM public.scheduled_tasks_archive_unpartitioned))
+);
+CREATE TABLE public.scheduled_tasks_archive_default PARTITION OF public.scheduled_tasks_archive DEFAULT;
+
+-- The same task can be archived more than once, so no unique key here
+CREATE INDEX idx_scheduled_tasks_archive_user_date_id
+  ON public.scheduled_tasks_archive (user_id, local_date, id);
+
+INSERT INTO public.scheduled_tasks_archive SELECT * FROM public.scheduled_tasks_archive_unpartitioned;
+
+ALTER TABLE public.scheduled_tasks_archive ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "scheduled_tasks_archive_select" ON public.scheduled_tasks_archive FOR SELECT
+  USING (auth.uid() = user_id);
+CREATE POLICY "scheduled_tasks_archive_insert" ON public.scheduled_tasks_archive FOR INSERT
+  WITH CHECK (auth.uid() = user_id);
+GRANT SELECT, INSERT ON public.scheduled_tasks_archive TO authenticated;
+GRANT SELECT, INSERT, UPDATE, DELETE ON public.scheduled_tasks_archive TO service_role;
+
+-- ----------------------------------------
+-- latest_instance_per_template with local_date bounds
+-- ----------------------------------------
+-- The one-argument version is dropped so PostgREST has a single candidate to call;
+-- callers that only send p_template_ids keep working through the defaults.
+DROP FUNCTION IF EXISTS public.latest_instance_per_template(uuid[]);
+CREATE OR REPLACE FUNCTION public.latest_instance_per_template(
+  p_template_ids uuid[],
+  p_since date DEFAULT NULL,
+  p_until date DEFAULT NULL
+)
+RETURNS TABLE (
+  template_id  uuid,
+  local_date   date,
+  is_deleted   boolean,
+  is_completed boolean
+)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT DISTINCT ON (st.template_id)
+         st.template_id, st.local_date, st.is_deleted, st.is_completed
+  FROM public.scheduled_tasks st
+  WHERE st.template_id = ANY (p_template_ids)
+    AND (p_since IS NULL OR st.local_date >= p_since)
+    AND (p_until IS NULL OR st.local_date < p_until)
+  ORDER BY st.template_id, st.local_date DESC, st.id DESC
+$$;
+GRANT EXECUTE ON FUNCTION public.latest_instance_per_template(uuid[], date, date) TO service_role;
+
+ANALYZE public.scheduled_tasks;
+ANALYZE public.scheduled_tasks_archive;
+
+COMMIT;
+
+-- Verify (row counts must match, then drop the old tables):
+-- SELECT (SELECT count(*) FROM scheduled_tasks) AS live,
+--        (SELECT count(*) FROM scheduled_tasks_unpartitioned) AS live_old,
+--        (SELECT count(*) FROM scheduled_tasks_archive) AS archive,
+--        (SELECT count(*) FROM scheduled_tasks_archive_unpartitioned) AS archive_old;
+-- DROP TABLE scheduled_tasks_unpartitioned;
+-- DROP TABLE scheduled_tasks_archive_unpartitioned;
+--
+-- Pruning (only the current month's partition should appear in the plan):
+-- EXPLAIN SELECT id FROM scheduled_tasks
+--   WHERE user_id = '<some-user-id>' AND local_date = CURRENT_DATE;
+--
+-- Foreign keys referencing scheduled_tasks (run BEFORE the migration; drop them first):
+-- SELECT conrelid::regclass, conname FROM pg_constraint
+--   WHERE contype = 'f' AND confrelid = 'public.scheduled_tasks'::regclass;
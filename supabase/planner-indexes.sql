@@ -0,0 +1,55 @@
+-- Composite and partial indexes for every scheduled_tasks / scheduled_tasks_archive
+-- read the planner issues (dayflow/planner.py, dayflow/scheduler_main.py).
+-- Check the result with the EXPLAIN tool:
+--   python -m dayflow.explain --dsn postgresql://localhost/dayflow_scratch --seed
+-- Run this in your Supabase SQL Editor.
+--
+-- On a large live table, run each CREATE INDEX on its own as
+-- CREATE INDEX CONCURRENTLY ... (not inside a transaction) to avoid blocking writes.
+
+-- Already in place, not repeated here:
+--   uq_sched_user_day_template (user_id, local_date, template_id)   unique constraint
+--   idx_scheduled_tasks_template_latest (template_id, local_date DESC, id DESC)
+--     latest-instance-per-template.sql: template_id IN (...) ORDER BY local_date DESC
+--   idx_task_templates_user_active (user_id) WHERE is_deleted = false
+--     user-scoped-carry-forward-indexes.sql
+
+-- (user_id, local_date): today's rows, yesterday + today, last run date, completed on
+-- missed days. Adding id lets the keyset history stream (user_id = ? AND
+-- local_date <> ? ORDER BY local_date, id) read in index order without a sort, so it
+-- supersedes the two-column index from user-scoped-carry-forward-indexes.sql.
+CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_date_id
+  ON public.scheduled_tasks (user_id, local_date, id);
+DROP INDEX IF EXISTS public.idx_scheduled_tasks_user_local_date;
+
+-- (user_id, local_date, is_deleted): the deleted-today blocklist. Deleted rows are a
+-- small fraction of the table, so a partial index is smaller than a third key column.
+CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_date_deleted
+  ON public.scheduled_tasks (user_id, local_date)
+  WHERE is_deleted = true;
+
+-- start_time IS NULL: the unscheduled backlog for a day (preprocess + step 3b)
+CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_date_unscheduled
+  ON public.scheduled_tasks (user_id, local_date)
+  WHERE start_time IS NULL;
+
+-- Archive side of the one-off history stream
+CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_archive_user_date_id
+  ON public.scheduled_tasks_archive (user_id, local_date, id);
+
+-- Soft-deleted templates for one user (step 1c in scheduler_main)
+CREATE INDEX IF NOT EXISTS idx_task_templates_user_deleted
+  ON public.task_templates (user_id)
+  WHERE is_deleted = true;
+
+ANALYZE public.scheduled_tasks;
+ANALYZE public.scheduled_tasks_archive;
+ANALYZE public.task_templates;
+
+-- Verify (should show Index Scan / Bitmap Index Scan, not Seq Scan):
+-- EXPLAIN SELECT template_id, is_completed, is_deleted, local_date, id
+--   FROM scheduled_tasks_archive
+--   WHERE user_id = '<some-user-id>' AND local_date <> CURRENT_DATE
+--   ORDER BY local_date, id;
+-- EXPLAIN SELECT id FROM scheduled_tasks
+--   WHERE user_id = '<some-user-id>' AND local_date = CURRENT_DATE AND start_time IS NULL;
@@ -0,0 +1,25 @@
+-- Replication lag probe for the scheduler's read/write split (dayflow/replica.py).
+-- Create it on the primary; it replicates to the read replica like any other function.
+-- Returns 0 on the primary, 0 on a caught-up replica, otherwise seconds since the last
+-- replayed commit. Without it the scheduler can't tell how stale the replica is and keeps
+-- every read on the primary.
+-- Run this in your Supabase SQL Editor.
+
+CREATE OR REPLACE FUNCTION public.replica_lag_seconds()
+RETURNS double precision
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(
+    CASE
+      WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+      ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END,
+    0
+  )::double precision
+$$;
+
+GRANT EXECUTE ON FUNCTION public.replica_lag_seconds() TO service_role;
+
+-- Verify (against the replica's API URL this should be a small number):
+-- SELECT public.replica_lag_seconds();
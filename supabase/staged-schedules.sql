@@ -0,0 +1,33 @@
+-- Plans staged overnight by `scheduler_main --precompute` (dayflow/precompute.py).
+-- One row per user and day: the planner's recorded writes, a hash snapshot of the
+-- inputs they were computed from, and the day start the plan assumed. The next normal
+-- run for that day claims the plan (status staged -> committing, a conditional update
+-- only one run can win), then replays the writes if the inputs still hold
+-- (-> committed) or discards the plan and plans in full (-> discarded).
+-- Without this table --precompute runs fail to stage and normal runs plan in full.
+-- Run this in your Supabase SQL Editor.
+
+CREATE TABLE IF NOT EXISTS public.staged_schedules (
+  user_id      UUID        NOT NULL,
+  local_date   DATE        NOT NULL,
+  status       TEXT        NOT NULL DEFAULT 'staged' CHECK (status IN ('staged', 'committing', 'committed', 'discarded')),
+  day_start    TIMESTAMPTZ NOT NULL,
+  timezone     TEXT        NOT NULL,
+  inputs       JSONB       NOT NULL,
+  writes       JSONB       NOT NULL,
+  placed       INTEGER,
+  computed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  committed_at TIMESTAMPTZ,
+  PRIMARY KEY (user_id, local_date)
+);
+
+-- Tables created before the 'committing' status existed
+ALTER TABLE public.staged_schedules DROP CONSTRAINT IF EXISTS staged_schedules_status_check;
+ALTER TABLE public.staged_schedules ADD CONSTRAINT staged_schedules_status_check
+  CHECK (status IN ('staged', 'committing', 'committed', 'discarded'));
+
+-- Only the scheduler (service role) reads or writes staged plans
+ALTER TABLE public.staged_schedules ENABLE ROW LEVEL SECURITY;
+
+-- Old plans are of no use once their day has passed
+-- DELETE FROM public.staged_schedules WHERE local_date < CURRENT_DATE - 7;
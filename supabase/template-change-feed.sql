@@ -0,0 +1,44 @@
+-- Change feed for the server's template cache (dayflow/template_cache.py).
+-- The poll feed reads task_templates rows with updated_at past its watermark, so
+-- updated_at has to move on every write; the realtime feed needs the table in the
+-- supabase_realtime publication, and full old rows so a DELETE carries its user_id.
+-- Run this in your Supabase SQL Editor.
+
+ALTER TABLE public.task_templates
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION public.task_templates_touch_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.updated_at := NOW();
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_task_templates_updated_at ON public.task_templates;
+CREATE TRIGGER trg_task_templates_updated_at
+  BEFORE INSERT OR UPDATE ON public.task_templates
+  FOR EACH ROW EXECUTE FUNCTION public.task_templates_touch_updated_at();
+
+-- Poll feed: updated_at >= watermark ORDER BY updated_at, id
+CREATE INDEX IF NOT EXISTS idx_task_templates_updated_at
+  ON public.task_templates (updated_at, id);
+
+-- Realtime feed (DAYFLOW_TEMPLATE_FEED=realtime)
+ALTER TABLE public.task_templates REPLICA IDENTITY FULL;
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_publication_tables
+    WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = 'task_templates'
+  ) THEN
+    ALTER PUBLICATION supabase_realtime ADD TABLE public.task_templates;
+  END IF;
+END;
+$$;
+
+-- Verify:
+-- UPDATE task_templates SET title = title WHERE id = '<some-template-id>' RETURNING updated_at;
+-- SELECT * FROM pg_publication_tables WHERE tablename = 'task_templates';
@@ -0,0 +1,19 @@
+-- Indexes backing the per-user carry-forward reads in dayflow/scheduler_main.py.
+-- Every carry-forward query now filters on user_id first, so a single user's run
+-- touches only that user's rows no matter how many tenants exist.
+-- Run this in your Supabase SQL Editor.
+
+-- "Last run date" (user_id = ? AND local_date < ? ORDER BY local_date DESC LIMIT 1),
+-- yesterday's unfinished tasks, today's rows and completed-on-missed-days lookups
+CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_local_date
+  ON public.scheduled_tasks (user_id, local_date);
+
+-- Active templates for one user
+CREATE INDEX IF NOT EXISTS idx_task_templates_user_active
+  ON public.task_templates (user_id)
+  WHERE is_deleted = false;
+
+-- Verify (should show Index Scan / Index Only Scan, not Seq Scan):
+-- EXPLAIN SELECT local_date FROM scheduled_tasks
+--   WHERE user_id = '<some-user-id>' AND local_date < CURRENT_DATE
+--   ORDER BY local_date DESC LIMIT 1;
@@ -0,0 +1,81 @@
+# tests/test_batch.py
+"""
+All-users batch mode (dayflow/batch.py): active-user enumeration, and one
+user's failure, hang or crash staying with that user.
+
+The pool tests run real spawned workers on a SQLite store; the worker swaps in
+_scripted_run (by user id) for scheduler_main.run_for_user before it starts.
+
+    python -m pytest -q tests
+"""
+import os
+import time
+from datetime import date
+
+from dayflow import batch, transport
+from dayflow.scheduler_main import RunOptions, run_for_user
+from dayflow.sqlite_store import SqliteStore
+
+RUN_DATE = date(2025, 12, 10)
+
+
+def _scripted_run(user_id, run_date, tz, options, store, stats=None):
+    if user_id == "boom":
+        raise RuntimeError("bad template")
+    if user_id == "hang":
+        time.sleep(60)
+    if user_id == "crash":
+        os._exit(3)
+    stats["placed"] = 2
+    return 0
+
+
+def _scripted_worker(conn, *args):
+    from dayflow import scheduler_main
+    scheduler_main.run_for_user = _scripted_run
+    batch._worker(conn, *args)
+
+
+def _run(monkeypatch, tmp_path, users, **kw):
+    monkeypatch.setenv("DAYFLOW_SQLITE_PATH", str(tmp_path / "dayflow.sqlite3"))
+    monkeypatch.setattr(batch, "_worker", _scripted_worker)
+    results = batch.run_all(users, RUN_DATE, "UTC", RunOptions(), backend="sqlite", **kw)
+    return {r["user_id"]: r for r in results}
+
+
+def test_active_users_are_distinct_and_skip_deleted_templates():
+    store = SqliteStore(":memory:")
+    store.upsert("task_templates", [
+        dict(id="1", user_id="u2", title="a", is_deleted=False),
+        dict(id="2", user_id="u1", title="b", is_deleted=False),
+        dict(id="3", user_id="u1", title="c", is_deleted=False),
+        dict(id="4", user_id="u3", title="d", is_deleted=True),
+    ], on_conflict="id")
+    assert batch.active_user_ids(store) == ["u1", "u2"]
+
+
+def test_failures_hangs_and_crashes_stay_with_their_user(monkeypatch, tmp_path):
+    results = _run(monkeypatch, tmp_path, ["ok1", "boom", "hang", "crash", "ok2"], workers=2, user_timeout=5)
+    assert set(results) == {"ok1", "boom", "hang", "crash", "ok2"}
+    assert results["ok1"]["rc"] == 0 and results["ok2"]["rc"] == 0 and results["ok2"]["placed"] == 2
+    assert results["boom"]["error"] == "RuntimeError: bad template"
+    assert results["hang"]["timed_out"]
+    assert "worker died" in results["crash"]["error"]
+    s = batch.summarize(list(results.values()), 1.0)
+    assert (s["ok"], s["failed"], s["timed_out"], s["placed"]) == (2, 2, 1, 4)
+
+
+def test_users_not_started_by_the_deadline_are_skipped(monkeypatch, tmp_path):
+    results = _run(monkeypatch, tmp_path, ["a", "b"], workers=1, deadline=1e-9)
+    assert all(r["skipped"] for r in results.values())
+    assert batch.summarize(list(results.values()), 0.0)["skipped"] == 2
+
+
+def test_a_users_run_is_not_aborted_by_the_previous_users_errors(monkeypatch):
+    monkeypatch.setenv("DAYFLOW_PRECOMPUTE", "0")
+    inner = SqliteStore(":memory:")
+    inner.backend = "batch-shared"
+    store = transport.ResilientStore(inner, run_deadline=0.05)
+    store.unrecovered_errors = 2   # left by the previous user on this worker's store
+    time.sleep(0.06)               # ... whose run deadline has passed
+    assert run_for_user("11111111-1111-1111-1111-111111111111", RUN_DATE, "UTC", RunOptions(dry_run=True), store) == 0
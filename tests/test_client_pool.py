@@ -0,0 +1,90 @@
+# tests/test_client_pool.py
+"""
+ClientPool's connection counters (dayflow/client_pool.py) against a local HTTP
+server: keep-alive reuse is counted, refused or closed connections are not.
+
+    python -m pytest -q tests
+"""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from dayflow.client_pool import ClientPool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    close = False
+
+    def do_GET(self):
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    def start(close=False):
+        handler = type("Handler", (_Handler,), {"close": close})
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        started.append(httpd)
+        return f"http://127.0.0.1:{httpd.server_address[1]}/"
+
+    started = []
+    yield start
+    for httpd in started:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _pool():
+    return ClientPool("http://unused", "key", http2=False, timeout=5)
+
+
+def test_keepalive_requests_count_as_reused(server):
+    url = server()
+    pool = _pool()
+    with pool._build_http_client() as http:
+        for _ in range(4):
+            assert http.get(url).status_code == 200
+    m = pool.metrics()
+    assert (m["requests"], m["requests_sent"], m["connections_opened"], m["connections_reused"]) == (4, 4, 1, 3)
+    assert m["connection_reuse_rate"] == 0.75
+
+
+def test_refused_connections_are_not_reuse():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]   # closed again before the requests: nothing listens here
+    pool = _pool()
+    with pool._build_http_client() as http:
+        for _ in range(3):
+            with pytest.raises(httpx.ConnectError):
+                http.get(f"http://127.0.0.1:{port}/")
+    m = pool.metrics()
+    assert m["requests"] == 3
+    assert m["requests_sent"] == 0 and m["connections_reused"] == 0
+    assert m["connection_reuse_rate"] is None
+
+
+def test_server_closed_connections_are_not_reuse(server):
+    url = server(close=True)
+    pool = _pool()
+    with pool._build_http_client() as http:
+        for _ in range(3):
+            http.get(url)
+    m = pool.metrics()
+    assert m["connections_opened"] == 3
+    assert m["connection_reuse_rate"] == 0.0
@@ -0,0 +1,193 @@
+# tests/test_columns.py
+"""
+Column declarations (dayflow/columns.py): a stage must not read a column it
+didn't declare.
+
+The run goes against a local SQLite store seeded with rows that carry more
+columns than any stage declares. Every row a select returns only allows reads of
+the columns that select asked for; any other key read (row[k], row.get(k),
+k in row) is recorded. The run is a full run_for_user, so the templates,
+old_schedule, unscheduled and main_unscheduled (step 3b) fetches and
+schedule_day's reads all go through the store. Reading a column the table
+doesn't have is fine: select("*") wouldn't return it either.
+
+Most stages turn their rows into a DataFrame straight away, and a guarded
+DataFrame read (df.get, `in df.columns`) can't be seen that way. The second test
+covers those: projected and select("*") runs must produce the same instances
+and the same written schedule.
+
+    python -m pytest -q tests
+"""
+import io
+import contextlib
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from dayflow import columns as column_registry
+from dayflow import scheduler_main
+from dayflow.sqlite_store import SqliteStore
+
+USER = "11111111-1111-1111-1111-111111111111"
+RUN_DATE = date(2025, 12, 10)
+
+# Present on every seeded row, declared by no stage
+UNDECLARED = {"description": "d" * 200, "notes": "n" * 100, "color": "#ff0000", "reminder_minutes": 10}
+
+
+def _day(n: int) -> str:
+    return (RUN_DATE - timedelta(days=n)).isoformat()
+
+
+def _templates():
+    base = dict(user_id=USER, repeat_interval=1, is_deleted=False, is_appointment=False, is_routine=False,
+                is_fixed=False, priority=3, kind="floating", date=None, start_time=None, **UNDECLARED)
+    return [
+        dict(base, id="t-daily", title="Meds", repeat_unit="daily", start_time="09:00:00", duration_minutes=15,
+             is_routine=True, kind="routine", priority=2, date=_day(30)),
+        dict(base, id="t-float", title="Write report", repeat_unit="none", duration_minutes=60, priority=1,
+             date=RUN_DATE.isoformat(), window_start_local="10:00", window_end_local="16:00"),
+        dict(base, id="t-weekly", title="Bins", repeat_unit="weekly", repeat_days=[RUN_DATE.weekday()],
+             start_time="18:00:00", duration_minutes=20, date=_day(14)),
+        dict(base, id="t-appt", title="Dentist", repeat_unit="none", start_time="14:00:00", duration_minutes=45,
+             is_appointment=True, is_fixed=True, priority=1, kind="appointment", date=RUN_DATE.isoformat()),
+        dict(base, id="t-carry", title="Carry me", repeat_unit="none", duration_minutes=30, priority=2),
+        dict(base, id="t-gone", title="Old", repeat_unit="daily", start_time="09:00:00", duration_minutes=15,
+             is_deleted=True),
+    ]
+
+
+def _scheduled():
+    base = dict(user_id=USER, is_completed=False, is_deleted=False, is_appointment=False, is_routine=False,
+                is_fixed=False, timezone="Europe/London", priority=3, **UNDECLARED)
+    rows = [
+        dict(base, id=f"s-daily-{n}", template_id="t-daily", title="Meds", local_date=_day(n),
+             start_time=f"{_day(n)}T09:00:00+00:00", end_time=f"{_day(n)}T09:15:00+00:00",
+             duration_minutes=15, is_completed=n % 2 == 0)
+        for n in range(1, 8)
+    ]
+    # an unscheduled one-off from a missed day (carried forward into today)
+    rows.append(dict(base, id="s-carry", template_id="t-carry", title="Carry me", local_date=_day(3),
+                     start_time=None, end_time=None, duration_minutes=30, priority=2))
+    # a template-less task already waiting on today's backlog (steps 1b and 3b)
+    rows.append(dict(base, id="s-backlog", template_id=None, title="Call the bank", local_date=RUN_DATE.isoformat(),
+                     start_time=None, end_time=None, duration_minutes=20))
+    return rows
+
+
+class _TrackedRow(dict):
+    """A selected row that records reads of keys the select didn't ask for."""
+
+    def __init__(self, row, readable, table_columns, where, misses):
+        super().__init__(row)
+        self._readable = set(readable)
+        self._table_columns = table_columns
+        self._where = where
+        self._misses = misses
+
+    def _check(self, key):
+        if key in self._table_columns and key not in self._readable:
+            self._misses.add((self._where, key))
+
+    def __getitem__(self, key):
+        self._check(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._check(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self._check(key)
+        return super().__contains__(key)
+
+    def __setitem__(self, key, value):
+        self._readable.add(key)   # the planner's own additions are fine to read back
+        super().__setitem__(key, value)
+
+    def setdefault(self, key, default=None):
+        self._readable.add(key)
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        extra = dict(*args, **kwargs)
+        self._readable.update(extra)
+        super().update(extra)
+
+
+class TrackingStore(SqliteStore):
+    """SqliteStore whose projected selects hand back _TrackedRow rows."""
+
+    def __init__(self):
+        super().__init__(":memory:")
+        self.misses = set()
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        rows = super().select(table, columns, filters=filters, order=order, limit=limit)
+        wanted = [c.strip() for c in (columns or "*").split(",") if c.strip()]
+        if not wanted or "*" in wanted:
+            return rows
+        have = set(self._load_types(table))
+        return [_TrackedRow(r, wanted, have, f"{table}[{columns}]", self.misses) for r in rows]
+
+
+def _seeded(store):
+    store.upsert("task_templates", _templates(), on_conflict="id")
+    store.upsert("scheduled_tasks", _scheduled(), on_conflict="id")
+    return store
+
+
+def _run(store):
+    with contextlib.redirect_stdout(io.StringIO()):
+        rc = scheduler_main.run_for_user(USER, RUN_DATE, "Europe/London", scheduler_main.RunOptions(force=True), store)
+    assert rc == 0
+    rows = store.select("scheduled_tasks", "*", filters=[("eq", "user_id", USER), ("eq", "local_date", RUN_DATE.isoformat())])
+    return sorted(
+        (r.get("template_id") or "", r.get("title"), str(r.get("start_time")), str(r.get("end_time")),
+         r.get("duration_minutes"), bool(r.get("is_deleted")), bool(r.get("is_completed")))
+        for r in rows
+    )
+
+
+@pytest.fixture(autouse=True)
+def _fresh_registry(monkeypatch):
+    # Prefetched rows are copied into plain dicts; read straight from the store instead
+    monkeypatch.setenv("DAYFLOW_PREFETCH", "0")
+    monkeypatch.setenv("DAYFLOW_PRECOMPUTE", "0")
+    monkeypatch.delenv("DAYFLOW_COLUMN_PROJECTION", raising=False)
+    column_registry._table_cache.clear()
+    column_registry.reset_metrics()
+    yield
+    column_registry._table_cache.clear()
+
+
+def test_stages_read_only_declared_columns():
+    store = _seeded(TrackingStore())
+    _run(store)
+
+    fetched = column_registry.metrics()
+    assert set(column_registry.STAGES) <= set(fetched), f"stages not exercised: {set(column_registry.STAGES) - set(fetched)}"
+    assert all(s["last"]["projected"] for s in fetched.values())
+    assert not store.misses, "undeclared column reads: " + ", ".join(f"{w} -> {k}" for w, k in sorted(store.misses))
+
+
+def _decisions():
+    tz = ZoneInfo("Europe/London")
+    store = _seeded(SqliteStore(":memory:"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        decisions, _ = column_registry._run_once(
+            store, USER, RUN_DATE,
+            datetime.combine(RUN_DATE, time(8, 0), tzinfo=tz), datetime.combine(RUN_DATE, time(23, 0), tzinfo=tz),
+        )
+    return decisions, _run(_seeded(SqliteStore(":memory:")))
+
+
+def test_projection_does_not_change_the_schedule():
+    projected = _decisions()
+    column_registry._table_cache.clear()
+    with column_registry.projection_disabled():
+        full = _decisions()
+    assert projected[0] == full[0], "instances differ"
+    assert projected[1] == full[1], "written schedule differs"
+    assert any(title == "Call the bank" for _, title, *_ in projected[1])
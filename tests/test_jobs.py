@@ -0,0 +1,164 @@
+# tests/test_jobs.py
+"""
+The server's job queue (dayflow/jobs.py): runs on worker threads, the durable
+SQLite backend, coalescing per key, admission limits, and the idempotency-key
+map.
+
+    python -m pytest -q tests
+"""
+import threading
+import time
+
+import pytest
+
+from dayflow import jobs
+
+
+class Gate:
+    """Handler whose runs block until released; records payloads in start order."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = []
+        self._lock = threading.Lock()
+
+    def __call__(self, payload, emit):
+        with self._lock:
+            self.started.append(payload)
+        self.release.wait(5)
+        if payload.get("fail"):
+            raise RuntimeError("run failed")
+        return {"ran": payload}
+
+
+@pytest.fixture
+def gate():
+    g = Gate()
+    yield g
+    g.release.set()
+
+
+def test_jobs_run_on_workers_and_record_their_result(gate):
+    q = jobs.JobQueue(gate, workers=1).start()
+    ok, bad = q.submit({"user": "a"}), q.submit({"user": "b", "fail": True})
+    assert ok["status"] == jobs.QUEUED
+    gate.release.set()
+    q.join()
+    assert q.get(ok["id"])["status"] == jobs.SUCCEEDED
+    assert q.get(ok["id"])["result"] == {"ran": {"user": "a"}}
+    assert q.get(bad["id"])["status"] == jobs.FAILED and q.get(bad["id"])["error"] == "run failed"
+    m = q.metrics()
+    assert (m["submitted"], m[jobs.SUCCEEDED], m[jobs.FAILED], m["depth"], m["busy"]) == (2, 1, 1, 0, 0)
+
+
+def test_sqlite_backend_requeues_unfinished_jobs(tmp_path, gate):
+    path = str(tmp_path / "jobs.sqlite3")
+    first = jobs.JobQueue(gate, backend=jobs.SqliteJobs(path))   # never started: the process "dies"
+    job = first.submit({"user": "a"})
+    first.backend.close()
+
+    q = jobs.JobQueue(gate, backend=jobs.SqliteJobs(path)).start()
+    gate.release.set()
+    q.join()
+    assert q.metrics()["recovered"] == 1
+    assert q.get(job["id"])["status"] == jobs.SUCCEEDED
+
+
+def test_idempotency_keys_of_unfinished_jobs_outlive_the_cap(gate):
+    q = jobs.JobQueue(gate, workers=1, keep_events=2).start()
+    live = [q.submit({"user": u}, idempotency_key=u) for u in "abcd"]
+    assert q.metrics()["idempotency_keys"] == 4   # over the cap of 2, all still queued or running
+    for u, job in zip("abcd", live):
+        assert q.submit({"user": u}, idempotency_key=u)["id"] == job["id"]
+
+    gate.release.set()
+    q.join()
+    q.submit({"user": "e"}, idempotency_key="e")   # now the finished ones can go
+    assert q.metrics()["idempotency_keys"] == 2
+
+
+def _wait_started(gate, n):
+    deadline = time.monotonic() + 2
+    while len(gate.started) < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)   # and give any extra worker the chance to start one more
+
+
+def test_requests_for_a_running_key_coalesce_into_one_follow_up(gate):
+    q = jobs.JobQueue(gate, workers=2, key=lambda p: (p["user"], p["date"])).start()
+    first = q.submit({"user": "a", "date": "2025-12-10"})
+    _wait_started(gate, 1)
+    follow = [q.submit({"user": "a", "date": "2025-12-10"}) for _ in range(3)]
+    assert len({j["id"] for j in follow}) == 1 and follow[0]["id"] != first["id"]
+    other = q.submit({"user": "b", "date": "2025-12-10"})
+    _wait_started(gate, 2)
+    # the follow-up is held behind the running job even with a worker free
+    assert [p["user"] for p in gate.started] == ["a", "b"]
+    assert q.metrics()["held"] == 1
+
+    gate.release.set()
+    q.join()
+    assert len(gate.started) == 3
+    assert all(q.get(j["id"])["status"] == jobs.SUCCEEDED for j in (first, follow[0], other))
+    m = q.metrics()
+    assert (m["submitted"], m["coalesced"]) == (3, 2)
+
+
+def test_a_full_queue_refuses_with_a_retry_after(gate):
+    q = jobs.JobQueue(gate, workers=1, max_depth=2).start()
+    q.submit({"user": "a"})
+    _wait_started(gate, 1)                   # running: no longer counts toward the depth
+    q.submit({"user": "b"})
+    q.submit({"user": "c"})
+    with pytest.raises(jobs.QueueFull) as err:
+        q.submit({"user": "d"})
+    assert err.value.retry_after >= 1
+    assert q.metrics()["rejected"] == 1
+    gate.release.set()
+    q.join()
+    q.submit({"user": "d"})                  # room again once the queue drains
+
+
+def test_a_users_runs_take_one_worker_and_a_bounded_queue(gate):
+    q = jobs.JobQueue(gate, workers=3, group=lambda p: p["user"], max_per_group=2).start()
+    q.submit({"user": "a", "n": 1})
+    _wait_started(gate, 1)
+    q.submit({"user": "a", "n": 2})
+    q.submit({"user": "a", "n": 3})
+    with pytest.raises(jobs.QueueFull, match="for this user"):
+        q.submit({"user": "a", "n": 4})
+    q.submit({"user": "b", "n": 1})          # another user still gets in, and a worker
+    _wait_started(gate, 2)
+    assert [(p["user"], p["n"]) for p in gate.started] == [("a", 1), ("b", 1)]
+
+    gate.release.set()
+    q.join()
+    assert [p["n"] for p in gate.started if p["user"] == "a"] == [1, 2, 3]
+    m = q.metrics()
+    assert (m["depth"], m["held"], m["rejected"]) == (0, 0, 1)
+    assert m["wait_p95_ms"] is not None and m["run_p95_ms"] is not None
+
+
+
+def test_an_idempotency_key_replays_its_job_and_result(gate):
+    q = jobs.JobQueue(gate, workers=1).start()
+    first = q.submit({"user": "a"}, idempotency_key="k")
+    again = q.submit({"user": "a"}, idempotency_key="k")   # attaches to the run in flight
+    assert again["id"] == first["id"] and again["replayed"]
+    with pytest.raises(jobs.IdempotencyConflict):
+        q.submit({"user": "b"}, idempotency_key="k")
+    gate.release.set()
+    q.join()
+    done = q.submit({"user": "a"}, idempotency_key="k")
+    assert done["id"] == first["id"] and done["result"] == {"ran": {"user": "a"}}
+    assert (q.metrics()["submitted"], q.metrics()["replayed"]) == (1, 2)
+
+
+def test_a_key_expires_after_the_ttl_only_once_its_job_finished(gate):
+    q = jobs.JobQueue(gate, workers=1, idempotency_ttl=0.1).start()
+    first = q.submit({"user": "a"}, idempotency_key="k")
+    time.sleep(0.15)
+    assert q.submit({"user": "a"}, idempotency_key="k")["id"] == first["id"]   # still running
+    gate.release.set()
+    q.join()
+    assert q.submit({"user": "a"}, idempotency_key="k")["id"] != first["id"]
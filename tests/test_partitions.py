@@ -0,0 +1,115 @@
+# tests/test_partitions.py
+"""
+local_date windows for open-ended planner reads (dayflow/partitions.py): the
+history floor comes from the data, so nothing older than DAYFLOW_HISTORY_START
+is silently cut off.
+
+    python -m pytest -q tests
+"""
+import io
+import logging
+import contextlib
+from datetime import date, timedelta
+
+import pytest
+
+from dayflow import partitions
+from dayflow.planner import preprocess_recurring_tasks
+from dayflow.sqlite_store import SqliteStore
+
+USER = "11111111-1111-1111-1111-111111111111"
+RUN_DATE = date(2025, 12, 10)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_floor(monkeypatch):
+    monkeypatch.delenv("DAYFLOW_HISTORY_START", raising=False)
+    monkeypatch.setenv("DAYFLOW_PREFETCH", "0")
+    partitions._floor_cache.clear()
+    partitions._warned.clear()
+    yield
+    partitions._floor_cache.clear()
+
+
+def _store(*scheduled, archived=()):
+    store = SqliteStore(":memory:")
+    base = dict(user_id=USER, is_completed=False, is_deleted=False, start_time=None, duration_minutes=30)
+    if scheduled:
+        store.upsert("scheduled_tasks", [dict(base, **r) for r in scheduled], on_conflict="id")
+    if archived:
+        store.insert("scheduled_tasks_archive", [dict(base, **r) for r in archived])
+    return store
+
+
+def test_windows_cover_every_day_down_to_the_floor():
+    floor = date(2020, 3, 5)
+    windows = list(partitions.windows_back(RUN_DATE, floor))
+    assert windows[0] == (RUN_DATE - timedelta(days=31), RUN_DATE)
+    assert windows[-1][0] == floor
+    for (since, _), (_, until) in zip(windows, windows[1:]):
+        assert until == since   # contiguous, no gaps
+    sizes = [(u - s).days for s, u in windows[:-1]]
+    assert sizes == [31 * 2 ** i for i in range(len(sizes))]
+
+
+def test_floor_is_the_oldest_stored_day_and_is_cached():
+    store = _store(dict(id="a", template_id="t", local_date="2023-02-14"),
+                   archived=[dict(id="b", template_id="t", local_date="2022-11-30")])
+    assert partitions.history_start(store) == date(2022, 11, 30)
+    store.delete("scheduled_tasks_archive", filters=[("eq", "id", "b")])
+    assert partitions.history_start(store) == date(2022, 11, 30)   # cached
+    partitions._floor_cache.clear()
+    assert partitions.history_start(store) == date(2023, 2, 14)
+
+
+def test_floor_never_later_than_the_data(monkeypatch, caplog):
+    monkeypatch.setenv("DAYFLOW_HISTORY_START", "2025-01-01")
+    store = _store(dict(id="a", template_id="t", local_date="2023-06-01"))
+    with caplog.at_level(logging.WARNING):
+        assert partitions.history_start(store) == date(2023, 6, 1)
+    assert "before DAYFLOW_HISTORY_START" in caplog.text
+    # no data: the configured start
+    partitions._floor_cache.clear()
+    assert partitions.history_start(_store()) == date(2025, 1, 1)
+
+
+def test_lookup_failure_warns_and_uses_the_configured_start(caplog):
+    class Broken(SqliteStore):
+        def select(self, *a, **k):
+            raise ConnectionError("down")
+
+    with caplog.at_level(logging.WARNING):
+        assert partitions.history_start(Broken(":memory:")) == partitions._DEFAULT_HISTORY_START
+    assert "is not searched" in caplog.text
+
+
+def test_last_run_before_the_default_floor_is_found():
+    store = _store(dict(id="a", template_id="t", local_date="2023-08-20"),
+                   dict(id="b", template_id="t", local_date="2023-08-21"))
+    assert partitions.last_date_before(store, RUN_DATE, [("eq", "user_id", USER)]) == "2023-08-21"
+    assert partitions.last_date_before(store, date(2023, 8, 21), [("eq", "user_id", USER)]) == "2023-08-20"
+
+
+def test_latest_per_template_reaches_old_history():
+    store = _store(dict(id="a", template_id="old", local_date="2023-03-01", is_deleted=True),
+                   dict(id="b", template_id="new", local_date="2025-12-09", is_completed=True),
+                   dict(id="c", template_id="new", local_date="2025-12-20"))   # deferred
+    latest = {r["template_id"]: r for r in partitions.latest_per_template(store, ["old", "new", "none"], RUN_DATE)}
+    assert set(latest) == {"old", "new"}
+    assert str(latest["old"]["local_date"]) == "2023-03-01" and latest["old"]["is_deleted"]
+    assert str(latest["new"]["local_date"]) == "2025-12-20"
+
+
+def test_one_off_completed_before_the_default_floor_is_not_reinstantiated():
+    store = _store(dict(id="s-old", template_id="t-old", local_date="2023-05-02", is_completed=True))
+    base = dict(user_id=USER, repeat_unit="none", repeat_interval=1, is_deleted=False, is_appointment=False,
+                is_routine=False, is_fixed=False, priority=3, duration_minutes=30, date=None, start_time=None)
+    store.upsert("task_templates", [
+        dict(base, id="t-old", title="Done in 2023", created_at="2023-05-01T10:00:00+00:00"),
+        dict(base, id="t-new", title="Still to do", created_at="2025-12-01T10:00:00+00:00"),
+    ], on_conflict="id")
+    with contextlib.redirect_stdout(io.StringIO()):
+        instances = preprocess_recurring_tasks(run_date=RUN_DATE, supabase=store, user_id=USER)
+    planned = {i.get("template_id") or i.get("id") for i in instances}
+    assert "t-new" in planned
+    assert "t-old" not in planned
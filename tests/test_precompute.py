@@ -0,0 +1,181 @@
+# tests/test_precompute.py
+"""
+Staged overnight plans (dayflow/precompute.py) on a SQLite store: the input
+diff, committing with removals dropped, re-timing for a later day start, the
+claim that keeps two first runs from both replaying, and a failed replay.
+
+    python -m pytest -q tests
+"""
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+
+from dayflow import precompute
+from dayflow.sqlite_store import SqliteStore
+
+USER = "11111111-1111-1111-1111-111111111111"
+DAY = date(2025, 12, 10)
+UTC = timezone.utc
+
+
+def _at(h, m=0):
+    return datetime.combine(DAY, time(h, m), tzinfo=UTC)
+
+
+def _row(tid, start, minutes, **flags):
+    s = _at(*start)
+    row = dict(user_id=USER, local_date=DAY.isoformat(), template_id=tid, title=tid,
+               start_time=s.isoformat(), end_time=(s + timedelta(minutes=minutes)).isoformat(),
+               duration_minutes=minutes, is_appointment=False, is_routine=False, is_fixed=False)
+    row.update(flags)
+    return row
+
+
+PLAN = [
+    _row("t-read", (8, 0), 30),
+    _row("t-dentist", (9, 0), 60, is_appointment=True, is_fixed=True),
+    _row("t-write", (10, 0), 60),
+]
+
+
+def _store(store=None):
+    store = store or SqliteStore(":memory:")
+    store.upsert("task_templates", [
+        dict(id=tid, user_id=USER, title=tid, repeat_unit="daily", is_deleted=False)
+        for tid in ("t-read", "t-dentist", "t-write")
+    ], on_conflict="id")
+    return store
+
+
+def _stage(store, plan=PLAN, start=(8, 0)):
+    writes = [{"op": "upsert", "table": "scheduled_tasks", "rows": [dict(r) for r in plan],
+               "on_conflict": "user_id,local_date,template_id", "ignore_duplicates": False}]
+    assert precompute.stage(store, USER, DAY, inputs=precompute.snapshot(store, USER, DAY), writes=writes,
+                            day_start=_at(*start), tz_name="UTC", placed=len(plan))
+
+
+def _commit(store, start=(8, 0), **kw):
+    return precompute.commit(store, USER, DAY, day_start=_at(*start), tz_name="UTC", **kw)
+
+
+def _schedule(store):
+    rows = store.select("scheduled_tasks", "*", filters=[("eq", "user_id", USER), ("eq", "local_date", DAY.isoformat())])
+    return {r["template_id"]: (r["start_time"], r["end_time"]) for r in rows}
+
+
+def _status(store):
+    return store.select(precompute.TABLE, "status", filters=[("eq", "user_id", USER)])[0]["status"]
+
+
+def test_unchanged_inputs_commit_the_staged_writes_once():
+    store = _store()
+    _stage(store)
+    result = _commit(store)
+    assert result == {"placed": 3, "writes": 1, "removed": 0, "moved": 0, "unscheduled": 0}
+    assert _schedule(store)["t-write"][0].startswith(f"{DAY}T10:00")
+    assert _status(store) == precompute.COMMITTED
+    assert _commit(store) is None   # used at most once
+
+
+def test_edited_template_discards_the_plan():
+    store = _store()
+    _stage(store)
+    store.update("task_templates", {"title": "Read more"}, filters=[("eq", "id", "t-read")])
+    assert _commit(store) is None
+    assert _status(store) == precompute.DISCARDED
+    assert _schedule(store) == {}
+
+
+def test_deleted_template_drops_only_its_writes():
+    store = _store()
+    _stage(store)
+    store.update("task_templates", {"is_deleted": True}, filters=[("eq", "id", "t-write")])
+    result = _commit(store)
+    assert result["placed"] == 2 and result["removed"] == 1
+    assert set(_schedule(store)) == {"t-read", "t-dentist"}
+
+
+def test_whitelist_or_earlier_start_discards():
+    store = _store()
+    _stage(store, start=(9, 0))
+    assert _commit(store, start=(8, 0)) is None
+    assert _status(store) == precompute.DISCARDED
+
+
+def test_later_start_re_times_what_it_passed():
+    store = _store()
+    _stage(store)
+    result = _commit(store, start=(8, 45))
+    assert result["moved"] == 1 and result["unscheduled"] == 0
+    sched = _schedule(store)
+    # the appointment stays put; the 08:00 read moves to the first free slot after it
+    assert sched["t-dentist"][0].startswith(f"{DAY}T09:00")
+    assert sched["t-read"][0].startswith(f"{DAY}T11:00")
+    assert sched["t-write"][0].startswith(f"{DAY}T10:00")
+
+
+def test_from_start_unschedules_what_no_longer_fits():
+    plan = [_row("short", (7, 0), 10), _row("long", (8, 0), 60), _row("fixed", (8, 30), 15, is_fixed=True),
+            _row("later", (22, 40), 10)]
+    writes = [{"op": "upsert", "table": "scheduled_tasks", "rows": plan}]
+    out, moved, unscheduled = precompute._from_start(writes, _at(22, 30), _at(23, 0))
+    rows = {r["template_id"]: r for r in out[0]["rows"]}
+    assert (moved, unscheduled) == (1, 2)
+    assert rows["short"]["start_time"].startswith(f"{DAY}T22:30")   # just fits before the kept 22:40 task
+    assert rows["later"]["start_time"].startswith(f"{DAY}T22:40")
+    assert rows["long"]["start_time"] is None                        # no hour left before 23:00
+    assert rows["fixed"]["start_time"] is None                       # a fixed time that has passed
+    assert plan[0]["start_time"].startswith(f"{DAY}T07:00")          # the staged writes are untouched
+
+
+class _RacingStore(SqliteStore):
+    """Both runs read the staged plan before either claims it."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.barrier = threading.Barrier(2, timeout=5)
+        self.racing = True
+        self.replays = 0
+        self._count = threading.Lock()
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        rows = super().select(table, columns, filters=filters, order=order, limit=limit)
+        if table == precompute.TABLE and self.racing:
+            self.barrier.wait()
+        return rows
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        if table == "scheduled_tasks":
+            with self._count:
+                self.replays += 1
+        return super().upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+
+def test_two_first_runs_replay_the_plan_once(tmp_path):
+    store = _store(_RacingStore(str(tmp_path / "dayflow.sqlite3")))
+    _stage(store)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(_commit(store))) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    store.racing = False
+    assert sorted(r is None for r in results) == [False, True]
+    assert store.replays == 1
+    assert _status(store) == precompute.COMMITTED
+
+
+def test_failed_replay_discards_the_claimed_plan():
+    class Failing(SqliteStore):
+        def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+            if table == "scheduled_tasks":
+                raise ConnectionError("lost")
+            return super().upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+    store = _store(Failing(":memory:"))
+    _stage(store)
+    with pytest.raises(ConnectionError):
+        _commit(store)
+    assert _status(store) == precompute.DISCARDED
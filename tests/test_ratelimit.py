@@ -0,0 +1,79 @@
+# tests/test_ratelimit.py
+"""
+Token buckets (dayflow/ratelimit.py): waiting instead of failing, optional
+requests that never wait, and a token per request actually sent - retries
+through the transport included.
+
+    python -m pytest -q tests
+"""
+import time
+
+import pytest
+
+from dayflow import ratelimit, transport
+from dayflow.ratelimit import TokenBucket
+from dayflow.sqlite_store import SqliteStore
+
+
+@pytest.fixture(autouse=True)
+def _fresh_buckets(monkeypatch):
+    for name in ("DAYFLOW_RATE_READS_PER_S", "DAYFLOW_RATE_WRITES_PER_S"):
+        monkeypatch.delenv(name, raising=False)
+    ratelimit._buckets.clear()
+    yield
+    ratelimit._buckets.clear()
+
+
+def test_an_empty_bucket_makes_callers_wait_their_turn():
+    bucket = TokenBucket("reads", rate=20, burst=2)
+    t0 = time.monotonic()
+    waits = [bucket.acquire() for _ in range(4)]
+    elapsed = time.monotonic() - t0
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.05, abs=0.02) and waits[3] == pytest.approx(0.05, abs=0.02)
+    assert 0.08 <= elapsed < 0.5
+    m = bucket.metrics()
+    assert (m["acquired"], m["delayed"], m["waiting_now"]) == (4, 2, 0)
+
+
+def test_try_acquire_never_waits():
+    bucket = TokenBucket("reads", rate=1, burst=1)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.metrics()["acquired"] == 1
+
+
+def test_unset_budgets_are_unlimited():
+    assert ratelimit.take("reads") == 0.0 and ratelimit.try_take("writes")
+    store = SqliteStore(":memory:")
+    assert ratelimit.wrap(store) is store
+
+
+def test_each_transport_attempt_takes_a_token(monkeypatch):
+    monkeypatch.setenv("DAYFLOW_RETRY_BASE_MS", "1")
+    ratelimit.configure(reads_per_s=1000, read_burst=1000)
+
+    class Flaky(SqliteStore):
+        calls = 0
+
+        def select(self, *a, **k):
+            self.calls += 1
+            if self.calls < 3:
+                raise ConnectionError("reset")
+            return super().select(*a, **k)
+
+    inner = Flaky(":memory:")
+    inner.backend = "ratelimit-flaky"
+    store = transport.ResilientStore(inner, read_retries=2)
+    store.select("task_templates", "id")
+    assert ratelimit.metrics()["reads"]["acquired"] == 3
+
+
+def test_wrapper_takes_a_read_or_write_token_per_request():
+    ratelimit.configure(reads_per_s=1000, writes_per_s=1000, read_burst=1000, write_burst=1000)
+    store = ratelimit.wrap(SqliteStore(":memory:"))
+    store.upsert("task_templates", [{"id": "t1", "title": "Read"}], on_conflict="id")
+    store.select("task_templates", "id")
+    store.select("task_templates", "id")
+    m = ratelimit.metrics()
+    assert (m["reads"]["acquired"], m["writes"]["acquired"]) == (2, 1)
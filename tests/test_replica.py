@@ -0,0 +1,103 @@
+# tests/test_replica.py
+"""
+Read routing in SplitStore (dayflow/replica.py) with two SQLite stores: the
+replica holds an older copy of the rows, so a read that lands there shows it.
+
+    python -m pytest -q tests
+"""
+import io
+import contextlib
+from datetime import date
+
+from dayflow import replica, transport
+from dayflow.scheduler_main import RunOptions, run_for_user
+from dayflow.sqlite_store import SqliteStore
+
+USER = "11111111-1111-1111-1111-111111111111"
+RUN_DATE = date(2025, 12, 10)
+TODAY = RUN_DATE.isoformat()
+
+
+class _Replica(SqliteStore):
+    def __init__(self, lag=0.0):
+        super().__init__(":memory:")
+        self.lag = lag
+
+    def replication_lag(self):
+        return self.lag
+
+
+def _task(id, local_date, **kw):
+    return dict(dict(id=id, user_id=USER, template_id=f"t-{id}", title=id, local_date=local_date,
+                     is_completed=False, is_deleted=False, start_time=None, duration_minutes=30), **kw)
+
+
+def _split(lag=0.0):
+    """Both stores have yesterday's row; only the primary has the user's edits of today."""
+    primary, stale = SqliteStore(":memory:"), _Replica(lag)
+    for store in (primary, stale):
+        store.upsert("scheduled_tasks", [_task("y", "2025-12-09"), _task("a", TODAY)], on_conflict="id")
+        store.upsert("task_templates", [dict(id="t-a", user_id=USER, title="Read", is_deleted=False)],
+                     on_conflict="id")
+    primary.update("scheduled_tasks", {"is_deleted": True}, filters=[("eq", "id", "a")])
+    primary.update("task_templates", {"is_deleted": True}, filters=[("eq", "id", "t-a")])
+    return replica.SplitStore(primary, stale, lag_check_every=0)
+
+
+def _deleted_today(store):
+    rows = store.select("scheduled_tasks", "id, is_deleted", filters=[("eq", "local_date", TODAY)])
+    return [bool(r["is_deleted"]) for r in rows]
+
+
+def test_run_day_reads_go_to_the_primary_before_any_write():
+    store = _split()
+    assert _deleted_today(store) == [False]   # no run yet: the fresh-enough replica
+    replica.start_run(store, RUN_DATE)
+    assert _deleted_today(store) == [True]
+    assert store.select("task_templates", "is_deleted")[0]["is_deleted"]
+
+
+def test_history_reads_stay_on_the_replica():
+    store = _split()
+    replica.start_run(store, RUN_DATE)
+    before = replica.metrics()["reads_replica"]
+    rows = store.select("scheduled_tasks", "id", filters=[("lt", "local_date", TODAY)])
+    assert [r["id"] for r in rows] == ["y"]
+    assert replica.metrics()["reads_replica"] == before + 1
+
+
+def test_start_run_finds_the_split_under_other_wrappers():
+    store = _split()
+    wrapped = transport.ResilientStore(store)
+    replica.start_run(wrapped, RUN_DATE)
+    assert _deleted_today(wrapped) == [True]
+    replica.start_run(SqliteStore(":memory:"), RUN_DATE)   # no split: nothing to do
+
+
+def test_written_dates_and_lag_still_route_to_the_primary():
+    store = _split()
+    store.upsert("scheduled_tasks", [_task("b", "2025-12-11")], on_conflict="id")
+    rows = store.select("scheduled_tasks", "id", filters=[("eq", "local_date", "2025-12-11")])
+    assert [r["id"] for r in rows] == ["b"]
+
+    lagging = _split(lag=30.0)
+    assert _deleted_today(lagging) == [True]
+
+
+def test_revise_does_not_bring_back_a_task_deleted_today(monkeypatch):
+    monkeypatch.setenv("DAYFLOW_PRECOMPUTE", "0")
+    monkeypatch.setenv("DAYFLOW_PREFETCH", "0")
+    store = _split()
+    base = dict(user_id=USER, repeat_unit="daily", repeat_interval=1, is_appointment=False, is_routine=False,
+                is_fixed=False, priority=3, duration_minutes=30, date=None, start_time=None,
+                created_at="2025-12-01T10:00:00+00:00")
+    for s in (store.primary, store.replica):
+        s.upsert("task_templates", [dict(base, id="t-a", title="Read", is_deleted=False),
+                                    dict(base, id="t-b", title="Write", is_deleted=False)], on_conflict="id")
+    # today's "a" was deleted in the UI; the template itself stays
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert run_for_user(USER, RUN_DATE, "UTC", RunOptions(), store) == 0
+    today = {r["template_id"]: r for r in store.primary.select(
+        "scheduled_tasks", "template_id, is_deleted, start_time", filters=[("eq", "local_date", TODAY)])}
+    assert today["t-b"]["start_time"] is not None
+    assert today["t-a"]["is_deleted"] and today["t-a"]["start_time"] is None   # not planned again
@@ -0,0 +1,206 @@
+# tests/test_serialize.py
+"""
+schedule_day's write payload (dayflow/serialize.py) against the per-row code it
+replaced. `_per_row` below is that code, unchanged apart from being lifted out of
+schedule_day; both run on the same frame and must give the same records.
+
+    python -m pytest -q tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from dayflow import serialize
+from dayflow.planner import _normalize_priority
+
+USER = "11111111-1111-1111-1111-111111111111"
+LOCAL_DATE = "2025-12-10"
+TZ = "Europe/London"
+TABLE_COLUMNS = {
+    "id", "user_id", "local_date", "date", "template_id", "title", "start_time", "end_time",
+    "duration_minutes", "timezone", "is_appointment", "is_routine", "is_fixed", "priority", "description",
+}
+
+
+def _per_row(df, notes, whitelist):
+    """The old iterrows() builder: (upsert rows, [(id, update), ...])."""
+    def _is_blank(v):
+        if v is None:
+            return True
+        try:
+            if pd.isna(v):
+                return True
+        except Exception:
+            pass
+        return isinstance(v, str) and v.strip() == ""
+
+    def _safe_title(row):
+        for key in ("title", "task"):
+            v = row.get(key)
+            if not _is_blank(v):
+                return str(v)
+        return f"Template {row.get('origin_template_id') or row.get('template_id') or row.get('id') or 'unknown'}"
+
+    def _row_template_id(row):
+        tid = row.get("origin_template_id") or row.get("template_id") or row.get("id")
+        if tid is None:
+            return None
+        try:
+            if pd.isna(tid):
+                return None
+        except (TypeError, ValueError):
+            pass
+        return str(tid)
+
+    def _to_utc_iso(ts):
+        if pd.isna(ts):
+            return None
+        ts = pd.to_datetime(ts, utc=True)
+        return ts.tz_convert("UTC").isoformat()
+
+    def _dur(row_dict):
+        try:
+            return int(row_dict.get("duration_minutes")) if row_dict.get("duration_minutes") is not None else None
+        except Exception:
+            return None
+
+    rows, updates = [], []
+    for _, row in df.iterrows():
+        row_dict = row.to_dict()
+        template_id = _row_template_id(row_dict)
+        row_id = row_dict.get("id")
+        has_existing_id = row_id and not pd.isna(row_id)
+        if has_existing_id and (template_id is None or template_id == str(row_id)):
+            start = _to_utc_iso(row_dict.get("start_time"))
+            if start:
+                end_ts = row_dict.get("end_time")
+                updates.append((str(row_id), {
+                    "start_time": start,
+                    "end_time": _to_utc_iso(end_ts) if pd.notna(end_ts) else None,
+                    "duration_minutes": _dur(row_dict),
+                    "priority": _normalize_priority(row_dict.get("priority")),
+                }))
+            continue
+        if template_id is None:
+            continue
+        if whitelist and isinstance(whitelist, (set, list, tuple)) and template_id not in set(whitelist):
+            continue
+        start_ts = row_dict.get("start_time")
+        if pd.isna(start_ts):
+            continue
+        start = _to_utc_iso(start_ts)
+        if not start:
+            continue
+        end_ts = row_dict.get("end_time")
+        description = notes.get(str(template_id))
+        if description and ("No available time slot" in description or "window" in description.lower()):
+            description = None
+        row_data = {
+            "user_id": USER,
+            "local_date": LOCAL_DATE,
+            "template_id": str(template_id),
+            "title": _safe_title(row_dict),
+            "start_time": start,
+            "end_time": _to_utc_iso(end_ts) if pd.notna(end_ts) else None,
+            "duration_minutes": _dur(row_dict),
+            "timezone": TZ,
+            "is_appointment": bool(row_dict.get("is_appointment")),
+            "is_routine": bool(row_dict.get("is_routine")),
+            "is_fixed": bool(row_dict.get("is_fixed")),
+            "priority": _normalize_priority(row_dict.get("priority")),
+        }
+        if description is not None:
+            row_data["description"] = description
+        rows.append(row_data)
+
+    def _sanitize(r):
+        return {k: (None if not isinstance(v, (list, dict)) and pd.isna(v) else v) for k, v in r.items()}
+
+    rows = [_sanitize({k: v for k, v in r.items() if k in TABLE_COLUMNS and k != "date"}) for r in rows]
+    return rows, updates
+
+
+def _vectorized(df, notes, whitelist):
+    upserts, updates = serialize.schedule_rows(
+        df, user_id=USER, local_date=LOCAL_DATE, timezone=TZ, notes=notes, whitelist=whitelist,
+    )
+    rows = upserts.records(TABLE_COLUMNS, exclude={"date"}, omit_none=("description",))
+    out = []
+    for u in updates.records():
+        task_id = u.pop("id")
+        if u["start_time"]:
+            out.append((task_id, u))
+    return rows, out
+
+
+def _frame():
+    ts = pd.Timestamp("2025-12-10 09:00", tz="Europe/London")
+    nan = float("nan")
+    flags = dict(is_appointment=False, is_routine=False, is_fixed=False)
+    rows = [dict(flags, **r) for r in [
+        # plain template instance
+        dict(template_id="t1", title="Meds", start_time=ts, duration_minutes=15, priority=2, is_routine=True),
+        # missing title -> task -> "Template <id>"
+        dict(template_id="t2", title=None, task="From task", start_time=ts, duration_minutes=30.0, priority=nan),
+        dict(template_id="t3", title="  ", task=nan, start_time=ts, duration_minutes=nan, priority="2.5"),
+        dict(template_id="t4", title=nan, start_time=ts, duration_minutes="45", priority="4"),
+        # string / float / out-of-range priorities
+        dict(template_id="t5", title="High", start_time=ts, duration_minutes="20.5", priority="high"),
+        dict(template_id="t6", title="Float", start_time=ts, duration_minutes=10, priority=4.7),
+        dict(template_id="t7", title="Clamp", start_time=ts, duration_minutes=10, priority=9),
+        dict(template_id="t8", title="Clamp low", start_time=ts, duration_minutes=10, priority=-2),
+        dict(template_id="t9", title="Blank", start_time=ts, duration_minutes=10, priority=""),
+        # unplaced -> skipped
+        dict(template_id="t12", title="Unplaced", start_time=pd.NaT, duration_minutes=5),
+        # sub-second timestamps, no end time
+        dict(template_id="t13", title="Precise", start_time=ts + pd.Timedelta(milliseconds=250), end_time=pd.NaT),
+        # existing tasks updated by id
+        dict(id="s1", title="Backlog", start_time=ts, duration_minutes="15", priority="1"),
+        dict(id="s2", template_id="s2", title="Same id", start_time=ts, duration_minutes=nan, priority="3.0"),
+        dict(id="s3", title="Unplaced backlog", start_time=pd.NaT, duration_minutes=10),
+        # preserved / cleared notes
+        dict(template_id="t14", title="Notes", start_time=ts, duration_minutes=10, priority=3),
+        dict(template_id="t15", title="Stale note", start_time=ts, duration_minutes=10, priority=3),
+        # missing flag -> NaN -> bool(NaN) is True
+        dict(template_id="t16", title="No flag", start_time=ts, duration_minutes=10, is_fixed=nan),
+    ]]
+    df = pd.DataFrame(rows)
+    df["end_time"] = df["start_time"] + pd.to_timedelta(pd.to_numeric(df["duration_minutes"], errors="coerce"), unit="m")
+    df.loc[df["template_id"] == "t13", "end_time"] = pd.NaT
+    return df
+
+
+def _origin_frame():
+    # A NaN origin_template_id wins the `or` chain, so that row has no template id and is dropped
+    ts = pd.Timestamp("2025-12-10 09:00", tz="UTC")
+    return pd.DataFrame([
+        dict(origin_template_id=float("nan"), template_id="t10", title="Origin NaN", start_time=ts, priority="2.5"),
+        dict(origin_template_id="t11", template_id="x", title="Origin", start_time=ts, priority="2.5"),
+        dict(origin_template_id=None, template_id="t12", title=None, task=None, start_time=ts, priority=None),
+        dict(origin_template_id="", template_id=None, id="s9", title="Existing", start_time=ts, priority=1.0),
+    ])
+
+
+NOTES = {"t14": "bring the form", "t15": "No available time slot in window"}
+
+
+@pytest.mark.parametrize("whitelist", [None, {"t1", "t3", "t5", "t11", "t14"}])
+@pytest.mark.parametrize("frame", [_frame, _origin_frame])
+def test_matches_per_row_builder(frame, whitelist):
+    df = frame()
+    expected = _per_row(df, NOTES, whitelist)
+    got = _vectorized(df, NOTES, whitelist)
+    assert got[0] and got[0] == expected[0]
+    assert got[1] == expected[1]
+
+
+def test_non_integer_strings_get_the_default_priority():
+    values = serialize._objects(["2.5", "4", " 5 ", "3.0", "high", "", None, float("nan"), 2.9, 7, True])
+    assert serialize.priorities(values).tolist() == [_normalize_priority(v) for v in values]
+    assert serialize.priorities(serialize._objects(["2.5"])).tolist() == [3]
+    assert serialize.durations(serialize._objects(["2.5", "45", 30.0, None])).tolist() == [None, 45, 30, None]
+
+
+def test_rows_round_trip_dicts():
+    rows = [{"a": 1, "b": np.nan}, {"a": None, "c": "x"}]
+    assert serialize.Rows.from_dicts(rows).records() == [{"a": 1, "b": None, "c": None}, {"a": None, "b": None, "c": "x"}]
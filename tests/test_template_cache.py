@@ -0,0 +1,138 @@
+# tests/test_template_cache.py
+"""
+The per-user template cache (dayflow/template_cache.py): hits within a run,
+refetches when an entry could be older than the run or too stale, and feed
+changes patched into cached entries.
+
+    python -m pytest -q tests
+"""
+import time
+from datetime import datetime, timezone
+
+from dayflow.sqlite_store import SqliteStore
+from dayflow.template_cache import PollingFeed, TemplateCache
+
+USER = "11111111-1111-1111-1111-111111111111"
+ACTIVE = [("eq", "user_id", USER), ("eq", "is_deleted", False)]
+
+
+class CountingStore(SqliteStore):
+    def __init__(self):
+        super().__init__(":memory:")
+        self.template_reads = 0
+        self.on_read = None
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        rows = super().select(table, columns, filters=filters, order=order, limit=limit)
+        if table == "task_templates":
+            self.template_reads += 1
+            if self.on_read:
+                self.on_read()
+        return rows
+
+
+class SyncedFeed:
+    """A feed that has just confirmed every change up to now."""
+
+    kind = "test"
+
+    def start(self, cache):
+        pass
+
+    def synced_at(self):
+        return time.time()
+
+    def metrics(self):
+        return {}
+
+
+def _store(*titles):
+    store = CountingStore()
+    store.upsert("task_templates", [dict(id=f"t{i}", user_id=USER, title=t, is_deleted=False)
+                                    for i, t in enumerate(titles)], on_conflict="id")
+    return store
+
+
+def _titles(store):
+    return sorted(r["title"] for r in store.select("task_templates", "id, title", filters=ACTIVE))
+
+
+def test_second_read_in_a_run_is_a_hit():
+    inner = _store("Read", "Write")
+    run = TemplateCache().wrap(inner)
+    assert _titles(run) == _titles(run) == ["Read", "Write"]
+    assert inner.template_reads == 1
+    assert run.select("task_templates", "id", filters=ACTIVE + [("eq", "id", "t0")])   # not a cacheable read
+    assert inner.template_reads == 2
+
+
+def test_a_new_run_never_plans_from_an_entry_older_than_itself():
+    cache = TemplateCache()
+    inner = _store("Read")
+    _titles(cache.wrap(inner))
+    inner.upsert("task_templates", [dict(id="t9", user_id=USER, title="QuickAdd", is_deleted=False)],
+                 on_conflict="id")   # written outside the run's wrapper
+    time.sleep(0.01)
+    assert _titles(cache.wrap(inner)) == ["QuickAdd", "Read"]
+    assert cache.metrics()["behind_refetches"] == 1
+
+
+def test_a_confirmed_feed_lets_later_runs_hit_until_it_goes_stale():
+    cache = TemplateCache(SyncedFeed(), max_stale=0.05)
+    inner = _store("Read")
+    _titles(cache.wrap(inner))
+    run = cache.wrap(inner)
+    _titles(run)
+    assert inner.template_reads == 1
+
+    last_sync = time.time()
+    cache.feed.synced_at = lambda: last_sync   # the feed stops confirming
+    time.sleep(0.06)
+    _titles(run)
+    assert inner.template_reads == 2
+    assert cache.metrics()["stale_refetches"] == 1
+
+
+def test_feed_changes_patch_the_entry():
+    cache = TemplateCache(SyncedFeed())
+    inner = _store("Read", "Write")
+    run = cache.wrap(inner)
+    _titles(run)
+    cache.apply(dict(id="t0", user_id=USER, title="Read more", is_deleted=False))
+    cache.apply(dict(id="t1", user_id=USER, is_deleted=True))
+    cache.apply(dict(id="t2", user_id=USER, title="Call", is_deleted=False))
+    assert _titles(run) == ["Call", "Read more"]
+    assert inner.template_reads == 1
+
+
+def test_a_change_during_the_fetch_is_replayed_onto_it():
+    cache = TemplateCache(SyncedFeed())
+    inner = _store("Read", "Write")
+    inner.on_read = lambda: cache.apply(dict(id="t1", user_id=USER, is_deleted=True))
+    run = cache.wrap(inner)
+    _titles(run)
+    inner.on_read = None
+    assert _titles(run) == ["Read"]
+
+
+def test_writes_through_the_wrapper_drop_the_entry():
+    cache = TemplateCache(SyncedFeed())
+    inner = _store("Read")
+    run = cache.wrap(inner)
+    _titles(run)
+    run.update("task_templates", {"title": "Read more"}, filters=[("eq", "user_id", USER), ("eq", "id", "t0")])
+    assert _titles(run) == ["Read more"]
+    assert inner.template_reads == 2
+
+
+def test_polling_feed_applies_rows_updated_since_the_watermark():
+    inner = _store("Read")
+    feed = PollingFeed(lambda: inner, interval=3600, overlap=0)
+    cache = TemplateCache(feed)
+    run = cache.wrap(inner)
+    _titles(run)
+    stamp = datetime.now(timezone.utc).isoformat()
+    inner.update("task_templates", {"title": "Read more", "updated_at": stamp}, filters=[("eq", "id", "t0")])
+    assert feed.poll() == 1
+    assert _titles(run) == ["Read more"]
+    feed.stop()
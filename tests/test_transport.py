@@ -0,0 +1,201 @@
+# tests/test_transport.py
+"""
+ResilientStore (dayflow/transport.py) over a scripted fake backend: retries,
+the circuit breaker, deadlines, abandoned-call tracking, write settling and
+hedged reads.
+
+Every test gets its own backend name, so breaker state and counters (shared per
+backend across the process) start from zero.
+
+    python -m pytest -q tests
+"""
+import time
+import itertools
+import threading
+
+import pytest
+
+from dayflow import transport
+from dayflow.store import Store
+
+_names = itertools.count()
+
+
+class FakeBackend(Store):
+    """Each select/upsert pops the next step: an exception to raise, a callable, or a value."""
+
+    def __init__(self, *steps):
+        self.backend = f"fake-{next(_names)}"
+        self.steps = list(steps)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            self.calls += 1
+            step = self.steps.pop(0) if len(self.steps) > 1 else self.steps[0]
+        if isinstance(step, BaseException):
+            raise step
+        return step() if callable(step) else step
+
+    def select(self, table, columns="*", *, filters=(), order=None, limit=None):
+        return self._next()
+
+    def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+        return self._next()
+
+
+def _slow(seconds, value="slow", gate=None):
+    def run():
+        if gate is not None:
+            gate.wait(10)
+        else:
+            time.sleep(seconds)
+        return value
+    return run
+
+
+def _store(inner, **kw):
+    kw.setdefault("read_retries", 2)
+    return transport.ResilientStore(inner, **kw)
+
+
+def _counters(store):
+    return transport.metrics()[store.backend]
+
+
+@pytest.fixture(autouse=True)
+def _fast_backoff(monkeypatch):
+    monkeypatch.setenv("DAYFLOW_RETRY_BASE_MS", "1")
+    monkeypatch.setenv("DAYFLOW_BREAKER_THRESHOLD", "3")
+    monkeypatch.setenv("DAYFLOW_BREAKER_COOLDOWN_S", "0.2")
+    monkeypatch.delenv("DAYFLOW_RUN_DEADLINE_S", raising=False)
+    monkeypatch.delenv("DAYFLOW_TRANSPORT_MAX_ABANDONED", raising=False)
+
+
+def test_transient_read_errors_are_retried():
+    inner = FakeBackend(ConnectionError("reset"), TimeoutError("slow"), [{"id": 1}])
+    store = _store(inner)
+    assert store.select("t") == [{"id": 1}]
+    assert inner.calls == 3
+    assert _counters(store)["retries"] == 2
+    assert store.unrecovered_errors == 0
+
+
+def test_non_transient_errors_are_raised_at_once():
+    inner = FakeBackend(ValueError("column does not exist"), [])
+    store = _store(inner)
+    with pytest.raises(ValueError):
+        store.select("t")
+    assert inner.calls == 1
+    assert store.state.breaker.state == "closed"
+
+
+def test_exhausted_retries_count_as_unrecovered_until_the_next_run():
+    store = _store(FakeBackend(ConnectionError("down")), read_retries=1)
+    with pytest.raises(ConnectionError):
+        store.select("t")
+    assert store.unrecovered_errors == 1
+    transport.start_run(store)
+    assert store.unrecovered_errors == 0
+
+
+def test_writes_are_never_retried():
+    inner = FakeBackend(ConnectionError("reset"), [{"id": 1}])
+    store = _store(inner)
+    with pytest.raises(ConnectionError):
+        store.upsert("t", [{"id": 1}], on_conflict="id")
+    assert inner.calls == 1
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    inner = FakeBackend(ConnectionError("down"), ConnectionError("down"), ConnectionError("down"), [{"id": 1}])
+    store = _store(inner, read_retries=0)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            store.select("t")
+    with pytest.raises(transport.CircuitOpenError):
+        store.select("t")
+    assert inner.calls == 3   # rejected without reaching the backend
+    time.sleep(0.25)
+    assert store.select("t") == [{"id": 1}]   # half-open probe succeeds
+    assert store.state.breaker.state == "closed"
+
+
+def test_read_deadline_raises_and_the_call_is_tracked_until_it_finishes():
+    gate = threading.Event()
+    store = _store(FakeBackend(_slow(0, gate=gate)), read_timeout=0.05, read_retries=0)
+    with pytest.raises(transport.DeadlineExceeded):
+        store.select("t")
+    assert _counters(store)["abandoned_running"] == 1
+    gate.set()
+    time.sleep(0.05)
+    assert _counters(store)["abandoned_running"] == 0
+    assert _counters(store)["abandoned"] == 1
+
+
+def test_backend_with_too_many_abandoned_calls_fails_fast(monkeypatch):
+    monkeypatch.setenv("DAYFLOW_TRANSPORT_MAX_ABANDONED", "2")
+    monkeypatch.setenv("DAYFLOW_BREAKER_THRESHOLD", "10")   # keep the breaker out of it
+    gate = threading.Event()
+    inner = FakeBackend(_slow(0, gate=gate), _slow(0, gate=gate), [{"id": 1}])
+    store = _store(inner, read_timeout=0.05, read_retries=0)
+    for _ in range(2):
+        with pytest.raises(transport.DeadlineExceeded):
+            store.select("t")
+    with pytest.raises(transport.PoolSaturated):
+        store.select("t")
+    assert inner.calls == 2
+    assert _counters(store)["rejected_saturated"] == 1
+
+    # another backend on the same pool is unaffected
+    other = _store(FakeBackend([{"id": 2}]))
+    assert other.select("t") == [{"id": 2}]
+
+    gate.set()
+    time.sleep(0.05)
+    assert store.select("t") == [{"id": 1}]
+
+
+def test_a_write_past_its_deadline_settles_instead_of_failing():
+    inner = FakeBackend(_slow(0.2, value=[{"id": 1}]))
+    store = _store(inner, write_timeout=0.05)
+    assert store.upsert("t", [{"id": 1}], on_conflict="id") == [{"id": 1}]
+    c = _counters(store)
+    assert c["slow_writes"] == 1 and c["deadline_exceeded"] == 0 and c["abandoned"] == 0
+
+
+def test_a_failing_write_past_its_deadline_raises_its_own_error():
+    def boom():
+        time.sleep(0.15)
+        raise ValueError("duplicate key")
+
+    store = _store(FakeBackend(boom), write_timeout=0.05)
+    with pytest.raises(ValueError, match="duplicate key"):
+        store.upsert("t", [{"id": 1}], on_conflict="id")
+
+
+def test_run_deadline_stops_calls_before_they_start():
+    inner = FakeBackend([{"id": 1}])
+    store = _store(inner, run_deadline=0.05)
+    store.select("t")
+    time.sleep(0.06)
+    with pytest.raises(transport.DeadlineExceeded, match="run deadline"):
+        store.select("t")
+    assert inner.calls == 1
+    transport.start_run(store)
+    assert store.select("t") == [{"id": 1}]
+
+
+def test_hedged_read_wins_over_a_slow_primary(monkeypatch):
+    monkeypatch.setenv("DAYFLOW_HEDGE_MIN_SAMPLES", "5")
+    fast = [{"id": "fast"}]
+    inner = FakeBackend(*([fast] * 5), _slow(1.0, value=[{"id": "slow"}]), fast)
+    store = _store(inner, read_timeout=2.0, hedge_reads=True)
+    for _ in range(5):
+        store.select("t")   # p95 samples
+    t0 = time.monotonic()
+    assert store.select("t") == fast
+    assert time.monotonic() - t0 < 0.5
+    c = _counters(store)
+    assert c["hedges"] == 1 and c["hedge_wins"] == 1
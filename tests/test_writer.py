@@ -0,0 +1,75 @@
+# tests/test_writer.py
+"""
+Chunked upserts (dayflow/writer.py): conflict groups stay in one chunk, the
+size bounds hold, and a failed chunk doesn't stop the others.
+
+    python -m pytest -q tests
+"""
+import pytest
+
+from dayflow.sqlite_store import SqliteStore
+from dayflow.writer import ChunkedWriter, ChunkedWriteError, chunk_rows
+
+USER = "11111111-1111-1111-1111-111111111111"
+
+
+def _row(tid, day="2025-12-10", **kw):
+    return dict(dict(user_id=USER, local_date=day, template_id=tid, title=tid), **kw)
+
+
+def _keys(chunk):
+    return [(r["template_id"], r["title"]) for r in chunk]
+
+
+def test_rows_sharing_a_conflict_key_stay_in_one_chunk_in_order():
+    rows = [_row("a"), _row("b"), _row("a", title="a2"), _row("c"), _row("b", title="b2")]
+    chunks = chunk_rows(rows, max_rows=2)
+    assert [_keys(c) for c in chunks] == [
+        [("a", "a"), ("a", "a2")],
+        [("b", "b"), ("b", "b2")],
+        [("c", "c")],
+    ]
+
+
+def test_byte_bound_and_oversized_groups():
+    big = "x" * 400
+    rows = [_row("a", notes=big), _row("b", notes=big), _row("c", notes=big)]
+    assert [len(c) for c in chunk_rows(rows, max_bytes=1200)] == [2, 1]
+    same = [_row("a", notes=big) for _ in range(5)]   # one group over both bounds: still one chunk
+    assert [len(c) for c in chunk_rows(same, max_rows=2, max_bytes=1200)] == [5]
+
+
+def test_rows_with_a_null_key_never_group():
+    rows = [_row(None), _row(None), _row(None)]
+    assert [len(c) for c in chunk_rows(rows, max_rows=1)] == [1, 1, 1]
+
+
+def test_chunked_upsert_matches_one_upsert():
+    rows = [_row(f"t{i % 7}", title=f"v{i}") for i in range(20)]
+    one, chunked = SqliteStore(":memory:"), SqliteStore(":memory:")
+    one.upsert("scheduled_tasks", rows, on_conflict="user_id,local_date,template_id")
+    writer = ChunkedWriter(max_rows=3, workers=3)
+    writer.upsert(chunked, "scheduled_tasks", rows)
+
+    def state(store):
+        return sorted((r["template_id"], r["title"]) for r in store.select("scheduled_tasks", "template_id, title"))
+
+    assert state(chunked) == state(one)
+    assert writer.metrics()["chunks"] == 7
+
+
+def test_a_failed_chunk_reports_what_the_others_wrote():
+    class Flaky(SqliteStore):
+        def upsert(self, table, rows, *, on_conflict, ignore_duplicates=False):
+            if any(r["template_id"] == "bad" for r in rows):
+                raise ConnectionError("reset")
+            return super().upsert(table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+    store = Flaky(":memory:")
+    writer = ChunkedWriter(max_rows=1, workers=2)
+    with pytest.raises(ChunkedWriteError) as err:
+        writer.upsert(store, "scheduled_tasks", [_row("a"), _row("bad"), _row("c")])
+    assert sorted(r["template_id"] for r in err.value.written) == ["a", "c"]
+    assert len(err.value.errors) == 1
+    assert writer.metrics()["failed_chunks"] == 1
+    assert len(store.select("scheduled_tasks", "id")) == 2